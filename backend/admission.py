@@ -0,0 +1,383 @@
+import os
+import math
+import time
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from logging_config import get_logger
+from metrics import ADMISSION_QUEUE_WAIT, ADMISSION_WAITING, METRICS_ENABLED, record_admission
+
+logger = get_logger("admission")
+
+# Admission control for the chat and refiner endpoints (per worker process;
+# overridable through environment variables). A rate of 0 disables that bucket.
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+ADMISSION_USER_RATE = float(os.getenv("ADMISSION_USER_RATE", "1"))         # requests/second per user
+ADMISSION_USER_BURST = float(os.getenv("ADMISSION_USER_BURST", "10"))
+ADMISSION_GLOBAL_RATE = float(os.getenv("ADMISSION_GLOBAL_RATE", "50"))    # requests/second per worker
+ADMISSION_GLOBAL_BURST = float(os.getenv("ADMISSION_GLOBAL_BURST", "100"))
+# Requests served at once; the rest wait in per-user queues served round-robin
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "64"))
+# Slots only interactive (simple-query) requests may use, and they are queued first
+ADMISSION_INTERACTIVE_RESERVED = int(os.getenv("ADMISSION_INTERACTIVE_RESERVED", "8"))
+ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", "256"))
+ADMISSION_USER_MAX_WAITING = int(os.getenv("ADMISSION_USER_MAX_WAITING", "4"))
+# Queue-time budget: requests expected to wait longer are shed instead of queued
+ADMISSION_MAX_QUEUE_MS = float(os.getenv("ADMISSION_MAX_QUEUE_MS", "3000"))
+ADMISSION_MAX_TRACKED_USERS = int(os.getenv("ADMISSION_MAX_TRACKED_USERS", "10000"))
+# Callers are told apart by client IP: the user_id in request bodies is client-supplied
+# and the frontend sends shared placeholders. Set to true once user ids are authenticated;
+# placeholder ids are still ignored then.
+ADMISSION_TRUST_USER_ID = os.getenv("ADMISSION_TRUST_USER_ID", "false").lower() in ("1", "true", "yes")
+ADMISSION_PLACEHOLDER_USER_IDS = frozenset(
+    value.strip().lower()
+    for value in os.getenv(
+        "ADMISSION_PLACEHOLDER_USER_IDS", "anonymous,default_user,guest,user,null,undefined,none"
+    ).split(",")
+    if value.strip()
+)
+
+# Smoothing factor of the request service-time average used to predict queue waits
+_SERVICE_TIME_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """A request was not admitted; clients should retry after ``retry_after`` seconds."""
+
+    status_code = 503
+
+    def __init__(self, message: str, reason: str, retry_after: float):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(min(self.retry_after, 3600))))
+
+
+class RateLimitedError(AdmissionRejected):
+    """The caller exceeded its own rate or queue share (HTTP 429)."""
+
+    status_code = 429
+
+
+class OverloadedError(AdmissionRejected):
+    """The worker is saturated and shed the request (HTTP 503)."""
+
+    status_code = 503
+
+
+def admission_identity(client_host: Optional[str], user_id: Optional[str] = None) -> str:
+    """
+    Key of a caller's rate-limit bucket and waiter queue.
+
+    Args:
+        client_host: Client IP address as seen by the server
+        user_id: User id sent by the client, used only with ADMISSION_TRUST_USER_ID
+            and never when it is a shared placeholder such as 'anonymous'
+    """
+    if ADMISSION_TRUST_USER_ID and user_id and user_id.strip().lower() not in ADMISSION_PLACEHOLDER_USER_IDS:
+        return f"user:{user_id}"
+    return f"ip:{client_host or 'unknown'}"
+
+
+class TokenBucket:
+    """
+    Holds up to ``burst`` tokens, refilled at ``rate`` tokens per second.
+
+    A cost above the burst is taken from a full bucket and leaves it in debt,
+    so large requests (batches) are admitted but delay the caller's next ones.
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = now
+
+    def try_take(self, now: float, cost: float = 1.0) -> float:
+        """
+        Take ``cost`` tokens if available.
+
+        Returns:
+            0.0 on success, otherwise the seconds until enough tokens accrue
+        """
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        needed = min(cost, self.burst)
+        if self.tokens >= needed:
+            self.tokens -= cost
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def refund(self, cost: float = 1.0) -> None:
+        self.tokens = min(self.burst, self.tokens + cost)
+
+
+class AdmissionTicket:
+    """A serving slot held by one admitted request; release() is idempotent."""
+
+    def __init__(self, controller: Optional["AdmissionController"], user: str):
+        self._controller = controller
+        self.user = user
+        self.started = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        if self._controller is not None:
+            self._controller._release(self)
+
+
+class AdmissionController:
+    """
+    Token-bucket rate limiting, fair queueing and load shedding.
+
+    Every request first takes a token (a batch one per unique item) from its
+    user's bucket (429 when empty) and from the worker-wide bucket (503 when
+    empty). It then needs
+    one of ``max_concurrent`` serving slots, ``interactive_reserved`` of
+    which only interactive (simple-query) requests may use. While slots are
+    busy, waiting requests sit in per-user queues; freed slots go to
+    interactive requests first, then to users round-robin, so neither
+    refinement bursts nor one heavy user can starve the others. A request is
+    shed with 503 when the queue is full, when the predicted wait
+    (queue length x average service time / slots) exceeds the queue-time
+    budget, or when it actually waits longer than that budget.
+    """
+
+    def __init__(
+        self,
+        user_rate: float = ADMISSION_USER_RATE,
+        user_burst: float = ADMISSION_USER_BURST,
+        global_rate: float = ADMISSION_GLOBAL_RATE,
+        global_burst: float = ADMISSION_GLOBAL_BURST,
+        max_concurrent: int = ADMISSION_MAX_CONCURRENT,
+        interactive_reserved: int = ADMISSION_INTERACTIVE_RESERVED,
+        max_waiting: int = ADMISSION_MAX_WAITING,
+        user_max_waiting: int = ADMISSION_USER_MAX_WAITING,
+        max_queue_ms: float = ADMISSION_MAX_QUEUE_MS,
+        max_tracked_users: int = ADMISSION_MAX_TRACKED_USERS,
+        enabled: bool = ADMISSION_ENABLED,
+    ):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_concurrent = max(1, max_concurrent)
+        self.interactive_reserved = min(max(0, interactive_reserved), self.max_concurrent - 1)
+        self.max_waiting = max_waiting
+        self.user_max_waiting = max(1, user_max_waiting)
+        self.max_queue_seconds = max_queue_ms / 1000
+        self.max_tracked_users = max_tracked_users
+        self.enabled = enabled
+
+        self._user_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._global_bucket = (
+            TokenBucket(global_rate, global_burst, time.monotonic()) if global_rate > 0 else None
+        )
+        # Per-user waiter queues of interactive (True) and other (False) requests
+        self._waiters: Dict[bool, "OrderedDict[str, Deque[asyncio.Future]]"] = {True: OrderedDict(), False: OrderedDict()}
+        self._class_waiting = {True: 0, False: 0}
+        self._service_seconds: Optional[float] = None
+
+        self.active = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.outcomes: Dict[str, int] = {}
+
+        if METRICS_ENABLED:
+            ADMISSION_WAITING.set_function(lambda: self.waiting)
+
+    # ---------------------------------------------------------------- admission
+
+    async def acquire(self, user: str, interactive: bool = False, cost: float = 1.0) -> AdmissionTicket:
+        """
+        Admit a request from ``user`` and return its serving slot.
+
+        Args:
+            user: Caller identity for rate limiting and fair queueing
+            interactive: Cheap interactive request that may use reserved slots
+            cost: Tokens taken from the user and global buckets (e.g. unique batch items)
+
+        Raises:
+            RateLimitedError: The user is over its rate or queue share
+            OverloadedError: The worker is over its rate or the request was shed
+        """
+        if not self.enabled:
+            return AdmissionTicket(None, user)
+        enqueued_at = time.monotonic()
+        self._take_tokens(user, enqueued_at, cost)
+
+        if self._can_start(interactive) and not self._queued_ahead(interactive):
+            self.active += 1
+            return self._admitted(user, 0.0)
+
+        if self.waiting >= self.max_waiting:
+            self._shed("queue_full", self.max_queue_seconds)
+        waiters = self._waiters[interactive]
+        queue = waiters.get(user)
+        if queue is not None and len(queue) >= self.user_max_waiting:
+            self._reject(RateLimitedError("Too many queued requests for this user", "user_queue", self.max_queue_seconds))
+        predicted = self._predicted_wait(interactive)
+        if predicted > self.max_queue_seconds:
+            self._shed("predicted_wait", predicted)
+
+        future = asyncio.get_running_loop().create_future()
+        if queue is None:
+            queue = waiters[user] = deque()
+        queue.append(future)
+        self.waiting += 1
+        self._class_waiting[interactive] += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        try:
+            await asyncio.wait_for(future, timeout=self.max_queue_seconds)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we gave up; pass it on
+                self._release_slot()
+            else:
+                self._discard_waiter(interactive, user, future)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._shed("queue_timeout", self.max_queue_seconds)
+        # A slot handed over by _release_slot is already counted in self.active
+        return self._admitted(user, time.monotonic() - enqueued_at)
+
+    @asynccontextmanager
+    async def admit(self, user: str, interactive: bool = False, cost: float = 1.0) -> AsyncIterator[AdmissionTicket]:
+        """Hold a serving slot for the duration of the block."""
+        ticket = await self.acquire(user, interactive, cost)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def _take_tokens(self, user: str, now: float, cost: float = 1.0) -> None:
+        user_bucket = None
+        if self.user_rate > 0:
+            user_bucket = self._user_bucket(user, now)
+            wait = user_bucket.try_take(now, cost)
+            if wait:
+                self._reject(RateLimitedError("Too many requests for this user", "user_rate", wait))
+        if self._global_bucket is not None:
+            wait = self._global_bucket.try_take(now, cost)
+            if wait:
+                if user_bucket is not None:
+                    user_bucket.refund(cost)
+                self._reject(OverloadedError("Service request rate limit reached", "global_rate", wait))
+
+    def _user_bucket(self, user: str, now: float) -> TokenBucket:
+        bucket = self._user_buckets.get(user)
+        if bucket is None:
+            bucket = self._user_buckets[user] = TokenBucket(self.user_rate, self.user_burst, now)
+            if len(self._user_buckets) > self.max_tracked_users:
+                self._user_buckets.popitem(last=False)
+        else:
+            self._user_buckets.move_to_end(user)
+        return bucket
+
+    def _can_start(self, interactive: bool) -> bool:
+        limit = self.max_concurrent if interactive else self.max_concurrent - self.interactive_reserved
+        return self.active < limit
+
+    def _queued_ahead(self, interactive: bool) -> int:
+        """Waiting requests that would be served before a new one of this class."""
+        return self._class_waiting[True] if interactive else self.waiting
+
+    def _predicted_wait(self, interactive: bool) -> float:
+        if self._service_seconds is None:
+            return 0.0
+        return (self._queued_ahead(interactive) + 1) / self.max_concurrent * self._service_seconds
+
+    def _admitted(self, user: str, waited: float) -> AdmissionTicket:
+        self._count("admitted", "queued" if waited else "immediate")
+        if METRICS_ENABLED:
+            ADMISSION_QUEUE_WAIT.observe(waited)
+        return AdmissionTicket(self, user)
+
+    def _shed(self, reason: str, retry_after: float) -> None:
+        self._reject(OverloadedError("Service is busy", reason, retry_after))
+
+    def _reject(self, error: AdmissionRejected) -> None:
+        decision = "throttled" if isinstance(error, RateLimitedError) or error.reason == "global_rate" else "shed"
+        self._count(decision, error.reason)
+        logger.info(
+            "Request not admitted",
+            extra={"decision": decision, "reason": error.reason, "active": self.active, "waiting": self.waiting}
+        )
+        raise error
+
+    def _count(self, decision: str, reason: str) -> None:
+        key = f"{decision}:{reason}"
+        self.outcomes[key] = self.outcomes.get(key, 0) + 1
+        record_admission(decision, reason)
+
+    # ------------------------------------------------------------------ release
+
+    def _release(self, ticket: AdmissionTicket) -> None:
+        seconds = time.monotonic() - ticket.started
+        if self._service_seconds is None:
+            self._service_seconds = seconds
+        else:
+            self._service_seconds += _SERVICE_TIME_ALPHA * (seconds - self._service_seconds)
+        self._release_slot()
+
+    def _release_slot(self) -> None:
+        """Free a slot and hand free slots to waiters: interactive first, users round-robin."""
+        self.active -= 1
+        for interactive in (True, False):
+            waiters = self._waiters[interactive]
+            while waiters and self._can_start(interactive):
+                user, queue = next(iter(waiters.items()))
+                future = queue.popleft()
+                if queue:
+                    waiters.move_to_end(user)
+                else:
+                    del waiters[user]
+                self.waiting -= 1
+                self._class_waiting[interactive] -= 1
+                if not future.done():
+                    self.active += 1
+                    future.set_result(None)
+
+    def _discard_waiter(self, interactive: bool, user: str, future: asyncio.Future) -> None:
+        waiters = self._waiters[interactive]
+        queue = waiters.get(user)
+        if queue is None or future not in queue:
+            return
+        queue.remove(future)
+        self.waiting -= 1
+        self._class_waiting[interactive] -= 1
+        if not queue:
+            del waiters[user]
+
+    def _total(self, decision: str) -> int:
+        return sum(count for key, count in self.outcomes.items() if key.startswith(decision + ":"))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "active": self.active,
+            "max_concurrent": self.max_concurrent,
+            "interactive_reserved": self.interactive_reserved,
+            "waiting": self.waiting,
+            "waiting_interactive": self._class_waiting[True],
+            "waiting_users": len(set(self._waiters[True]) | set(self._waiters[False])),
+            "peak_waiting": self.peak_waiting,
+            "tracked_users": len(self._user_buckets),
+            "avg_service_ms": round(self._service_seconds * 1000, 2) if self._service_seconds is not None else None,
+            "admitted": self._total("admitted"),
+            "throttled": self._total("throttled"),
+            "shed": self._total("shed"),
+            "outcomes": dict(self.outcomes),
+        }
+
+
+admission_controller = AdmissionController()
@@ -0,0 +1,145 @@
+"""
+Shared helpers for benchmark baselines.
+
+A baseline is a JSON file in benchmarks/baselines/ holding the results of one
+benchmark as {case: {metric: value}} plus the environment it was recorded
+on. Benchmarks save one with --save-baseline and compare against it with
+--check, which exits non-zero when any metric regressed by more than the
+tolerance. Metric names carry their direction: throughput ('_rps', '_per_s')
+is better when higher, everything else (latency, memory, errors) when lower.
+"""
+import os
+import sys
+import json
+import platform
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+Results = Dict[str, Dict[str, float]]
+
+_HIGHER_IS_BETTER = ("_rps", "_per_s")
+# Metrics below this absolute change are noise, whatever their relative change
+_MIN_ABSOLUTE_CHANGE = {"_ms": 1.0, "_us": 0.05, "_mb": 2.0, "errors": 0.5}
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def baseline_path(name: str) -> str:
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def save_baseline(name: str, results: Results, settings: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Store ``results`` in the baseline ``name``; returns the file path.
+
+    Cases not in ``results`` keep their stored values, so a partial run
+    (a filter or a subset of scenarios) only replaces what it measured.
+    """
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = baseline_path(name)
+    merged = dict((load_baseline(name) or {}).get("results", {}))
+    for case, metrics in results.items():
+        merged[case] = {metric: round(value, 3) for metric, value in metrics.items()}
+    payload = {
+        "benchmark": name,
+        "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": environment(),
+        "settings": settings or {},
+        "results": merged,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
+        f.write("\n")
+    return path
+
+
+def load_baseline(name: str) -> Optional[Dict[str, Any]]:
+    path = baseline_path(name)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _higher_is_better(metric: str) -> bool:
+    return metric.endswith(_HIGHER_IS_BETTER)
+
+
+def _min_absolute_change(metric: str) -> float:
+    for suffix, threshold in _MIN_ABSOLUTE_CHANGE.items():
+        if metric.endswith(suffix):
+            return threshold
+    return 0.0
+
+
+def compare(results: Results, baseline: Results, tolerance: float) -> List[Tuple[str, str, float, float, float, bool]]:
+    """
+    Compare results with a baseline.
+
+    Returns:
+        (case, metric, baseline, current, relative change, regressed) rows for
+        every metric present in both; the change is signed so that positive
+        always means worse
+    """
+    rows = []
+    for case, metrics in results.items():
+        for metric, current in metrics.items():
+            previous = baseline.get(case, {}).get(metric)
+            if previous is None:
+                continue
+            delta = previous - current if _higher_is_better(metric) else current - previous
+            change = delta / previous if previous else (0.0 if delta <= 0 else float("inf"))
+            regressed = change > tolerance and delta > _min_absolute_change(metric)
+            rows.append((case, metric, previous, current, change, regressed))
+    return rows
+
+
+def report_comparison(name: str, results: Results, tolerance: float) -> bool:
+    """
+    Print the comparison with the stored baseline ``name``.
+
+    Returns:
+        True when no metric regressed beyond ``tolerance`` (or no baseline exists)
+    """
+    stored = load_baseline(name)
+    if stored is None:
+        print(f"\nNo baseline '{name}' yet; record one with --save-baseline.")
+        return True
+    if stored.get("environment", {}).get("machine") != platform.machine():
+        print(f"\nNote: baseline '{name}' was recorded on a different machine type.")
+
+    rows = compare(results, stored["results"], tolerance)
+    print(f"\nCompared with baseline '{name}' ({stored.get('recorded_at', '?')}), tolerance {tolerance:.0%}:")
+    print(f"{'case':<28}{'metric':<18}{'baseline':>12}{'current':>12}{'change':>10}")
+    for case, metric, previous, current, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{case:<28}{metric:<18}{previous:>12.2f}{current:>12.2f}{change:>+10.1%}{flag}")
+    regressions = sum(1 for row in rows if row[-1])
+    print(f"{regressions} regression(s)")
+    return regressions == 0
+
+
+def finish(name: str, results: Results, args: Any, settings: Optional[Dict[str, Any]] = None) -> None:
+    """Handle the shared --save-baseline / --check options and exit accordingly."""
+    ok = report_comparison(name, results, args.tolerance)
+    if args.save_baseline:
+        print(f"Baseline saved to {save_baseline(name, results, settings)}")
+    elif args.check and not ok:
+        sys.exit(1)
+
+
+def add_baseline_arguments(parser: Any, tolerance: float) -> None:
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 if any metric regressed")
+    parser.add_argument("--tolerance", type=float, default=tolerance,
+                        help=f"allowed relative regression before --check fails (default {tolerance})")
@@ -0,0 +1,264 @@
+"""
+Load test: the whole API served in-process against the deterministic fake LLM.
+
+Virtual users call main.app through httpx's ASGI transport (no sockets, no
+network) in a closed loop, after a warm-up period:
+  simple      - short questions answered directly by the LLM
+  smalltalk   - greetings answered locally without the LLM
+  refinement  - a learning request, then /refiner/continue until the final package
+  mixed       - 20% small talk, 50% simple questions, 30% refinement flows
+
+The fake provider draws each call's latency from a seeded lognormal
+distribution whose per-stage medians come from the profile ('realistic', or
+'zero' to measure pure server overhead). Response, semantic and
+precomputed caches are off and every query is unique, so each request runs
+the full pipeline. Admission control stays on with limits above the
+offered load.
+
+Every scenario runs in a fresh interpreter, so memory figures belong to
+that scenario. Reported per scenario: request throughput, errors, p50/p95/p99
+latency per request kind (chat, continue, and whole refinement flows), and
+peak and growth of resident memory.
+
+Usage (from backend/):
+    python benchmarks/bench_load.py [--scenarios simple,refinement] [--profile realistic|zero]
+        [--concurrency 32] [--duration 10] [--warmup 2] [--save-baseline | --check]
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
+import subprocess
+from typing import Any, Dict, Optional, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+SCENARIOS = ("simple", "smalltalk", "refinement", "mixed")
+
+# Median fake LLM latency per stage, in milliseconds
+PROFILES = {
+    "realistic": {"CLASSROOM_DIRECT": 400, "REFINE": 700, "CONTINUE": 900, "FINALIZE": 900},
+    "zero": {"CLASSROOM_DIRECT": 0, "REFINE": 0, "CONTINUE": 0, "FINALIZE": 0},
+}
+
+# Single-word concepts keep "what is <concept> <n>" classified as a simple question
+CONCEPTS = [
+    "recursion", "photosynthesis", "entropy", "osmosis", "momentum",
+    "inflation", "democracy", "isotopes", "probability", "polymorphism",
+]
+TOPICS = [
+    "recursion", "photosynthesis", "linear algebra", "organic chemistry", "the french revolution",
+    "binary search trees", "thermodynamics", "probability", "cell division", "machine learning",
+]
+GREETINGS = ["hi", "hello there", "thanks so much", "good morning", "how are you?"]
+ANSWERS = ["Beginner", "Mostly projects", "For my exams", "About an hour a day"]
+
+
+def configure(profile: str) -> None:
+    """Environment for the child process; variables already set take precedence."""
+    defaults = {
+        "LLM_PROVIDER": "fake",
+        "LOG_LEVEL": "ERROR",
+        "LLM_PREWARM": "false",
+        "FAKE_LLM_LATENCY_DISTRIBUTION": "lognormal",
+        "FAKE_LLM_LATENCY_SIGMA": "0.5",
+        "LLM_CACHE_ENABLED": "false",
+        "SEMANTIC_CACHE_ENABLED": "false",
+        "REFINEMENT_TABLE_ENABLED": "false",
+        "ADMISSION_USER_RATE": "100000",
+        "ADMISSION_USER_BURST": "100000",
+        "ADMISSION_GLOBAL_RATE": "100000",
+        "ADMISSION_GLOBAL_BURST": "100000",
+    }
+    defaults.update({f"FAKE_LLM_LATENCY_MS_{stage}": str(ms) for stage, ms in PROFILES[profile].items()})
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+
+
+def memory_mb() -> Tuple[float, float]:
+    """(current, peak) resident set size of this process in MiB."""
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KiB on Linux
+    try:
+        with open("/proc/self/statm") as f:
+            current_mb = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        current_mb = peak_mb
+    return current_mb, peak_mb
+
+
+class LoadRun:
+    """Closed-loop virtual users for one scenario, recording samples while measuring."""
+
+    def __init__(self, client: Any, scenario: str, seed: int):
+        from latency import LatencyTracker
+
+        self.client = client
+        self.scenario = scenario
+        self.random = random.Random(seed)
+        self.counter = itertools.count()
+        self.measuring = False
+        self.stopping = False
+        self.trackers = {kind: LatencyTracker(kind, window_size=1_000_000) for kind in ("chat", "continue", "flow")}
+        self.requests = 0
+        self.errors: Dict[str, int] = {}
+
+    async def _post(self, kind: str, path: str, body: Dict[str, Any], record: bool) -> Optional[Dict[str, Any]]:
+        started = time.perf_counter()
+        try:
+            response = await self.client.post(path, json=body)
+            status = str(response.status_code)
+        except Exception as e:
+            response, status = None, type(e).__name__
+        if record:
+            self.requests += 1
+            if status == "200":
+                self.trackers[kind].record(time.perf_counter() - started)
+            else:
+                self.errors[status] = self.errors.get(status, 0) + 1
+        return response.json() if status == "200" else None
+
+    async def _chat(self, user_id: str, message: str, record: bool) -> Optional[Dict[str, Any]]:
+        return await self._post("chat", "/api/v1/classroom/chat", {"user_message": message, "user_id": user_id}, record)
+
+    async def _refinement_flow(self, user_id: str, record: bool) -> None:
+        started = time.perf_counter()
+        topic = self.random.choice(TOPICS)
+        data = await self._chat(user_id, f"I want to learn {topic} for my exams, plan {next(self.counter)}", record)
+        refinement = (data or {}).get("refinement_data") or {}
+        for _ in range(3):
+            if not refinement.get("needs_refinement") or not refinement.get("session_id"):
+                break
+            answers = [{"question_id": s["question_id"], "answer": self.random.choice(ANSWERS)} for s in refinement["suggestions"]]
+            refinement = await self._post("continue", "/api/v1/refiner/continue", {
+                "session_id": refinement["session_id"], "answers": answers, "user_id": user_id
+            }, record) or {}
+        if record and data is not None:
+            self.trackers["flow"].record(time.perf_counter() - started)
+
+    async def _iteration(self, user_id: str) -> None:
+        record = self.measuring
+        kind = self.scenario
+        if kind == "mixed":
+            kind = self.random.choices(["smalltalk", "simple", "refinement"], weights=[20, 50, 30])[0]
+        if kind == "smalltalk":
+            await self._chat(user_id, self.random.choice(GREETINGS), record)
+        elif kind == "simple":
+            await self._chat(user_id, f"what is {self.random.choice(CONCEPTS)} {next(self.counter)}", record)
+        else:
+            await self._refinement_flow(user_id, record)
+
+    async def _user(self, index: int) -> None:
+        user_id = f"bench-{index}"
+        while not self.stopping:
+            await self._iteration(user_id)
+
+    async def run(self, concurrency: int, warmup: float, duration: float) -> Dict[str, float]:
+        users = [asyncio.create_task(self._user(i)) for i in range(concurrency)]
+        await asyncio.sleep(warmup)
+        rss_start, _ = memory_mb()
+        self.measuring = True
+        started = time.perf_counter()
+        await asyncio.sleep(duration)
+        self.measuring = False
+        elapsed = time.perf_counter() - started
+        self.stopping = True
+        await asyncio.gather(*users)
+        rss_end, rss_peak = memory_mb()
+
+        result = {
+            "throughput_rps": self.requests / elapsed,
+            "requests": float(self.requests),
+            "errors": float(sum(self.errors.values())),
+            "rss_peak_mb": rss_peak,
+            "rss_growth_mb": rss_end - rss_start,
+        }
+        for kind, tracker in self.trackers.items():
+            if tracker.count:
+                stats = tracker.stats()
+                for q in ("p50", "p95", "p99"):
+                    result[f"{kind}_{q}_ms"] = stats[f"{q}_ms"]
+        return result
+
+
+async def run_scenario(scenario: str, concurrency: int, warmup: float, duration: float, seed: int) -> Dict[str, float]:
+    import httpx
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            return await LoadRun(client, scenario, seed).run(concurrency, warmup, duration)
+
+
+def run_child(args: argparse.Namespace, scenario: str) -> Dict[str, float]:
+    """Run one scenario in a fresh interpreter and return its results."""
+    command = [
+        sys.executable, os.path.abspath(__file__), "--child", scenario, "--profile", args.profile,
+        "--concurrency", str(args.concurrency), "--duration", str(args.duration),
+        "--warmup", str(args.warmup), "--seed", str(args.seed),
+    ]
+    result = subprocess.run(command, cwd=BACKEND_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Scenario {scenario} failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def print_results(results: Dict[str, Dict[str, float]]) -> None:
+    print(f"{'scenario':<12}{'req/s':>9}{'errors':>8}{'kind':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'peak MiB':>10}{'growth':>9}")
+    for scenario, result in results.items():
+        kinds = [kind for kind in ("chat", "continue", "flow") if f"{kind}_p50_ms" in result]
+        for i, kind in enumerate(kinds or ["-"]):
+            head = (
+                f"{scenario:<12}{result['throughput_rps']:>9.1f}{int(result['errors']):>8}"
+                if i == 0 else " " * 29
+            )
+            latencies = "".join(f"{result.get(f'{kind}_{q}_ms', 0):>10.1f}" for q in ("p50", "p95", "p99"))
+            tail = f"{result['rss_peak_mb']:>10.1f}{result['rss_growth_mb']:>+9.1f}" if i == 0 else ""
+            print(f"{head}{kind:>10}{latencies}{tail}")
+
+
+def main() -> None:
+    from baseline import add_baseline_arguments, finish
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--profile", default="realistic", choices=sorted(PROFILES))
+    parser.add_argument("--concurrency", type=int, default=32, help="virtual users")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds before measuring")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--child", choices=SCENARIOS, help=argparse.SUPPRESS)
+    add_baseline_arguments(parser, tolerance=0.25)
+    args = parser.parse_args()
+
+    if args.child:
+        configure(args.profile)
+        result = asyncio.run(run_scenario(args.child, args.concurrency, args.warmup, args.duration, args.seed))
+        print(json.dumps(result))
+        return
+
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    results = {scenario: run_child(args, scenario) for scenario in scenarios}
+    print_results(results)
+    # Raw request counts depend on the run length; baselines keep rates and latencies
+    for result in results.values():
+        result.pop("requests", None)
+    finish(f"load-{args.profile}", results, args, settings={
+        "concurrency": args.concurrency, "duration": args.duration, "warmup": args.warmup, "seed": args.seed
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Micro-benchmarks: CPU cost of the per-request pipeline steps.
+
+  classify      - classify_query over a mix of greetings, questions and learning requests
+  extract_json  - extract_json_from_text on clean, fenced and prose-wrapped LLM output
+  parse         - parse_llm_output into the refine-stage schema
+  prompt        - direct, refine and continue prompt assembly
+  model         - response model construction for direct, refinement and final payloads
+
+Each case reports the best and median time per call over several repeats.
+No LLM or network is involved.
+
+Usage (from backend/):
+    python benchmarks/bench_micro.py [--repeat 7] [--save-baseline | --check]
+"""
+import os
+import sys
+import json
+import timeit
+import argparse
+import statistics
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LLM_PROVIDER", "fake")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+from baseline import Results, add_baseline_arguments, finish
+from bench_serialization import final_package_payload, refinement_payload
+from classroom import _build_direct_prompt, classify_query, format_direct_response
+from models import ClassroomChatResponse, ContinueRefinementResponse, RefinementDraft
+from refiner_agent import _build_continue_prompt, _build_refine_prompt, extract_json_from_text, parse_llm_output
+
+QUERIES = [
+    "hi",
+    "thanks a lot!",
+    "what is a prime number",
+    "How does photosynthesis work in plants and why is it important?",
+    "I want to learn data structures and algorithms for placement exams",
+    "Can you explain recursion with an example?",
+    "help me with my physics assignment on projectile motion",
+    "Why is the sky blue during the day but red at sunset?",
+]
+
+REFINEMENT_JSON = json.dumps({
+    "category": "academic",
+    "needs_refinement": True,
+    "suggestions": [
+        {"text": "Are you a beginner or do you already have some experience?", "adds": "skill level"},
+        {"text": "Do you prefer theory, projects, or both?", "adds": "learning format"},
+        {"text": "What is your goal - exams, a job, or curiosity?", "adds": "purpose"},
+    ],
+    "refined_query_preview": "Personalized learning path based on the student's level and goal",
+    "reasoning": "The query is broad; a few details will personalize the learning path.",
+})
+LLM_OUTPUTS = {
+    "clean": REFINEMENT_JSON,
+    "fenced": f"```json\n{REFINEMENT_JSON}\n```",
+    "prose": f"Sure! Here is the analysis you asked for:\n\n{REFINEMENT_JSON}\n\nLet me know if you need more.",
+}
+
+HISTORY = [
+    {"role": "user" if i % 2 == 0 else "assistant", "content": f"Message {i} about sorting algorithms and their complexity."}
+    for i in range(8)
+]
+TURNS = [
+    {"question_id": "q_1", "question": "Are you a beginner or already familiar with programming?", "answer": "Beginner, some Python"},
+    {"question_id": "q_2", "question": "Do you want theory, projects, or both?", "answer": "Both, mostly projects"},
+    {"question_id": "q_3", "question": "What is your ultimate goal - job, research, or curiosity?", "answer": "A data science job"},
+]
+
+
+def _classify_all() -> None:
+    for query in QUERIES:
+        classify_query(query)
+
+
+def cases() -> List[Tuple[str, Callable[[], Any], int]]:
+    """(name, function, operations per call) for every micro-benchmark."""
+    direct = format_direct_response("Recursion is when a function calls itself on a smaller input.", "gemini-2.0-flash-001")
+    refinement = refinement_payload()
+    final = final_package_payload()
+    return [
+        ("classify", _classify_all, len(QUERIES)),
+        *[(f"extract_json.{name}", (lambda text=text: extract_json_from_text(text)), 1) for name, text in LLM_OUTPUTS.items()],
+        ("parse.refinement", lambda: parse_llm_output(LLM_OUTPUTS["fenced"], RefinementDraft), 1),
+        ("prompt.direct", lambda: _build_direct_prompt(QUERIES[5], HISTORY), 1),
+        ("prompt.refine", lambda: _build_refine_prompt(QUERIES[4]), 1),
+        ("prompt.continue", lambda: _build_continue_prompt(QUERIES[4], TURNS, 1, combined=True), 1),
+        ("model.direct", lambda: ClassroomChatResponse(**direct), 1),
+        ("model.refinement", lambda: ClassroomChatResponse(**refinement), 1),
+        ("model.final_package", lambda: ContinueRefinementResponse(**final), 1),
+    ]
+
+
+def measure(fn: Callable[[], Any], operations: int, repeat: int) -> Dict[str, float]:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()  # calls per repeat so one repeat takes at least 0.2 s
+    per_call = [seconds / number / operations for seconds in timer.repeat(repeat=repeat, number=number)]
+    return {"best_us": min(per_call) * 1e6, "median_us": statistics.median(per_call) * 1e6}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this text")
+    add_baseline_arguments(parser, tolerance=0.3)
+    args = parser.parse_args()
+
+    results: Results = {}
+    print(f"{'case':<28}{'best us':>12}{'median us':>12}")
+    for name, fn, operations in cases():
+        if args.filter not in name:
+            continue
+        results[name] = measure(fn, operations, args.repeat)
+        print(f"{name:<28}{results[name]['best_us']:>12.2f}{results[name]['median_us']:>12.2f}")
+
+    finish("micro", results, args, settings={"repeat": args.repeat})
+
+
+if __name__ == "__main__":
+    main()
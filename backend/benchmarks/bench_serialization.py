@@ -0,0 +1,135 @@
+"""
+Micro-benchmark: per-response CPU cost of the API serialization paths.
+
+Compares, for typical refinement and final-package payloads:
+  default - build the model, then FastAPI's response_model re-validation and
+            jsonable_encoder, rendered with the stdlib JSONResponse
+  orjson  - the same FastAPI path rendered with ORJSONResponse
+  fast    - build the model once and render it with responses.ModelResponse
+
+Usage (from backend/):
+    python benchmarks/bench_serialization.py [--iterations 20000]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from models import ClassroomChatResponse, ContinueRefinementResponse
+from responses import ModelResponse
+
+
+def refinement_payload() -> Dict[str, Any]:
+    """A first-round refinement response as returned by generate_classroom_response."""
+    return {
+        "response_type": "refinement_needed",
+        "refinement_data": {
+            "needs_refinement": True,
+            "suggestions": [
+                {"question_id": "q_1", "text": "Are you a beginner or already familiar with programming?", "adds": "skill level"},
+                {"question_id": "q_2", "text": "Do you want theory, projects, or both?", "adds": "learning format"},
+                {"question_id": "q_3", "text": "What is your ultimate goal - job, research, or curiosity?", "adds": "purpose"},
+            ],
+            "reasoning": "The user's query is broad; refining it helps personalize the learning path.",
+            "original_query": "I want to learn Machine Learning",
+            "session_id": "5f0c2a9e8b7d4c3a9e1f2b3c4d5e6f70",
+        },
+        "timestamp": datetime.utcnow(),
+        "success": True,
+    }
+
+
+def final_package_payload() -> Dict[str, Any]:
+    """A completed refinement as returned by continue_refinement."""
+    return {
+        "needs_refinement": False,
+        "suggestions": [],
+        "reasoning": "",
+        "original_query": "I want to learn Machine Learning",
+        "final_package": {
+            "original_query": "I want to learn Machine Learning",
+            "refined_query": "Beginner-friendly Machine Learning roadmap with theory and projects for job preparation",
+            "conversation_history": [
+                {"question_id": "q_1", "question": "Are you a beginner or already familiar with programming?", "answer": "Beginner, some Python"},
+                {"question_id": "q_2", "question": "Do you want theory, projects, or both?", "answer": "Both, mostly projects"},
+                {"question_id": "q_3", "question": "What is your ultimate goal - job, research, or curiosity?", "answer": "A data science job"},
+            ],
+            "requirements": ["beginner level", "project-based", "job preparation", "Python"],
+            "reasoning": "The query is broad. Enough context has been gathered.",
+            "refinement_rounds": 1,
+            "confidence": 0.87,
+            "tags": ["non-academic", "machine learning", "career"],
+            "timestamp": datetime.now().isoformat(),
+        },
+    }
+
+
+def _fastapi_path(model_cls, payload: Dict[str, Any], response_class) -> Callable[[], Any]:
+    field = create_response_field(name="response", type_=model_cls)
+
+    async def run() -> bytes:
+        model = model_cls(**payload)
+        content = await serialize_response(field=field, response_content=model)
+        return response_class(content=content).body
+
+    return run
+
+
+def _fast_path(model_cls, payload: Dict[str, Any]) -> Callable[[], Any]:
+    async def run() -> bytes:
+        return ModelResponse(content=model_cls(**payload)).body
+
+    return run
+
+
+async def _time(fn: Callable[[], Any], iterations: int) -> float:
+    for _ in range(min(1000, iterations)):  # warm up
+        await fn()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await fn()
+    return (time.perf_counter() - started) / iterations
+
+
+async def run_benchmarks(iterations: int) -> List[Tuple[str, str, float]]:
+    cases = [
+        ("refinement", ClassroomChatResponse, refinement_payload()),
+        ("final_package", ContinueRefinementResponse, final_package_payload()),
+    ]
+    results = []
+    for name, model_cls, payload in cases:
+        paths = {
+            "default": _fastapi_path(model_cls, payload, JSONResponse),
+            "orjson": _fastapi_path(model_cls, payload, ORJSONResponse),
+            "fast": _fast_path(model_cls, payload),
+        }
+        for path, fn in paths.items():
+            results.append((name, path, await _time(fn, iterations)))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmarks(args.iterations))
+    baseline = {name: seconds for name, path, seconds in results if path == "default"}
+
+    print(f"{'payload':<15}{'path':<10}{'us/response':>14}{'saved us':>12}{'speedup':>10}")
+    for name, path, seconds in results:
+        saved = baseline[name] - seconds
+        print(f"{name:<15}{path:<10}{seconds * 1e6:>14.2f}{saved * 1e6:>12.2f}{baseline[name] / seconds:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
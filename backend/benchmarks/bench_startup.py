@@ -0,0 +1,101 @@
+"""
+Benchmark: cold-start cost of a backend worker.
+
+Each run starts a fresh interpreter and measures
+  import     - importing main (all backend modules, no network)
+  startup    - running the app lifespan (StudentGPT load, LLM prewarm kick-off)
+  first_call - the first classroom chat request after startup
+and reports which packages dominate import time (``python -X importtime``).
+
+By default every stage runs on the fake provider without GEMINI_API_KEY,
+which also checks that the app boots without secrets.
+
+Usage (from backend/):
+    python benchmarks/bench_startup.py [--runs 5] [--provider fake|gemini]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs inside the child interpreter; prints one JSON line of timings in seconds
+_CHILD = """
+import json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    ready = time.perf_counter()
+    client.post("/api/v1/classroom/chat", json={"user_message": "I want to learn data structures"})
+    answered = time.perf_counter()
+print(json.dumps({
+    "import": imported - started,
+    "startup": ready - imported,
+    "first_call": answered - ready,
+}))
+"""
+
+
+def _child_env(provider: str) -> Dict[str, str]:
+    env = dict(os.environ, LLM_PROVIDER=provider, LOG_LEVEL="ERROR")
+    if provider == "fake":
+        env.pop("GEMINI_API_KEY", None)
+    return env
+
+
+def run_once(provider: str) -> Dict[str, float]:
+    result = subprocess.run(
+        [sys.executable, "-c", _CHILD], cwd=BACKEND_DIR, env=_child_env(provider),
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(provider: str, top: int) -> List[Tuple[str, float]]:
+    """Top-level packages by total self import time when importing main."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"], cwd=BACKEND_DIR,
+        env=_child_env(provider), capture_output=True, text=True, check=True
+    )
+    totals: Dict[str, float] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # header line
+        package = name.strip().split(".")[0]
+        totals[package] = totals.get(package, 0.0) + int(self_us) / 1e6
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--provider", default="fake", choices=["fake", "gemini"])
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    args = parser.parse_args()
+
+    run_once(args.provider)  # warm the bytecode cache
+    runs = [run_once(args.provider) for _ in range(args.runs)]
+
+    print(f"{'phase':<12}{'median ms':>12}{'min ms':>10}{'max ms':>10}")
+    for phase in ("import", "startup", "first_call"):
+        values = [run[phase] * 1000 for run in runs]
+        print(f"{phase:<12}{statistics.median(values):>12.1f}{min(values):>10.1f}{max(values):>10.1f}")
+    total = [sum(run.values()) * 1000 for run in runs]
+    print(f"{'total':<12}{statistics.median(total):>12.1f}{min(total):>10.1f}{max(total):>10.1f}")
+
+    print(f"\n{'import':<24}{'ms':>10}")
+    for package, seconds in slowest_imports(args.provider, args.top):
+        print(f"{package:<24}{seconds * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
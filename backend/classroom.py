@@ -1,31 +1,48 @@
 import os
-from google import genai
-from google.genai import types
-from dotenv import load_dotenv
-from typing import List, Dict, Optional, Any
+import json
 import asyncio
+import logging
+from typing import TYPE_CHECKING, List, Dict, Optional, Any, AsyncIterator, Tuple, Union
 from datetime import datetime
-from refiner_agent import refine_query
+from refiner_agent import refine_query, is_fallback_refinement, start_refinement_session
+from llm_client import generate_content, generate_content_stream, get_route
+from llm_providers import StageRoute
+from logging_config import get_logger
+from metrics import observe_stage, record_routing
+from prompt_cache import prefix_cache
+from refinement_table import refinement_table
+from smalltalk import smalltalk_responder, SMALLTALK_SOURCE
+from speculation import speculation_policy
 
-# Load environment variables
-load_dotenv()
+if TYPE_CHECKING:
+    from google.genai import types
 
-# Configure Gemini API
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY not found in environment variables")
+logger = get_logger("classroom")
+classifier_logger = get_logger("classroom.classifier")
 
-# Initialize the client
-client = genai.Client(api_key=GEMINI_API_KEY)
+# Batch processing limits (overridable through environment variables)
+CLASSROOM_BATCH_MAX_ITEMS = int(os.getenv("CLASSROOM_BATCH_MAX_ITEMS", "1000"))
+CLASSROOM_BATCH_CONCURRENCY = int(os.getenv("CLASSROOM_BATCH_CONCURRENCY", "16"))
 
 # System prompt for Classroom AI
 CLASSROOM_SYSTEM_PROMPT = """You are a good mentor and teacher. You are helping students learn and understand concepts in a classroom setting."""
 
-def classify_query(query: str) -> str:
+# Classifier confidence per decision reason; keyword hits are reliable, the
+# word-count heuristics are guesses
+CLASSIFIER_CONFIDENCE = {
+    "learning_keywords": 0.9,
+    "greeting": 0.9,
+    "short_query": 0.6,
+    "default": 0.4,
+}
+
+def classify_query_details(query: str) -> Dict[str, Any]:
     """
-    Classifies the user query as 'simple' or 'complex'.
-    Simple: Greetings, short queries, basic questions.
-    Complex: Learning/upskilling requests, multi-step, or context-heavy queries.
+    Classify the user query and explain the decision.
+    
+    Returns:
+        Dict with 'decision' ('simple' or 'complex'), 'reason', 'matched'
+        keywords and 'confidence' (0.0-1.0) in the decision
     """
     greetings = [
         "hi", "hello", "hey", "thanks", "thank you",
@@ -38,152 +55,454 @@ def classify_query(query: str) -> str:
     ]
     
     query_lower = query.strip().lower()
-    
-    print(f"\n{'='*70}")
-    print(f"[CLASSIFIER] Analyzing query: '{query}'")
-    print(f"[CLASSIFIER] Query length: {len(query_lower.split())} words")
+    word_count = len(query_lower.split())
     
     # Check for learning/upskilling intent FIRST (highest priority)
     matched_learning_keywords = [kw for kw in learning_keywords if kw in query_lower]
     if matched_learning_keywords:
-        print(f"[CLASSIFIER] ✓ Learning keywords found: {matched_learning_keywords}")
-        print(f"[CLASSIFIER] 📊 Final decision: COMPLEX")
-        print(f"{'='*70}\n")
-        return "complex"
-    
-    # Check for greetings
-    matched_greetings = [greet for greet in greetings if greet in query_lower]
-    if matched_greetings:
-        print(f"[CLASSIFIER] ✓ Greeting keywords found: {matched_greetings}")
-        print(f"[CLASSIFIER] 📊 Final decision: SIMPLE")
-        print(f"{'='*70}\n")
-        return "simple"
-    
-    # Check for short queries
-    if len(query_lower.split()) < 5:
-        print(f"[CLASSIFIER] ✓ Short query detected (< 5 words)")
-        print(f"[CLASSIFIER] 📊 Final decision: SIMPLE")
-        print(f"{'='*70}\n")
-        return "simple"
-    
-    # Default to complex for safety
-    print(f"[CLASSIFIER] ⚠ No specific patterns matched, defaulting to COMPLEX")
-    print(f"[CLASSIFIER] 📊 Final decision: COMPLEX")
-    print(f"{'='*70}\n")
-    return "complex"
+        decision, reason, matched = "complex", "learning_keywords", matched_learning_keywords
+    else:
+        # Check for greetings
+        matched_greetings = [greet for greet in greetings if greet in query_lower]
+        if matched_greetings:
+            decision, reason, matched = "simple", "greeting", matched_greetings
+        # Check for short queries
+        elif word_count < 5:
+            decision, reason, matched = "simple", "short_query", []
+        # Default to complex for safety
+        else:
+            decision, reason, matched = "complex", "default", []
+    
+    details = {
+        "decision": decision,
+        "reason": reason,
+        "matched": matched,
+        "confidence": CLASSIFIER_CONFIDENCE[reason],
+        "word_count": word_count,
+    }
+    classifier_logger.debug("Query classified", extra=details)
+    return details
+
+
+def classify_query(query: str) -> str:
+    """
+    Classifies the user query as 'simple' or 'complex'.
+    Simple: Greetings, short queries, basic questions.
+    Complex: Learning/upskilling requests, multi-step, or context-heavy queries.
+    """
+    return classify_message(query)["decision"]
+
+
+def classify_message(query: str) -> Dict[str, Any]:
+    """
+    classify_query_details with its latency recorded.
+
+    Callers that also need the decision for admission pass the result on to
+    generate_classroom_response / stream_classroom_response, so each message
+    is classified once per request.
+    """
+    with observe_stage("classify_query"):
+        return classify_query_details(query)
+
+
+def _accept_refinement(refinement_data: Optional[Dict[str, Any]]) -> bool:
+    """Routing rule: a refiner result is used unless the refiner fell back."""
+    return refinement_data is not None and not is_fallback_refinement(refinement_data)
+
+
+async def _precomputed_refinement(user_message: str) -> Optional[Dict[str, Any]]:
+    """Refinement from the offline table (no LLM call), or None when not precomputed."""
+    refinement_data = refinement_table.lookup(user_message)
+    if refinement_data is None:
+        return None
+    refinement_data['original_query'] = user_message
+    await start_refinement_session(refinement_data, user_message)
+    record_routing("precomputed")
+    logger.info("Serving precomputed refinement", extra={"query_type": "complex"})
+    return refinement_data
+
+
+def _log_refinement(refinement_data: Dict[str, Any]) -> None:
+    logger.info(
+        "Refiner agent responded",
+        extra={
+            "needs_refinement": refinement_data.get('needs_refinement'),
+            "suggestion_count": len(refinement_data.get('suggestions') or []),
+        }
+    )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "Refiner suggestions",
+            extra={
+                "reasoning": refinement_data.get('reasoning'),
+                "suggestions": refinement_data.get('suggestions'),
+            }
+        )
+
+
+def _smalltalk_response(
+    user_message: str,
+    classification: Dict[str, Any],
+    locale: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """Locally answered greeting/small talk, or None when the LLM should answer."""
+    reply = smalltalk_responder.reply(user_message, classification, locale)
+    if reply is None:
+        return None
+    record_routing("local")
+    return format_direct_response(reply, SMALLTALK_SOURCE)
 
 
 async def generate_classroom_response(
     user_message: str,
-    conversation_history: Optional[List[Dict[str, str]]] = None
+    conversation_history: Optional[List[Dict[str, str]]] = None,
+    interactive: bool = True,
+    locale: Optional[str] = None,
+    classification: Optional[Dict[str, Any]] = None
 ) -> Dict[str, Any]:
     """
     Main function to generate classroom responses.
-    Routes to either refiner agent (complex) or direct response (simple).
+    Routes to either refiner agent (complex) or direct response (simple);
+    complex queries found in the precomputed refinement table skip the LLM.
+    Low-confidence complex queries may race both branches (see speculation.py).
+    Simple queries use the 'interactive' LLM lane unless ``interactive`` is
+    False (bulk work), so they never queue behind refinement calls.
+    Pure greetings and courtesies are answered locally in ``locale``
+    (see smalltalk.py) without reaching the LLM.
+    ``classification`` is the classify_message result when the caller already
+    has it; otherwise the message is classified here.
     """
     # Classify the query
-    query_type = classify_query(user_message)
+    if classification is None:
+        classification = classify_message(user_message)
+    query_type = classification["decision"]
     
     if query_type == "complex":
-        print(f"\n{'='*70}")
-        print(f"[CLASSIFIER] ✓ Complex query detected")
-        print(f"[ORIGINAL QUERY] {user_message}")
-        print(f"{'='*70}")
-        print(f"[REFINER] Calling refiner agent...")
+        refinement_data = await _precomputed_refinement(user_message)
+        if refinement_data is not None:
+            return format_refinement_response(refinement_data)
         
-        try:
-            refinement_data = await refine_query(user_message)
-            
-            print(f"\n{'='*70}")
-            print(f"[REFINER AGENT RESPONSE]")
-            print(f"{'='*70}")
-            print(f"Needs Refinement: {refinement_data.get('needs_refinement')}")
-            print(f"Reasoning: {refinement_data.get('reasoning')}")
-            
-            if refinement_data.get('suggestions'):
-                print(f"\n� Suggestions Generated:")
-                for i, sug in enumerate(refinement_data['suggestions'], 1):
-                    print(f"   {i}. Question: {sug['text']}")
-                    print(f"      → Adds: {sug['adds']}")
-            else:
-                print(f"\n✓ No suggestions needed - query is clear")
-            
-            print(f"{'='*70}\n")
-            
+        if speculation_policy.should_speculate(classification["confidence"]):
+            record_routing("speculative")
+            return await _speculative_response(user_message, conversation_history)
+        
+        logger.info("Routing to refiner agent", extra={"query_type": query_type})
+        
+        refinement_data = await refine_query(user_message)
+        
+        accepted = _accept_refinement(refinement_data)
+        speculation_policy.record_refiner_outcome(accepted)
+        if accepted:
+            record_routing("complex")
+            _log_refinement(refinement_data)
             return format_refinement_response(refinement_data)
-            
-        except Exception as e:
-            print(f"\n{'❌'*35}")
-            print(f"[REFINER ERROR] {str(e)}")
-            print(f"[FALLBACK] Routing to direct Gemini response")
-            print(f"{'❌'*35}\n")
-            # Fallback: treat as simple query
-            return await _direct_gemini_response(user_message, conversation_history)
-    else:
-        print(f"\n[ROUTING] Simple query detected - Direct response\n")
+        
+        record_routing("fallback")
+        logger.warning("Refiner failed, falling back to direct Gemini response")
+        # Fallback: treat as simple query
         return await _direct_gemini_response(user_message, conversation_history)
+    else:
+        local_response = _smalltalk_response(user_message, classification, locale)
+        if local_response is not None:
+            return local_response
+        
+        record_routing("simple")
+        logger.info("Routing to direct response", extra={"query_type": query_type})
+        return await _direct_gemini_response(
+            user_message, conversation_history, lane="interactive" if interactive else "standard"
+        )
+
+
+async def _speculative_response(
+    user_message: str,
+    conversation_history: Optional[List[Dict[str, str]]] = None
+) -> Dict[str, Any]:
+    """
+    Run the refiner and a direct answer concurrently and keep the branch routing accepts.
+    
+    The refiner result wins whenever it is usable; otherwise the direct answer,
+    already in flight, is returned. The losing branch is cancelled. The
+    refinement session is only stored once the refiner wins, so a direct win
+    leaves no orphaned session behind.
+    """
+    logger.info("Speculative routing: refiner and direct answer in parallel")
+    refiner_task = asyncio.create_task(refine_query(user_message, start_session=False))
+    direct_task = asyncio.create_task(_direct_gemini_response(user_message, conversation_history))
+    
+    try:
+        refinement_data = await refiner_task
+        
+        accepted = _accept_refinement(refinement_data)
+        speculation_policy.record_refiner_outcome(accepted)
+        if accepted:
+            cancelled = direct_task.cancel()
+            speculation_policy.record_winner("refiner", cancelled_other=cancelled)
+            await start_refinement_session(refinement_data, user_message)
+            _log_refinement(refinement_data)
+            return format_refinement_response(refinement_data)
+        
+        speculation_policy.record_winner("direct", cancelled_other=False)
+        return await direct_task
+    finally:
+        for task in (refiner_task, direct_task):
+            if not task.done():
+                task.cancel()
+
+
+BatchItem = Tuple[str, Optional[List[Dict[str, str]]], Optional[str], Optional[str]]
+
+
+def group_batch_items(items: List[BatchItem]) -> Dict[str, List[int]]:
+    """
+    Indices of batch items that share one generation.
+
+    Items with the same message, history and locale get the same response;
+    the user id does not change it.
+    """
+    groups: Dict[str, List[int]] = {}
+    for index, (user_message, conversation_history, locale, _) in enumerate(items):
+        key = json.dumps([user_message, conversation_history, locale], sort_keys=True, ensure_ascii=False)
+        groups.setdefault(key, []).append(index)
+    return groups
+
+
+async def generate_classroom_batch(
+    items: List[BatchItem],
+    max_concurrency: int = CLASSROOM_BATCH_CONCURRENCY
+) -> AsyncIterator[Tuple[List[int], Union[Dict[str, Any], Exception]]]:
+    """
+    Run many messages through generate_classroom_response with bounded parallelism.
+    
+    Items with the same message, history and locale are generated once and
+    their result is reported for every matching index (see group_batch_items);
+    the user id is only logged.
+    
+    Args:
+        items: (user_message, conversation_history, locale, user_id) tuples
+        max_concurrency: Maximum number of unique items processed at once
+    
+    Yields:
+        (indices, outcome) in completion order, where outcome is the response
+        dict or the exception raised for that message
+    """
+    groups = group_batch_items(items)
+    
+    logger.info(
+        "Processing classroom batch",
+        extra={"items": len(items), "unique_items": len(groups), "max_concurrency": max_concurrency}
+    )
+    
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    
+    async def _run(indices: List[int]) -> Tuple[List[int], Union[Dict[str, Any], Exception]]:
+        user_message, conversation_history, locale, _ = items[indices[0]]
+        async with semaphore:
+            try:
+                return indices, await generate_classroom_response(
+                    user_message, conversation_history, interactive=False, locale=locale
+                )
+            except Exception as e:
+                user_ids = sorted({items[i][3] for i in indices if items[i][3]})
+                logger.warning("Batch item failed", extra={"indices": indices, "user_ids": user_ids, "error": str(e)})
+                return indices, e
+    
+    tasks = [asyncio.create_task(_run(indices)) for indices in groups.values()]
+    try:
+        for completed in asyncio.as_completed(tasks):
+            yield await completed
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+def _build_direct_prompt(
+    user_message: str,
+    conversation_history: Optional[List[Dict[str, str]]] = None
+) -> str:
+    """
+    Combine recent history and the student message.
+    CLASSROOM_SYSTEM_PROMPT is attached separately through the prompt prefix cache.
+    """
+    # Build conversation context
+    conversation_context = ""
+    if conversation_history:
+        for msg in conversation_history[-5:]:  # Keep last 5 messages for context
+            role = msg.get("role", "user")
+            content = msg.get("content", "")
+            conversation_context += f"{role.capitalize()}: {content}\n"
+    
+    # Combine conversation context and user message
+    full_prompt = ""
+    if conversation_context:
+        full_prompt += f"Previous conversation:\n{conversation_context}\n"
+    full_prompt += f"Student: {user_message}\n\nTeacher:"
+    return full_prompt
+
+
+async def _direct_generation_config(route: StageRoute) -> "types.GenerateContentConfig":
+    """Generation config for direct answers with the classroom system prompt attached."""
+    return await prefix_cache.prepare_config(
+        "classroom",
+        route,
+        CLASSROOM_SYSTEM_PROMPT,
+        route.generation_config()
+    )
 
 
 async def _direct_gemini_response(
     user_message: str, 
-    conversation_history: Optional[List[Dict[str, str]]] = None
+    conversation_history: Optional[List[Dict[str, str]]] = None,
+    lane: str = "standard"
 ) -> Dict[str, Any]:
     """
     Generate a direct response using Gemini for simple queries.
     """
+    route = get_route("classroom_direct")
     try:
-        # Build conversation context
-        conversation_context = ""
-        if conversation_history:
-            for msg in conversation_history[-5:]:  # Keep last 5 messages for context
-                role = msg.get("role", "user")
-                content = msg.get("content", "")
-                conversation_context += f"{role.capitalize()}: {content}\n"
-        
-        # Combine system prompt with conversation context and user message
-        full_prompt = f"{CLASSROOM_SYSTEM_PROMPT}\n\n"
-        if conversation_context:
-            full_prompt += f"Previous conversation:\n{conversation_context}\n"
-        full_prompt += f"Student: {user_message}\n\nTeacher:"
+        full_prompt = _build_direct_prompt(user_message, conversation_history)
         
-        print(f"[CLASSROOM] Processing direct query: {user_message[:80]}...")
+        logger.debug("Processing direct query", extra={"query_preview": user_message[:80]})
         
-        # Generate response using Gemini
-        response = await asyncio.to_thread(
-            client.models.generate_content,
-            model='gemini-2.0-flash-001',
+        # Generate response with the model routed to direct answers
+        response = await generate_content(
+            "classroom_direct",
             contents=full_prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.7,
-                max_output_tokens=1000
-            )
+            config=await _direct_generation_config(route),
+            lane=lane
         )
         
         if response and response.text:
             generated_text = response.text.strip()
-            print(f"[CLASSROOM] ✓ Response generated successfully ({len(generated_text)} chars)\n")
-            return format_direct_response(generated_text)
+            logger.info("Direct response generated", extra={"chars": len(generated_text)})
+            return format_direct_response(generated_text, route.source)
         else:
-            print("[CLASSROOM] ⚠ Empty response from Gemini API\n")
+            logger.warning("Empty response from LLM", extra={"model": route.model})
             return format_direct_response(
-                "I apologize, but I couldn't generate a proper response. Could you please rephrase your question?"
+                "I apologize, but I couldn't generate a proper response. Could you please rephrase your question?",
+                route.source
             )
             
     except Exception as e:
-        print(f"[CLASSROOM] ❌ Error generating response: {str(e)}\n")
+        logger.error("Error generating direct response", extra={"error": str(e)})
         return format_direct_response(
-            "I'm experiencing some technical difficulties right now. Please try again in a moment, or rephrase your question."
+            "I'm experiencing some technical difficulties right now. Please try again in a moment, or rephrase your question.",
+            route.source
+        )
+
+
+async def stream_classroom_response(
+    user_message: str,
+    conversation_history: Optional[List[Dict[str, str]]] = None,
+    locale: Optional[str] = None,
+    classification: Optional[Dict[str, Any]] = None
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Streaming variant of generate_classroom_response.
+    
+    Yields (event, payload) pairs: zero or more ('token', {'text': ...}) events
+    while a direct answer is being generated, followed by exactly one
+    ('final', response_data) event with the same structure that
+    generate_classroom_response returns, or by one ('error', {'detail': ...,
+    'partial': True}) event when generation fails after tokens were sent.
+    ``classification`` is as for generate_classroom_response.
+    """
+    if classification is None:
+        classification = classify_message(user_message)
+    query_type = classification["decision"]
+    
+    if query_type == "complex":
+        refinement_data = await _precomputed_refinement(user_message)
+        if refinement_data is not None:
+            yield "final", format_refinement_response(refinement_data)
+            return
+        
+        logger.info("Routing to refiner agent", extra={"query_type": query_type, "streaming": True})
+        refinement_data = await refine_query(user_message)
+        
+        accepted = _accept_refinement(refinement_data)
+        speculation_policy.record_refiner_outcome(accepted)
+        if accepted:
+            record_routing("complex")
+            _log_refinement(refinement_data)
+            yield "final", format_refinement_response(refinement_data)
+            return
+        record_routing("fallback")
+        logger.warning("Refiner failed, falling back to streamed direct response")
+        lane = "standard"
+    else:
+        local_response = _smalltalk_response(user_message, classification, locale)
+        if local_response is not None:
+            yield "final", local_response
+            return
+        record_routing("simple")
+        lane = "interactive"
+    
+    async for event in _stream_direct_gemini_response(user_message, conversation_history, lane):
+        yield event
+
+
+async def _stream_direct_gemini_response(
+    user_message: str,
+    conversation_history: Optional[List[Dict[str, str]]] = None,
+    lane: str = "standard"
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Stream a direct Gemini answer chunk by chunk, then emit the formatted response.
+    A failure after some chunks ends the stream with an 'error' event, so the
+    truncated text is never reported as a complete answer.
+    """
+    full_prompt = _build_direct_prompt(user_message, conversation_history)
+    logger.debug("Streaming direct query", extra={"query_preview": user_message[:80]})
+    
+    route = get_route("classroom_direct")
+    chunks: List[str] = []
+    try:
+        stream = generate_content_stream(
+            "classroom_direct",
+            contents=full_prompt,
+            config=await _direct_generation_config(route),
+            lane=lane
+        )
+        async for chunk in stream:
+            text = chunk.text if chunk else None
+            if text:
+                chunks.append(text)
+                yield "token", {"text": text}
+    except Exception as e:
+        logger.error("Error streaming direct response", extra={"error": str(e), "chunks": len(chunks)})
+        if not chunks:
+            yield "final", format_direct_response(
+                "I'm experiencing some technical difficulties right now. Please try again in a moment, or rephrase your question.",
+                route.source
+            )
+        else:
+            yield "error", {
+                "detail": "The response was interrupted. Please try again.",
+                "partial": True
+            }
+        return
+    
+    generated_text = "".join(chunks).strip()
+    if generated_text:
+        logger.info("Streamed response complete", extra={"chars": len(generated_text)})
+        yield "final", format_direct_response(generated_text, route.source)
+    else:
+        logger.warning("Empty streamed response from LLM", extra={"model": route.model})
+        yield "final", format_direct_response(
+            "I apologize, but I couldn't generate a proper response. Could you please rephrase your question?",
+            route.source
         )
 
 
-def format_direct_response(bot_message: str) -> Dict[str, Any]:
-    """Format a direct response from the AI."""
+def format_direct_response(bot_message: str, source: str) -> Dict[str, Any]:
+    """Format a direct response from the AI, tagged with the provider and model that produced it."""
     return {
         "response_type": "direct_response",
         "bot_message": bot_message,
         "timestamp": datetime.utcnow(),
         "success": True,
-        "source": "gemini-2.0-flash-001"
+        "source": source
     }
 
 
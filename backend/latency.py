@@ -0,0 +1,57 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, Optional
+
+# Number of most recent samples kept for percentile estimates
+LATENCY_WINDOW_SIZE = 1024
+
+
+class LatencyTracker:
+    """
+    Rolling latency statistics over the most recent samples.
+
+    Keeps a bounded window so percentiles follow current upstream behaviour
+    rather than the whole process lifetime.
+    """
+
+    def __init__(self, name: str, window_size: int = LATENCY_WINDOW_SIZE):
+        self.name = name
+        self._samples: Deque[float] = deque(maxlen=window_size)
+        self.count = 0
+        self.total_seconds = 0.0
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        self.count += 1
+        self.total_seconds += seconds
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Record the duration of the wrapped block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(time.perf_counter() - started)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Return the q-th percentile (0-100) in seconds, or None without samples."""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def stats(self) -> Dict[str, Any]:
+        def _ms(value: Optional[float]) -> Optional[float]:
+            return round(value * 1000, 2) if value is not None else None
+
+        return {
+            "name": self.name,
+            "count": self.count,
+            "avg_ms": _ms(self.total_seconds / self.count) if self.count else None,
+            "p50_ms": _ms(self.percentile(50)),
+            "p95_ms": _ms(self.percentile(95)),
+            "p99_ms": _ms(self.percentile(99)),
+        }
@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+from logging_config import get_logger
+from metrics import (
+    LLM_CACHE_BYTES, LLM_CACHE_ENTRIES, LLM_CACHE_EVICTIONS, LLM_CACHE_LOOKUPS, LLM_CACHE_REFRESHES,
+    METRICS_ENABLED
+)
+from shared_state import STATE_BACKEND, get_shared_kv, shared_key
+
+logger = get_logger("llm_cache")
+
+# Cache configuration (overridable through environment variables)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", "3600"))
+LLM_CACHE_STALE_SECONDS = float(os.getenv("LLM_CACHE_STALE_SECONDS", "600"))
+# Second-level store shared by worker processes ('memory' keeps the cache per process)
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", STATE_BACKEND).lower()
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a student query so trivially different spellings share a cache key."""
+    normalized = " ".join(query.strip().lower().split())
+    return normalized.rstrip(" .!?")
+
+
+def make_cache_key(stage: str, prompt_version: str, *parts: Any) -> str:
+    """
+    Build a stable cache key for one LLM stage.
+
+    Args:
+        stage: Pipeline stage name (e.g. 'refine', 'continue', 'finalize')
+        prompt_version: Version of the prompt used for this stage
+        parts: Any JSON-serializable values that influence the LLM output
+
+    Returns:
+        Hex digest identifying the request
+    """
+    payload = json.dumps([stage, prompt_version, *parts], sort_keys=True, ensure_ascii=False)
+    return f"{stage}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+@dataclass
+class _CacheEntry:
+    value: str          # JSON-encoded payload, decoded on every read so callers get a private copy
+    size: int
+    created_at: float
+
+
+class LLMResponseCache:
+    """
+    In-process LRU + TTL cache for parsed LLM responses.
+
+    Entries younger than ``ttl_seconds`` are served as fresh hits. Entries that
+    are older, but still within ``stale_seconds`` past their TTL, are served
+    immediately while a background task recomputes them (stale-while-revalidate).
+    The cache is bounded both by entry count and by the total encoded size.
+
+    With a shared ``backend`` ('sqlite' or 'redis', see shared_state.py) the
+    in-process LRU acts as a first level in front of a store every worker
+    process reads and writes, so a result computed by one worker is a hit in
+    all of them.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        max_bytes: int = LLM_CACHE_MAX_BYTES,
+        ttl_seconds: float = LLM_CACHE_TTL_SECONDS,
+        stale_seconds: float = LLM_CACHE_STALE_SECONDS,
+        enabled: bool = LLM_CACHE_ENABLED,
+        backend: str = LLM_CACHE_BACKEND,
+    ):
+        self.name = name
+        self.backend = backend
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.enabled = enabled
+
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._total_bytes = 0
+        self._refreshing: Set[str] = set()
+        self._background_tasks: Set[asyncio.Task] = set()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.shared_hits = 0
+        self.shared_errors = 0
+
+        if METRICS_ENABLED:
+            LLM_CACHE_ENTRIES.labels(name).set_function(lambda: len(self._entries))
+            LLM_CACHE_BYTES.labels(name).set_function(lambda: self._total_bytes)
+
+    # ---------------------------------------------------------------- storage
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a fresh cached value or None (does not serve stale entries)."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.created_at >= self.ttl_seconds:
+            return None
+        self._entries.move_to_end(key)
+        return json.loads(entry.value)
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """Store a value, evicting least recently used entries past the limits."""
+        self._put(key, json.dumps(value, ensure_ascii=False, default=str), time.monotonic())
+
+    def _put(self, key: str, encoded: str, created_at: float) -> None:
+        size = len(encoded.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+
+        self._remove(key)
+        self._entries[key] = _CacheEntry(value=encoded, size=size, created_at=created_at)
+        self._total_bytes += size
+
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes
+        ):
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+            if METRICS_ENABLED:
+                LLM_CACHE_EVICTIONS.labels(self.name, "lru").inc()
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._total_bytes = 0
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry.size
+
+    # ----------------------------------------------------------- shared store
+
+    async def _load_shared(self, key: str) -> Optional[_CacheEntry]:
+        """Pull an entry written by any worker into the local LRU."""
+        shared = get_shared_kv(self.backend)
+        if shared is None:
+            return None
+        try:
+            item = await shared.get(shared_key("cache", self.name, key))
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning("Shared cache read failed", extra={"cache": self.name, "error": str(e)[:80]})
+            return None
+        if item is None:
+            return None
+        encoded, stored_at = item
+        # Convert the wall-clock write time into this process's monotonic clock
+        age = max(0.0, time.time() - stored_at)
+        self._put(key, encoded, time.monotonic() - age)
+        self.shared_hits += 1
+        return self._entries.get(key)
+
+    async def _store_shared(self, key: str) -> None:
+        shared = get_shared_kv(self.backend)
+        entry = self._entries.get(key)
+        if shared is None or entry is None:
+            return
+        try:
+            await shared.set(
+                shared_key("cache", self.name, key), entry.value, self.ttl_seconds + self.stale_seconds
+            )
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning("Shared cache write failed", extra={"cache": self.name, "error": str(e)[:80]})
+
+    # ------------------------------------------------------------------ reads
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Dict[str, Any]]],
+    ) -> Dict[str, Any]:
+        """
+        Return the cached value for ``key`` or compute and store it.
+
+        ``compute`` must raise on failure; only successful results are cached,
+        so fallback responses are never served from the cache.
+
+        Args:
+            key: Cache key built with make_cache_key
+            compute: Coroutine factory that performs the LLM call
+
+        Returns:
+            A private copy of the cached or freshly computed value
+        """
+        if not self.enabled:
+            return await compute()
+
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = await self._load_shared(key)
+        if entry is not None:
+            age = time.monotonic() - entry.created_at
+            if age < self.ttl_seconds:
+                self.hits += 1
+                self._record_lookup("hit")
+                self._entries.move_to_end(key)
+                return json.loads(entry.value)
+
+            if age < self.ttl_seconds + self.stale_seconds:
+                self.stale_hits += 1
+                self._record_lookup("stale_hit")
+                self._entries.move_to_end(key)
+                self._schedule_refresh(key, compute)
+                return json.loads(entry.value)
+
+            self.expirations += 1
+            if METRICS_ENABLED:
+                LLM_CACHE_EVICTIONS.labels(self.name, "expired").inc()
+            self._remove(key)
+
+        self.misses += 1
+        self._record_lookup("miss")
+        value = await compute()
+        self.set(key, value)
+        await self._store_shared(key)
+        return json.loads(json.dumps(value, ensure_ascii=False, default=str))
+
+    def _schedule_refresh(self, key: str, compute: Callable[[], Awaitable[Dict[str, Any]]]) -> None:
+        """Recompute a stale entry in the background, at most once per key at a time."""
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+
+        async def _refresh() -> None:
+            try:
+                value = await compute()
+                self.set(key, value)
+                await self._store_shared(key)
+                self.refreshes += 1
+                if METRICS_ENABLED:
+                    LLM_CACHE_REFRESHES.labels(self.name, "success").inc()
+            except Exception as e:
+                self.refresh_failures += 1
+                if METRICS_ENABLED:
+                    LLM_CACHE_REFRESHES.labels(self.name, "failure").inc()
+                logger.warning("Background cache refresh failed", extra={"cache": self.name, "error": str(e)[:80]})
+            finally:
+                self._refreshing.discard(key)
+
+        task = asyncio.create_task(_refresh())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    # ------------------------------------------------------------------ stats
+
+    def _record_lookup(self, result: str) -> None:
+        if METRICS_ENABLED:
+            LLM_CACHE_LOOKUPS.labels(self.name, result).inc()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "name": self.name,
+            "enabled": self.enabled,
+            "backend": self.backend,
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "shared_hits": self.shared_hits,
+            "shared_errors": self.shared_errors,
+        }
@@ -0,0 +1,510 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from contextlib import asynccontextmanager
+from collections import deque
+from typing import TYPE_CHECKING, Any, AsyncIterator, Deque, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from singleflight import SingleFlight
+from llm_providers import STAGES, FakeProvider, GeminiProvider, LLMProvider, StageRoute, StageRouter
+from logging_config import get_logger
+from resilience import resilient_caller
+from metrics import (
+    LLM_IN_FLIGHT, LLM_LANE_IN_FLIGHT, LLM_LANE_QUEUE_DEPTH, LLM_LANE_WAIT, LLM_QUEUE_DEPTH,
+    METRICS_ENABLED, observe_llm_call
+)
+
+if TYPE_CHECKING:
+    # The Gemini SDK takes most of the backend's import time; it is loaded on first use
+    import httpx
+    from google import genai
+    from google.genai import types
+
+logger = get_logger("llm_client")
+
+# Load environment variables
+load_dotenv()
+
+# Gemini API key; only required once a stage routed to Gemini is called
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+
+# Import the SDK and build the client in the background at startup (see prewarm)
+LLM_PREWARM = os.getenv("LLM_PREWARM", "true").lower() in ("1", "true", "yes")
+
+# Concurrency and connection pool settings (per worker process)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "256"))
+LLM_HTTP_TIMEOUT_MS = int(os.getenv("LLM_HTTP_TIMEOUT_MS", "60000"))
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", str(LLM_MAX_CONCURRENCY)))
+LLM_HTTP_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_HTTP_KEEPALIVE_CONNECTIONS", "64"))
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "30"))
+LLM_SINGLEFLIGHT_ENABLED = os.getenv("LLM_SINGLEFLIGHT_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Priority lanes of the concurrency pool, highest priority first:
+#   'interactive' - direct answers to simple queries (greetings, short questions)
+#   'standard'    - direct answers to complex queries (refiner fallback, speculation)
+#   'refinement'  - the refine / continue / finalize stages
+# Callers pick the lane per query class; otherwise it follows the stage
+# (override with LLM_LANE_<STAGE>). LLM_LANE_<LANE>_RESERVED slots can only be
+# used by that lane and LLM_LANE_<LANE>_MAX caps it.
+LLM_LANES = ("interactive", "standard", "refinement")
+STAGE_LANES = {
+    stage: os.getenv(f"LLM_LANE_{stage.upper()}", "standard" if stage == "classroom_direct" else "refinement").lower()
+    for stage in STAGES
+}
+_LANE_RESERVED_DEFAULTS = {"interactive": max(1, LLM_MAX_CONCURRENCY // 8)}
+
+
+def _lane_limits(lane: str) -> Tuple[int, int]:
+    """(reserved slots, maximum slots) of a lane."""
+    reserved = int(os.getenv(f"LLM_LANE_{lane.upper()}_RESERVED", str(_LANE_RESERVED_DEFAULTS.get(lane, 0))))
+    max_slots = int(os.getenv(f"LLM_LANE_{lane.upper()}_MAX", str(LLM_MAX_CONCURRENCY)))
+    return reserved, max_slots
+
+
+def _http_limits() -> "httpx.Limits":
+    import httpx
+
+    return httpx.Limits(
+        max_connections=LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_HTTP_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def _sdk_accepts_client_args() -> bool:
+    from google.genai import types
+
+    return "async_client_args" in types.HttpOptions.model_fields
+
+
+def _build_http_options() -> "types.HttpOptions":
+    """
+    HTTP options for the shared client.
+
+    SDK releases that accept ``async_client_args`` reuse one pooled httpx
+    AsyncClient for every call, so we size its keep-alive pool here. Older
+    releases (including the pinned one) get the shared pool through
+    _use_shared_async_pool instead.
+    """
+    from google.genai import types
+
+    options: Dict[str, Any] = {"timeout": LLM_HTTP_TIMEOUT_MS}
+    if _sdk_accepts_client_args():
+        options["async_client_args"] = {"limits": _http_limits()}
+    return types.HttpOptions(**options)
+
+
+def _new_async_http_client() -> "httpx.AsyncClient":
+    import httpx
+
+    return httpx.AsyncClient(limits=_http_limits(), timeout=LLM_HTTP_TIMEOUT_MS / 1000)
+
+
+# One pooled client per event loop: httpx connections cannot move between loops
+_async_http_clients: Dict[int, Tuple[asyncio.AbstractEventLoop, "httpx.AsyncClient"]] = {}
+
+
+def _shared_async_http_client() -> "httpx.AsyncClient":
+    loop = asyncio.get_running_loop()
+    entry = _async_http_clients.get(id(loop))
+    if entry is None or entry[0] is not loop:
+        for key, (other_loop, _) in list(_async_http_clients.items()):
+            if other_loop.is_closed():
+                del _async_http_clients[key]
+        entry = _async_http_clients[id(loop)] = (loop, _new_async_http_client())
+    return entry[1]
+
+
+def _use_shared_async_pool(client: "genai.Client") -> None:
+    """
+    Send the SDK's async requests through one pooled keep-alive httpx client.
+
+    SDK releases without ``async_client_args`` build a new httpx.AsyncClient,
+    and so a new TLS connection, for every async request. This replaces that
+    request method on our client instance with the same request sent through
+    _shared_async_http_client.
+    """
+    import httpx
+    from google.genai import _api_client, errors
+
+    api_client = client._api_client
+
+    async def _async_request(http_request: Any, stream: bool = False) -> Any:
+        if api_client.vertexai:
+            http_request.headers["Authorization"] = f"Bearer {await api_client._async_access_token()}"
+            if api_client._credentials.quota_project_id:
+                http_request.headers["x-goog-user-project"] = api_client._credentials.quota_project_id
+        shared = _shared_async_http_client()
+        content = json.dumps(http_request.data) if http_request.data else None
+        if stream:
+            request = shared.build_request(
+                http_request.method, http_request.url, content=content, headers=http_request.headers
+            )
+            response = await shared.send(request, stream=True)
+            if response.status_code != 200:
+                # Read the error body so it can be reported and the connection returns to the pool
+                await response.aread()
+        else:
+            response = await shared.request(
+                http_request.method, http_request.url, content=content,
+                headers=http_request.headers, timeout=http_request.timeout or httpx.USE_CLIENT_DEFAULT
+            )
+        errors.APIError.raise_for_response(response)
+        return _api_client.HttpResponse(response.headers, response if stream else [response.text])
+
+    api_client._async_request = _async_request
+
+
+_client: Optional["genai.Client"] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> "genai.Client":
+    """
+    Shared Gemini client used by the Gemini provider and context caching.
+
+    Created on first use, so importing the backend needs neither the SDK
+    import nor credentials (e.g. when every stage runs on the fake provider).
+
+    Raises:
+        ValueError: GEMINI_API_KEY is not set
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if not GEMINI_API_KEY:
+                    raise ValueError("GEMINI_API_KEY not found in environment variables")
+                started = time.perf_counter()
+                from google import genai
+                _client = genai.Client(api_key=GEMINI_API_KEY, http_options=_build_http_options())
+                if not _sdk_accepts_client_args():
+                    _use_shared_async_pool(_client)
+                logger.info(
+                    "Gemini client created",
+                    extra={"init_ms": round((time.perf_counter() - started) * 1000, 2)}
+                )
+    return _client
+
+
+def prewarm() -> None:
+    """
+    Import the SDK types used to build generation configs, and create the
+    Gemini client when a stage is routed to Gemini, so the first request does
+    not pay for them. Blocking; run it in a thread.
+    """
+    try:
+        from google.genai import types  # noqa: F401
+        if any(route["provider"] == "gemini" for route in router.routes().values()):
+            get_client()
+    except Exception as e:
+        logger.warning("LLM client prewarm failed", extra={"error": str(e)[:200]})
+
+
+class _Lane:
+    """Waiters and accounting of one priority lane."""
+
+    def __init__(self, name: str, reserved: int, max_slots: int):
+        self.name = name
+        self.reserved = reserved
+        self.max_slots = max_slots
+        self.in_flight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.peak_waiting = 0
+        self.calls = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "reserved": self.reserved,
+            "max_slots": self.max_slots,
+            "in_flight": self.in_flight,
+            "queue_depth": len(self.waiters),
+            "peak_queue_depth": self.peak_waiting,
+            "calls": self.calls,
+            "avg_wait_ms": round(self.total_wait_seconds * 1000 / self.calls, 3) if self.calls else 0.0,
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+        }
+
+
+class LLMConcurrencyPool:
+    """
+    Explicit limit on in-flight LLM calls, split into priority lanes.
+
+    Replaces the implicit cap of the default thread pool executor that
+    asyncio.to_thread used: callers past the limit wait in their lane and
+    are visible in stats() instead of queueing silently. A freed slot goes
+    to the oldest waiter of the highest-priority lane allowed to run, and
+    slots reserved for a lane are never taken by others, so a burst of
+    refinement calls cannot delay interactive answers.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, lane_limits: Optional[Dict[str, Tuple[int, int]]] = None):
+        self.max_concurrency = max_concurrency
+        lane_limits = lane_limits or {lane: _lane_limits(lane) for lane in LLM_LANES}
+        self._lanes: Dict[str, _Lane] = {
+            lane: _Lane(lane, *lane_limits.get(lane, (0, max_concurrency))) for lane in LLM_LANES
+        }
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.peak_in_flight = 0
+        self.peak_waiting = 0
+        self.total_calls = 0
+        self.total_errors = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _can_start(self, lane: _Lane) -> bool:
+        if self.in_flight >= self.max_concurrency or lane.in_flight >= lane.max_slots:
+            return False
+        held_for_others = sum(
+            max(0, other.reserved - other.in_flight) for other in self._lanes.values() if other is not lane
+        )
+        return self.max_concurrency - self.in_flight > held_for_others
+
+    def _start(self, lane: _Lane) -> None:
+        lane.in_flight += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _finish(self, lane: _Lane) -> None:
+        lane.in_flight -= 1
+        self.in_flight -= 1
+        # Hand freed slots out in priority order
+        for candidate in self._lanes.values():
+            while candidate.waiters and self._can_start(candidate):
+                future = candidate.waiters.popleft()
+                self.waiting -= 1
+                if not future.done():
+                    self._start(candidate)
+                    future.set_result(None)
+
+    def has_capacity(self, lane_name: str = "standard") -> bool:
+        """Whether a call in ``lane_name`` would get a slot without waiting."""
+        lane = self._lanes.get(lane_name) or self._lanes["standard"]
+        return not lane.waiters and self._can_start(lane)
+
+    @asynccontextmanager
+    async def slot(self, lane_name: str = "standard") -> AsyncIterator[None]:
+        """Hold one concurrency slot in ``lane_name`` for the duration of an LLM call."""
+        lane = self._lanes.get(lane_name) or self._lanes["standard"]
+        queued_at = time.perf_counter()
+        if not lane.waiters and self._can_start(lane):
+            self._start(lane)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            lane.waiters.append(future)
+            self.waiting += 1
+            lane.peak_waiting = max(lane.peak_waiting, len(lane.waiters))
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Granted a slot just as we were cancelled; pass it on
+                    self._finish(lane)
+                elif future in lane.waiters:
+                    lane.waiters.remove(future)
+                    self.waiting -= 1
+                raise
+
+        waited = time.perf_counter() - queued_at
+        self.total_wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        lane.total_wait_seconds += waited
+        lane.max_wait_seconds = max(lane.max_wait_seconds, waited)
+        lane.calls += 1
+        self.total_calls += 1
+        if METRICS_ENABLED:
+            LLM_LANE_WAIT.labels(lane.name).observe(waited)
+        try:
+            yield
+        except Exception:
+            self.total_errors += 1
+            raise
+        finally:
+            self._finish(lane)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "peak_in_flight": self.peak_in_flight,
+            "peak_queue_depth": self.peak_waiting,
+            "total_calls": self.total_calls,
+            "total_errors": self.total_errors,
+            "avg_wait_ms": round(self.total_wait_seconds * 1000 / self.total_calls, 3) if self.total_calls else 0.0,
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+            "lanes": {name: lane.stats() for name, lane in self._lanes.items()},
+        }
+
+
+pool = LLMConcurrencyPool()
+LLM_IN_FLIGHT.set_function(lambda: pool.in_flight)
+LLM_QUEUE_DEPTH.set_function(lambda: pool.waiting)
+if METRICS_ENABLED:
+    for _name, _lane in pool._lanes.items():
+        LLM_LANE_IN_FLIGHT.labels(_name).set_function(lambda lane=_lane: lane.in_flight)
+        LLM_LANE_QUEUE_DEPTH.labels(_name).set_function(lambda lane=_lane: len(lane.waiters))
+
+
+coalescer = SingleFlight("generate_content")
+
+
+# Provider backends and per-stage routing (see llm_providers.py)
+providers: Dict[str, LLMProvider] = {
+    "gemini": GeminiProvider(get_client),
+    "fake": FakeProvider(),
+}
+router = StageRouter()
+
+
+def get_route(stage: str) -> StageRoute:
+    """Provider, model and generation settings for a pipeline stage."""
+    return router.route(stage)
+
+
+def lane_for_stage(stage: str) -> str:
+    """Default concurrency lane of a stage when the caller does not choose one."""
+    return STAGE_LANES.get(stage, "standard")
+
+
+def _provider_for(route: StageRoute) -> LLMProvider:
+    try:
+        return providers[route.provider]
+    except KeyError:
+        raise ValueError(f"Unknown LLM provider '{route.provider}' for stage '{route.stage}'")
+
+
+def _config_key(config: Optional["types.GenerateContentConfig"]) -> str:
+    if config is None:
+        return ""
+    schema = config.response_schema
+    if isinstance(schema, type):
+        # Pydantic schema classes are not JSON serializable; key them by name
+        config = config.model_copy(update={"response_schema": None})
+        return f"{config.model_dump_json(exclude_none=True)}|{schema.__module__}.{schema.__qualname__}"
+    return config.model_dump_json(exclude_none=True)
+
+
+def _request_key(
+    route: StageRoute,
+    contents: Any,
+    config: Optional["types.GenerateContentConfig"],
+    lane: str = "standard"
+) -> str:
+    """Identity of an LLM request: stage, lane, final prompt, provider, model and generation config."""
+    contents_key = contents if isinstance(contents, str) else repr(contents)
+    config_key = _config_key(config)
+    payload = json.dumps(
+        [route.stage, lane, route.provider, route.model, contents_key, config_key], ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def _generate_content(
+    route: StageRoute,
+    contents: Any,
+    config: Optional["types.GenerateContentConfig"] = None,
+    lane: str = "standard"
+) -> Any:
+    provider = _provider_for(route)
+
+    async def _attempt() -> Any:
+        # Runs while holding a pool slot (see ResilientCaller), so only upstream time is measured
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            response = await provider.generate(route, contents, config)
+            outcome = "success"
+            return response
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            observe_llm_call(route.stage, route.provider, route.model, outcome, time.perf_counter() - started)
+
+    return await resilient_caller.call(route, _attempt, pool=pool, lane=lane)
+
+
+async def generate_content(
+    stage: str,
+    contents: Any,
+    config: Optional["types.GenerateContentConfig"] = None,
+    lane: Optional[str] = None
+) -> Any:
+    """
+    Non-blocking generate_content routed to the provider and model of a stage.
+
+    Concurrent calls with the same stage, lane, prompt, route and config share
+    a single upstream request (see singleflight.py). Each request runs with the
+    stage's timeout, retry, hedging and circuit breaker policy (see
+    resilience.py); an open breaker raises CircuitOpenError immediately so
+    callers fall back without waiting on an unhealthy upstream.
+
+    Args:
+        stage: Pipeline stage (one of llm_providers.STAGES)
+        contents: Prompt contents
+        config: Generation config (defaults to the stage's route settings)
+        lane: Concurrency lane (defaults to the stage's lane, see LLM_LANES)
+
+    Returns:
+        The provider response (exposes ``text``)
+    """
+    route = router.route(stage)
+    if config is None:
+        config = route.generation_config()
+    lane = lane or lane_for_stage(stage)
+    if not LLM_SINGLEFLIGHT_ENABLED:
+        return await _generate_content(route, contents, config, lane)
+    return await coalescer.do(
+        _request_key(route, contents, config, lane),
+        lambda: _generate_content(route, contents, config, lane)
+    )
+
+
+async def generate_content_stream(
+    stage: str,
+    contents: Any,
+    config: Optional["types.GenerateContentConfig"] = None,
+    lane: Optional[str] = None
+) -> AsyncIterator[Any]:
+    """
+    Stream response chunks for a stage, holding a pool slot until the stream ends.
+
+    Streams are not retried or hedged once started, but they honour the
+    model's circuit breaker and report their outcome to it.
+    """
+    route = router.route(stage)
+    if config is None:
+        config = route.generation_config()
+    provider = _provider_for(route)
+    resilient_caller.check_breaker(route)
+    async with pool.slot(lane or lane_for_stage(stage)):
+        started = time.perf_counter()
+        try:
+            async for chunk in provider.stream(route, contents, config):
+                yield chunk
+        except Exception as e:
+            observe_llm_call(route.stage, route.provider, route.model, "error", time.perf_counter() - started)
+            resilient_caller.record_outcome(route, e)
+            raise
+    observe_llm_call(route.stage, route.provider, route.model, "success", time.perf_counter() - started)
+    resilient_caller.record_outcome(route, None)
+
+
+def get_stats() -> Dict[str, Any]:
+    """Queue depth, per-lane concurrency, coalescing, routing and resilience statistics."""
+    return {
+        **pool.stats(),
+        "singleflight": coalescer.stats(),
+        "routes": router.routes(),
+        "resilience": resilient_caller.stats(),
+    }
@@ -0,0 +1,266 @@
+import os
+import json
+import random
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, Optional
+
+if TYPE_CHECKING:
+    from google.genai import types
+
+# Pipeline stages that call an LLM
+STAGES = ("classroom_direct", "refine", "continue", "finalize")
+
+# Default provider/model for every stage; override per stage with
+# LLM_PROVIDER_<STAGE> / LLM_MODEL_<STAGE> (e.g. LLM_MODEL_REFINE=gemini-2.0-flash-lite-001)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini").lower()
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.0-flash-001")
+
+# Per-stage generation defaults: (temperature, max_output_tokens), overridable
+# with LLM_TEMPERATURE_<STAGE> / LLM_MAX_OUTPUT_TOKENS_<STAGE>
+STAGE_GENERATION_DEFAULTS = {
+    "classroom_direct": (0.7, 1000),
+    "refine": (0.3, 500),
+    "continue": (0.3, 500),
+    "finalize": (0.3, 800),
+}
+
+# Fake provider behaviour (offline load testing)
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "0"))
+FAKE_LLM_LATENCY_JITTER_MS = float(os.getenv("FAKE_LLM_LATENCY_JITTER_MS", "0"))
+# 'uniform' (latency +/- jitter) or 'lognormal' (median latency, long right tail like real LLM calls)
+FAKE_LLM_LATENCY_DISTRIBUTION = os.getenv("FAKE_LLM_LATENCY_DISTRIBUTION", "uniform").lower()
+FAKE_LLM_LATENCY_SIGMA = float(os.getenv("FAKE_LLM_LATENCY_SIGMA", "0.5"))
+FAKE_LLM_FAILURE_RATE = float(os.getenv("FAKE_LLM_FAILURE_RATE", "0"))
+FAKE_LLM_MALFORMED_RATE = float(os.getenv("FAKE_LLM_MALFORMED_RATE", "0"))
+FAKE_LLM_SEED = int(os.getenv("FAKE_LLM_SEED", "42"))
+
+
+@dataclass(frozen=True)
+class StageRoute:
+    """Provider, model and generation settings serving one pipeline stage."""
+    stage: str
+    provider: str
+    model: str
+    temperature: float
+    max_output_tokens: int
+
+    @property
+    def source(self) -> str:
+        """Label for responses this route produced: the Gemini model name, or 'provider:model' for other providers."""
+        return self.model if self.provider == "gemini" else f"{self.provider}:{self.model}"
+
+    def generation_config(self, **overrides: Any) -> "types.GenerateContentConfig":
+        """Generation config for this stage; keyword arguments override the route defaults."""
+        from google.genai import types
+
+        settings: Dict[str, Any] = {
+            "temperature": self.temperature,
+            "max_output_tokens": self.max_output_tokens,
+        }
+        settings.update(overrides)
+        return types.GenerateContentConfig(**settings)
+
+
+class StageRouter:
+    """Resolve each pipeline stage to a provider, model and generation settings."""
+
+    def __init__(self, default_provider: str = LLM_PROVIDER, default_model: str = LLM_MODEL):
+        self._routes: Dict[str, StageRoute] = {}
+        for stage in STAGES:
+            env_suffix = stage.upper()
+            temperature, max_output_tokens = STAGE_GENERATION_DEFAULTS[stage]
+            self._routes[stage] = StageRoute(
+                stage=stage,
+                provider=os.getenv(f"LLM_PROVIDER_{env_suffix}", default_provider).lower(),
+                model=os.getenv(f"LLM_MODEL_{env_suffix}", default_model),
+                temperature=float(os.getenv(f"LLM_TEMPERATURE_{env_suffix}", str(temperature))),
+                max_output_tokens=int(os.getenv(f"LLM_MAX_OUTPUT_TOKENS_{env_suffix}", str(max_output_tokens))),
+            )
+
+    def route(self, stage: str) -> StageRoute:
+        try:
+            return self._routes[stage]
+        except KeyError:
+            raise ValueError(f"Unknown LLM stage: {stage}")
+
+    def routes(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            stage: {
+                "provider": r.provider,
+                "model": r.model,
+                "temperature": r.temperature,
+                "max_output_tokens": r.max_output_tokens,
+            }
+            for stage, r in self._routes.items()
+        }
+
+
+class LLMProvider:
+    """
+    Interface for LLM backends.
+
+    Responses only need a ``text`` attribute; streams yield chunks with ``text``.
+    """
+
+    name = "base"
+
+    async def generate(
+        self,
+        route: StageRoute,
+        contents: Any,
+        config: Optional["types.GenerateContentConfig"] = None
+    ) -> Any:
+        raise NotImplementedError
+
+    async def stream(
+        self,
+        route: StageRoute,
+        contents: Any,
+        config: Optional["types.GenerateContentConfig"] = None
+    ) -> AsyncIterator[Any]:
+        raise NotImplementedError
+        yield  # pragma: no cover
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini through the SDK's async surface."""
+
+    name = "gemini"
+
+    def __init__(self, client_factory: Callable[[], Any]):
+        # The client is created on first call (see llm_client.get_client)
+        self._client_factory = client_factory
+
+    @property
+    def client(self) -> Any:
+        return self._client_factory()
+
+    async def generate(self, route, contents, config=None):
+        return await self.client.aio.models.generate_content(
+            model=route.model,
+            contents=contents,
+            config=config
+        )
+
+    async def stream(self, route, contents, config=None):
+        stream = await self.client.aio.models.generate_content_stream(
+            model=route.model,
+            contents=contents,
+            config=config
+        )
+        async for chunk in stream:
+            yield chunk
+
+
+class FakeProviderError(Exception):
+    """Injected failure raised by the fake provider."""
+
+
+@dataclass
+class FakeResponse:
+    text: str
+
+
+class FakeProvider(LLMProvider):
+    """
+    Deterministic in-process provider for offline development and load tests.
+
+    Replies depend only on the stage and the prompt, so identical requests get
+    identical answers. Latency, hard failures and malformed JSON output can be
+    injected to exercise timeouts and fallback paths. Latency is drawn from a
+    seeded uniform or lognormal distribution; FAKE_LLM_LATENCY_MS_<STAGE>
+    overrides the median of one stage.
+    """
+
+    name = "fake"
+
+    _DIRECT_REPLIES = (
+        "Great question! Let's break it down step by step so it is easy to follow.",
+        "Happy to help. Here is a short explanation with an example you can try yourself.",
+        "Good thinking! Start with the core idea, then we can build on it together.",
+    )
+
+    def __init__(
+        self,
+        latency_ms: float = FAKE_LLM_LATENCY_MS,
+        jitter_ms: float = FAKE_LLM_LATENCY_JITTER_MS,
+        failure_rate: float = FAKE_LLM_FAILURE_RATE,
+        malformed_rate: float = FAKE_LLM_MALFORMED_RATE,
+        seed: int = FAKE_LLM_SEED,
+        distribution: str = FAKE_LLM_LATENCY_DISTRIBUTION,
+        sigma: float = FAKE_LLM_LATENCY_SIGMA,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.distribution = distribution
+        self.sigma = sigma
+        self.stage_latency_ms = {
+            stage: float(os.environ[f"FAKE_LLM_LATENCY_MS_{stage.upper()}"])
+            for stage in STAGE_GENERATION_DEFAULTS
+            if f"FAKE_LLM_LATENCY_MS_{stage.upper()}" in os.environ
+        }
+        self.failure_rate = failure_rate
+        self.malformed_rate = malformed_rate
+        self._random = random.Random(seed)
+        self.calls = 0
+
+    def _delay_ms(self, stage: str) -> float:
+        latency_ms = self.stage_latency_ms.get(stage, self.latency_ms)
+        if self.distribution == "lognormal":
+            return latency_ms * self._random.lognormvariate(0.0, self.sigma)
+        return latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)
+
+    async def _simulate(self, stage: str) -> bool:
+        """Sleep for the configured latency; return True if the output should be malformed."""
+        self.calls += 1
+        delay_ms = self._delay_ms(stage)
+        if delay_ms > 0:
+            await asyncio.sleep(delay_ms / 1000)
+        if self._random.random() < self.failure_rate:
+            raise FakeProviderError("Injected fake provider failure")
+        return self._random.random() < self.malformed_rate
+
+    def reply(self, stage: str, contents: Any) -> str:
+        """The deterministic reply text for a stage and prompt."""
+        prompt = contents if isinstance(contents, str) else repr(contents)
+        digest = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+
+        if stage == "refine":
+            return json.dumps({
+                "category": "non-academic",
+                "needs_refinement": True,
+                "suggestions": [
+                    {"text": "Are you a beginner or do you already have some experience?", "adds": "skill level"},
+                    {"text": "Do you prefer theory, projects, or both?", "adds": "learning format"},
+                    {"text": "What is your goal - exams, a job, or curiosity?", "adds": "purpose"},
+                ],
+                "refined_query_preview": "Personalized learning path based on the student's level and goal",
+                "reasoning": "The query is broad; a few details will personalize the learning path.",
+            })
+        if stage in ("continue", "finalize"):
+            return json.dumps({
+                "needs_refinement": False,
+                "suggestions": [],
+                "reasoning": "Enough context has been gathered.",
+                "refined_query": "Personalized, project-based learning plan matching the student's answers",
+                "requirements": ["beginner friendly", "project-based"],
+                "tags": ["non-academic", "skills"],
+                "confidence": 0.85,
+            })
+        return self._DIRECT_REPLIES[digest % len(self._DIRECT_REPLIES)]
+
+    async def generate(self, route, contents, config=None):
+        malformed = await self._simulate(route.stage)
+        text = self.reply(route.stage, contents)
+        if malformed:
+            text = "Sure! Here is what I think: " + text[: len(text) // 2]
+        return FakeResponse(text=text)
+
+    async def stream(self, route, contents, config=None):
+        await self._simulate(route.stage)
+        words = self.reply(route.stage, contents).split(" ")
+        for i, word in enumerate(words):
+            yield FakeResponse(text=word if i == 0 else " " + word)
+            await asyncio.sleep(0)
@@ -1,14 +1,60 @@
-from fastapi import FastAPI, Form, HTTPException
+import os
+import json
+import time
+import uuid
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+from fastapi import FastAPI, Form, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.requests import HTTPConnection
 from models import (
     ChatRequest, ChatResponse, RegisterRequest, 
     TokenResponse, UserResponse, ClassroomChatRequest, ClassroomChatResponse,
-    ContinueRefinementRequest, ContinueRefinementResponse
+    ContinueRefinementRequest, ContinueRefinementResponse,
+    ClassroomBatchRequest, ClassroomBatchResponse, ClassroomBatchItemResult
 )
-from classroom import generate_classroom_response
-from refiner_agent import continue_refinement
+from classroom import (
+    generate_classroom_response, stream_classroom_response, generate_classroom_batch, group_batch_items,
+    classify_message,
+    CLASSROOM_BATCH_MAX_ITEMS, CLASSROOM_BATCH_CONCURRENCY
+)
+from refiner_agent import continue_refinement, semantic_cache
+from refiner_socket import RefinerSocket
+from admission import AdmissionRejected, AdmissionTicket, admission_controller, admission_identity
+from llm_client import LLM_PREWARM, prewarm
+from studentgpt import StudentGPTOverloadedError, studentgpt_engine
+from session_store import SessionNotFoundError
+from logging_config import setup_logging, get_logger, request_id_var
+from responses import model_response
+from metrics import (
+    CONTENT_TYPE_LATEST, HTTP_IN_FLIGHT, HTTP_REQUEST_DURATION, HTTP_REQUESTS,
+    METRICS_ENABLED, observe_stage, render_latest
+)
+
+setup_logging()
+logger = get_logger("api")
 
-app = FastAPI(title="Mahaguru AI Backend", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The LLM SDK loads in the background so the worker starts serving without waiting for it
+    warmup = asyncio.create_task(asyncio.to_thread(prewarm)) if LLM_PREWARM else None
+    # Load the local StudentGPT weights once per worker, before serving traffic
+    await studentgpt_engine.start()
+    yield
+    if warmup is not None and not warmup.done():
+        await warmup
+    await studentgpt_engine.stop()
+    semantic_cache.save()
+
+app = FastAPI(
+    title="Mahaguru AI Backend",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
+)
 
 # Allow frontend to connect
 app.add_middleware(
@@ -24,55 +70,252 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    """
+    Assign a request id to every request, emit one structured access log
+    record and update the HTTP request metrics.
+    """
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    started = time.perf_counter()
+    status_code = 500
+    if METRICS_ENABLED:
+        HTTP_IN_FLIGHT.inc()
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        duration = time.perf_counter() - started
+        if METRICS_ENABLED:
+            HTTP_IN_FLIGHT.dec()
+            # Label by route template, not raw path, to keep cardinality bounded
+            route = request.scope.get("route")
+            route_label = route.path if route is not None else "unmatched"
+            HTTP_REQUESTS.labels(request.method, route_label, str(status_code)).inc()
+            HTTP_REQUEST_DURATION.labels(request.method, route_label).observe(duration)
+        logger.info(
+            "Request handled",
+            extra={
+                "method": request.method,
+                "path": request.url.path,
+                "status": status_code,
+                "duration_ms": round(duration * 1000, 2),
+            }
+        )
+        request_id_var.reset(token)
+
+def _client_key(http_request: HTTPConnection, user_id: Optional[str]) -> str:
+    """Admission identity of a caller (see admission.admission_identity)."""
+    return admission_identity(http_request.client.host if http_request.client else None, user_id)
+
+async def _admit(
+    http_request: Request,
+    user_id: Optional[str] = None,
+    classification: Optional[Dict[str, Any]] = None,
+    cost: float = 1.0
+) -> AdmissionTicket:
+    """
+    Pass admission control (see admission.py) or fail fast with 429/503 and Retry-After.
+    Chat messages whose ``classification`` (from classify_message) is simple are
+    admitted as interactive and may use reserved capacity.
+    ``cost`` is the number of rate-limit tokens charged (one per unique batch item).
+    The returned ticket must be released when the request is done.
+    """
+    interactive = classification is not None and classification["decision"] == "simple"
+    try:
+        return await admission_controller.acquire(_client_key(http_request, user_id), interactive, cost)
+    except AdmissionRejected as e:
+        detail = (
+            "Too many requests. Please slow down and try again shortly."
+            if e.status_code == 429 else
+            "The service is busy. Please try again shortly."
+        )
+        raise HTTPException(status_code=e.status_code, detail=detail, headers={"Retry-After": e.retry_after_header})
+
 @app.get("/")
 async def root():
     return {"message": "Mahaguru AI Backend"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint."""
+    return Response(content=render_latest(), media_type=CONTENT_TYPE_LATEST)
+
 # For Brainstorming (StudentGPT)
 @app.post("/api/v1/studentgpt/chat", response_model=ChatResponse)
 async def studentgpt_chat(request: ChatRequest):
-    # Your fine-tuned small LLM logic here
-    # For now, returning a simple mock response
-    response = f"StudentGPT: I understand you asked about '{request.message}'. This is a placeholder response. Implement your fine-tuned small LLM logic here."
+    """
+    Brainstorming chat served by the local StudentGPT model.
+    
+    Concurrent requests are micro-batched (see studentgpt.py); a full queue
+    answers 503 so clients back off instead of waiting indefinitely.
+    """
+    try:
+        response = await studentgpt_engine.submit(request.message)
+    except StudentGPTOverloadedError:
+        raise HTTPException(
+            status_code=503,
+            detail="StudentGPT is busy. Please try again shortly.",
+            headers={"Retry-After": "1"}
+        )
+    except Exception:
+        logger.exception("Error in StudentGPT chat")
+        raise HTTPException(
+            status_code=500,
+            detail="An error occurred while processing your request. Please try again."
+        )
     return ChatResponse(response=response)
 
 # For Classroom (Multi-agent)
 @app.post("/api/v1/classroom/chat", response_model=ClassroomChatResponse)
-async def classroom_chat(request: ClassroomChatRequest):
+async def classroom_chat(request: ClassroomChatRequest, http_request: Request):
     """
     Classroom chat endpoint using Gemini API for educational conversations
     """
+    classification = classify_message(request.user_message)
+    ticket = await _admit(http_request, request.user_id, classification)
     try:
-        print(f"[API] Received classroom chat request from user: {request.user_id}")
-        print(f"[API] User message: '{request.user_message}'")
+        logger.info("Classroom chat request", extra={"user_id": request.user_id})
+        logger.debug("Classroom chat message", extra={"user_message": request.user_message})
         
         # Generate response using the classroom system
         response_data = await generate_classroom_response(
             user_message=request.user_message,
-            conversation_history=request.conversation_history
+            conversation_history=request.conversation_history,
+            locale=request.locale,
+            classification=classification
         )
         
-        print(f"[API] Generated response type: {response_data.get('response_type')}")
-        print(f"[API] Sending response to frontend")
+        logger.info("Classroom chat response ready", extra={"response_type": response_data.get('response_type')})
         
-        return ClassroomChatResponse(**response_data)
+        with observe_stage("response_model"):
+            return model_response(ClassroomChatResponse(**response_data))
         
     except Exception as e:
-        print(f"[API] Error in classroom chat: {str(e)}")
+        logger.exception("Error in classroom chat")
         raise HTTPException(
             status_code=500, 
             detail="An error occurred while processing your request. Please try again."
         )
+    finally:
+        ticket.release()
+
+def _format_sse(event: str, data: str) -> str:
+    """Format a single Server-Sent Events message."""
+    return f"event: {event}\ndata: {data}\n\n"
+
+@app.post("/api/v1/classroom/chat/stream")
+async def classroom_chat_stream(request: ClassroomChatRequest, http_request: Request):
+    """
+    Streaming classroom chat endpoint (Server-Sent Events).
+    
+    Emits 'token' events with text chunks as Gemini produces them, then a
+    single 'final' event carrying the ClassroomChatResponse payload, or an
+    'error' event if generation fails (after partial tokens it has 'partial': true).
+    """
+    logger.info("Streaming classroom chat request", extra={"user_id": request.user_id})
+    logger.debug("Classroom chat message", extra={"user_message": request.user_message})
+    classification = classify_message(request.user_message)
+    ticket = await _admit(http_request, request.user_id, classification)
+    
+    async def event_stream():
+        try:
+            async for event, payload in stream_classroom_response(
+                user_message=request.user_message,
+                conversation_history=request.conversation_history,
+                locale=request.locale,
+                classification=classification
+            ):
+                if event == "final":
+                    yield _format_sse(event, ClassroomChatResponse(**payload).model_dump_json())
+                else:
+                    yield _format_sse(event, json.dumps(payload, ensure_ascii=False))
+        except Exception as e:
+            logger.exception("Error in streaming classroom chat")
+            yield _format_sse("error", json.dumps({
+                "detail": "An error occurred while processing your request. Please try again."
+            }))
+        finally:
+            ticket.release()
+    
+    # The background task also releases the slot if the client disconnects before streaming starts
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(ticket.release)
+    )
+
+def _batch_item_result(index: int, outcome) -> ClassroomBatchItemResult:
+    """Convert one batch outcome (response dict or exception) into its API model."""
+    if isinstance(outcome, Exception):
+        return ClassroomBatchItemResult(
+            index=index,
+            success=False,
+            error="An error occurred while processing this item."
+        )
+    return ClassroomBatchItemResult(index=index, success=True, response=ClassroomChatResponse(**outcome))
+
+@app.post("/api/v1/classroom/chat/batch", response_model=ClassroomBatchResponse)
+async def classroom_chat_batch(request: ClassroomBatchRequest, http_request: Request):
+    """
+    Bulk classroom chat endpoint for LMS imports.
+    
+    Processes items with bounded parallelism, generating identical messages
+    once. Returns per-item results in request order, or with stream=true
+    emits one NDJSON line per item as soon as it completes.
+    """
+    if len(request.items) > CLASSROOM_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large. At most {CLASSROOM_BATCH_MAX_ITEMS} items are allowed."
+        )
+    
+    max_concurrency = min(request.max_concurrency or CLASSROOM_BATCH_CONCURRENCY, CLASSROOM_BATCH_CONCURRENCY)
+    logger.info("Classroom batch request", extra={"items": len(request.items), "stream": request.stream})
+    items = [(item.user_message, item.conversation_history, item.locale, item.user_id) for item in request.items]
+    # A batch holds one serving slot but is charged one rate-limit token per unique item
+    ticket = await _admit(http_request, cost=len(group_batch_items(items)))
+    
+    batch = generate_classroom_batch(items, max_concurrency=max_concurrency)
+    
+    if request.stream:
+        async def ndjson_stream():
+            try:
+                async for indices, outcome in batch:
+                    for index in indices:
+                        yield _batch_item_result(index, outcome).model_dump_json() + "\n"
+            finally:
+                ticket.release()
+        
+        return StreamingResponse(
+            ndjson_stream(), media_type="application/x-ndjson", background=BackgroundTask(ticket.release)
+        )
+    
+    try:
+        results: List[Optional[ClassroomBatchItemResult]] = [None] * len(request.items)
+        async for indices, outcome in batch:
+            for index in indices:
+                results[index] = _batch_item_result(index, outcome)
+    finally:
+        ticket.release()
+    return model_response(ClassroomBatchResponse(results=results))
 
 @app.post("/api/v1/refiner/continue", response_model=ContinueRefinementResponse)
-async def continue_refiner(request: ContinueRefinementRequest):
+async def continue_refiner(request: ContinueRefinementRequest, http_request: Request):
     """
     Continue multi-turn refinement with user answers
     """
+    if not request.session_id and not request.original_query:
+        raise HTTPException(status_code=400, detail="Either session_id or original_query is required.")
+    
+    ticket = await _admit(http_request, request.user_id)
     try:
-        print(f"[API] Received continue refinement request")
-        print(f"[API] Original query: '{request.original_query}'")
-        print(f"[API] User answers count: {len(request.answers)}")
+        logger.info("Continue refinement request", extra={"answer_count": len(request.answers)})
+        logger.debug("Continue refinement query", extra={"original_query": request.original_query})
         
         # Convert UserAnswer models to dict format for refiner_agent
         user_answers = [
@@ -83,7 +326,8 @@ async def continue_refiner(request: ContinueRefinementRequest):
         # Generate continue refinement response
         response_data = await continue_refinement(
             original_query=request.original_query,
-            user_answers=user_answers
+            user_answers=user_answers,
+            session_id=request.session_id
         )
         
         # Ensure all required fields exist (defense in depth)
@@ -91,16 +335,40 @@ async def continue_refiner(request: ContinueRefinementRequest):
         response_data.setdefault('reasoning', '')
         response_data.setdefault('original_query', request.original_query)
         
-        print(f"[API] Continue refinement response type: {'needs more refinement' if response_data.get('needs_refinement') else 'complete'}")
+        logger.info("Continue refinement response ready", extra={"needs_refinement": response_data.get('needs_refinement')})
         
-        return ContinueRefinementResponse(**response_data)
+        with observe_stage("response_model"):
+            return model_response(ContinueRefinementResponse(**response_data))
         
+    except SessionNotFoundError:
+        logger.info("Refinement session not found", extra={"session_id": request.session_id})
+        raise HTTPException(
+            status_code=404,
+            detail="Refinement session not found or expired. Please start again."
+        )
     except Exception as e:
-        print(f"[API] Error in continue refinement: {str(e)}")
+        logger.exception("Error in continue refinement")
         raise HTTPException(
             status_code=500, 
             detail="An error occurred while processing refinement. Please try again."
         )
+    finally:
+        ticket.release()
+
+@app.websocket("/api/v1/refiner/ws")
+async def refiner_socket(websocket: WebSocket, user_id: Optional[str] = None):
+    """
+    Whole refine -> answer -> continue -> final exchange over one connection.
+    
+    See refiner_socket.RefinerSocket for the message protocol. Each 'start'
+    and 'answers' message passes admission control like its HTTP equivalent.
+    """
+    token = request_id_var.set(websocket.headers.get("X-Request-ID") or uuid.uuid4().hex)
+    try:
+        logger.info("Refinement socket opened", extra={"user_id": user_id})
+        await RefinerSocket(websocket, lambda message_user_id: _client_key(websocket, message_user_id or user_id)).run()
+    finally:
+        request_id_var.reset(token)
 
 # Basic auth endpoints that frontend expects
 @app.post("/api/v1/auth/login", response_model=TokenResponse)
@@ -131,4 +399,30 @@ async def refresh_token():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    from shared_state import STATE_BACKEND
+    
+    # Production run mode: API_WORKERS processes share the listening socket.
+    # Use STATE_BACKEND=sqlite (or redis) so cache hits and refinement
+    # sessions are shared between them. Admission limits, LLM concurrency
+    # limits and the /metrics registry stay per worker: every worker admits
+    # up to the configured rates, and a scrape only reports the worker that
+    # happened to answer it. Divide the limits by API_WORKERS, or run one
+    # worker per container and scale containers, when exact totals matter.
+    workers = int(os.getenv("API_WORKERS", "1"))
+    if workers > 1:
+        logger.warning(
+            "Admission limits and /metrics are per worker process",
+            extra={"workers": workers}
+        )
+    if workers > 1 and STATE_BACKEND == "memory":
+        logger.warning(
+            "Running multiple workers with per-process state; set STATE_BACKEND=sqlite or redis to share it",
+            extra={"workers": workers}
+        )
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("API_HOST", "0.0.0.0"),
+        port=int(os.getenv("API_PORT", "8000")),
+        workers=workers,
+        app_dir=os.path.dirname(os.path.abspath(__file__))
+    )
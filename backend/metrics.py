@@ -0,0 +1,266 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+)
+
+# Metrics live in the default per-process registry: with API_WORKERS > 1 each
+# worker exports its own values and /metrics answers for whichever worker
+# accepted the scrape (multiprocess mode is not used because the gauges here
+# are computed live from in-process state).
+# Set METRICS_ENABLED=false to turn instrumentation into no-ops
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Bucket boundaries (seconds): sub-millisecond CPU stages up to multi-second LLM calls
+_STAGE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+_REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HTTP_REQUESTS = Counter(
+    "mahaguru_http_requests_total",
+    "HTTP requests handled",
+    ["method", "route", "status"],
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "mahaguru_http_request_duration_seconds",
+    "HTTP request latency by route",
+    ["method", "route"],
+    buckets=_REQUEST_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge(
+    "mahaguru_http_requests_in_flight",
+    "HTTP requests currently being handled",
+)
+STAGE_DURATION = Histogram(
+    "mahaguru_stage_duration_seconds",
+    "Latency of CPU-side pipeline stages",
+    ["stage"],
+    buckets=_STAGE_BUCKETS,
+)
+LLM_CALL_DURATION = Histogram(
+    "mahaguru_llm_call_duration_seconds",
+    "Latency of individual upstream LLM attempts",
+    ["stage", "provider", "model", "outcome"],
+    buckets=_STAGE_BUCKETS,
+)
+LLM_IN_FLIGHT = Gauge(
+    "mahaguru_llm_calls_in_flight",
+    "Upstream LLM attempts currently running",
+)
+LLM_QUEUE_DEPTH = Gauge(
+    "mahaguru_llm_queue_depth",
+    "LLM calls waiting for a concurrency slot",
+)
+LLM_LANE_WAIT = Histogram(
+    "mahaguru_llm_lane_wait_seconds",
+    "Time LLM calls waited for a concurrency slot, by priority lane",
+    ["lane"],
+    buckets=_STAGE_BUCKETS,
+)
+LLM_LANE_IN_FLIGHT = Gauge(
+    "mahaguru_llm_lane_in_flight",
+    "Upstream LLM attempts currently running, by priority lane",
+    ["lane"],
+)
+LLM_LANE_QUEUE_DEPTH = Gauge(
+    "mahaguru_llm_lane_queue_depth",
+    "LLM calls waiting for a concurrency slot, by priority lane",
+    ["lane"],
+)
+LLM_RETRIES = Counter(
+    "mahaguru_llm_retries_total",
+    "LLM calls retried after a transient failure",
+    ["stage", "model"],
+)
+LLM_TIMEOUTS = Counter(
+    "mahaguru_llm_timeouts_total",
+    "LLM attempts that exceeded their upstream timeout",
+    ["stage", "model"],
+)
+LLM_HEDGES = Counter(
+    "mahaguru_llm_hedges_total",
+    "Hedged duplicate LLM requests sent",
+    ["stage", "model"],
+)
+LLM_HEDGE_WINS = Counter(
+    "mahaguru_llm_hedge_wins_total",
+    "Hedged LLM requests that answered before the primary",
+    ["stage", "model"],
+)
+LLM_HEDGES_SKIPPED = Counter(
+    "mahaguru_llm_hedges_skipped_total",
+    "Hedges not sent because no concurrency slot was free",
+    ["stage", "model"],
+)
+LLM_BREAKER_STATE = Gauge(
+    "mahaguru_llm_breaker_state",
+    "Circuit breaker state per provider:model (0 closed, 1 half-open, 2 open)",
+    ["breaker"],
+)
+LLM_BREAKER_OPENED = Counter(
+    "mahaguru_llm_breaker_opened_total",
+    "Times a circuit breaker opened",
+    ["breaker"],
+)
+LLM_BREAKER_FAST_FAILED = Counter(
+    "mahaguru_llm_breaker_fast_failed_total",
+    "LLM calls rejected by an open circuit breaker",
+    ["breaker"],
+)
+LLM_CACHE_LOOKUPS = Counter(
+    "mahaguru_llm_cache_lookups_total",
+    "LLM response cache lookups, by result ('hit', 'stale_hit' or 'miss')",
+    ["cache", "result"],
+)
+LLM_CACHE_EVICTIONS = Counter(
+    "mahaguru_llm_cache_evictions_total",
+    "LLM response cache entries removed, by reason ('lru' or 'expired')",
+    ["cache", "reason"],
+)
+LLM_CACHE_REFRESHES = Counter(
+    "mahaguru_llm_cache_refreshes_total",
+    "Background refreshes of stale LLM response cache entries, by outcome",
+    ["cache", "outcome"],
+)
+LLM_CACHE_ENTRIES = Gauge(
+    "mahaguru_llm_cache_entries",
+    "Entries held in the in-process LLM response cache",
+    ["cache"],
+)
+LLM_CACHE_BYTES = Gauge(
+    "mahaguru_llm_cache_bytes",
+    "Encoded size of the in-process LLM response cache",
+    ["cache"],
+)
+SINGLEFLIGHT_CALLS = Counter(
+    "mahaguru_singleflight_calls_total",
+    "Calls entering a single-flight group",
+    ["name"],
+)
+SINGLEFLIGHT_EXECUTIONS = Counter(
+    "mahaguru_singleflight_executions_total",
+    "Calls that started a shared execution",
+    ["name"],
+)
+SINGLEFLIGHT_COALESCED = Counter(
+    "mahaguru_singleflight_coalesced_total",
+    "Calls that joined an execution already in flight",
+    ["name"],
+)
+JSON_PARSE_FAILURES = Counter(
+    "mahaguru_json_parse_failures_total",
+    "LLM responses that could not be parsed as JSON",
+    ["stage"],
+)
+ROUTING_DECISIONS = Counter(
+    "mahaguru_routing_decisions_total",
+    "Classroom routing outcomes",
+    ["decision"],
+)
+REFINER_FINALIZATION_DURATION = Histogram(
+    "mahaguru_refiner_finalization_duration_seconds",
+    "End-to-end latency of the final refinement round, by finalization path",
+    ["path"],
+    buckets=_REQUEST_BUCKETS,
+)
+ADMISSION_DECISIONS = Counter(
+    "mahaguru_admission_decisions_total",
+    "Admission control outcomes for chat and refiner requests",
+    ["decision", "reason"],
+)
+ADMISSION_QUEUE_WAIT = Histogram(
+    "mahaguru_admission_queue_wait_seconds",
+    "Time admitted requests waited for a serving slot",
+    buckets=_STAGE_BUCKETS,
+)
+ADMISSION_WAITING = Gauge(
+    "mahaguru_admission_waiting",
+    "Requests waiting for a serving slot",
+)
+WS_CONNECTIONS = Gauge(
+    "mahaguru_ws_connections",
+    "Open refinement WebSocket connections",
+)
+WS_MESSAGES = Counter(
+    "mahaguru_ws_messages_total",
+    "Refinement WebSocket frames received, by message type",
+    ["type"],
+)
+
+STUDENTGPT_BATCH_SIZE = Histogram(
+    "mahaguru_studentgpt_batch_size",
+    "Requests per StudentGPT micro-batch",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+STUDENTGPT_TOKENS = Counter(
+    "mahaguru_studentgpt_generated_tokens_total",
+    "Tokens generated by the local StudentGPT model",
+)
+STUDENTGPT_TOKENS_PER_SECOND = Gauge(
+    "mahaguru_studentgpt_tokens_per_second",
+    "Generation throughput of the most recent StudentGPT batch",
+)
+STUDENTGPT_QUEUE_DEPTH = Gauge(
+    "mahaguru_studentgpt_queue_depth",
+    "StudentGPT requests waiting to be batched",
+)
+STUDENTGPT_REJECTED = Counter(
+    "mahaguru_studentgpt_rejected_total",
+    "StudentGPT requests rejected because the queue was full",
+)
+
+
+@contextmanager
+def observe_stage(stage: str) -> Iterator[None]:
+    """Record the duration of the wrapped block in the stage latency histogram."""
+    if not METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.labels(stage).observe(time.perf_counter() - started)
+
+
+def observe_llm_call(stage: str, provider: str, model: str, outcome: str, seconds: float) -> None:
+    if METRICS_ENABLED:
+        LLM_CALL_DURATION.labels(stage, provider, model, outcome).observe(seconds)
+
+
+def record_singleflight(name: str, coalesced: bool) -> None:
+    """Count a single-flight call; the coalescing ratio is coalesced / calls."""
+    if METRICS_ENABLED:
+        SINGLEFLIGHT_CALLS.labels(name).inc()
+        (SINGLEFLIGHT_COALESCED if coalesced else SINGLEFLIGHT_EXECUTIONS).labels(name).inc()
+
+
+def record_json_parse_failure(stage: str) -> None:
+    if METRICS_ENABLED:
+        JSON_PARSE_FAILURES.labels(stage).inc()
+
+
+def record_routing(decision: str) -> None:
+    """Count a routing outcome: 'simple', 'complex', 'fallback', 'speculative', 'precomputed' or 'local'."""
+    if METRICS_ENABLED:
+        ROUTING_DECISIONS.labels(decision).inc()
+
+
+def observe_finalization(path: str, seconds: float) -> None:
+    """Record a final refinement round: 'combined', 'combined_fallback' or 'two_call'."""
+    if METRICS_ENABLED:
+        REFINER_FINALIZATION_DURATION.labels(path).observe(seconds)
+
+
+def record_admission(decision: str, reason: str) -> None:
+    """Count an admission outcome: 'admitted', 'throttled' or 'shed', with its reason."""
+    if METRICS_ENABLED:
+        ADMISSION_DECISIONS.labels(decision, reason).inc()
+
+
+def render_latest() -> bytes:
+    """Current metrics in the Prometheus text exposition format."""
+    return generate_latest(REGISTRY)
+
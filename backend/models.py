@@ -36,11 +36,13 @@ class RefinementData(BaseModel):
         suggestions: List of suggestions/questions to improve the query
         reasoning: Brief explanation for why refinement is/isn't needed
         original_query: The original user query before refinement
+        session_id: Server-side refinement session to reference in follow-ups
     """
     needs_refinement: bool
     suggestions: List[RefinementSuggestion]
     reasoning: str
     original_query: str
+    session_id: Optional[str] = None
 
 class UserAnswer(BaseModel):
     """
@@ -58,11 +60,15 @@ class ContinueRefinementRequest(BaseModel):
     Request model for continuing multi-turn refinement.
     
     Attributes:
-        original_query: The original user query
-        answers: List of user answers to previous questions
+        original_query: The original user query (optional when session_id is sent)
+        answers: List of user answers to the latest questions
+        session_id: Refinement session id returned with the first suggestions
+        user_id: Optional user identifier (rate-limit key when ADMISSION_TRUST_USER_ID is set)
     """
-    original_query: str
+    original_query: Optional[str] = None
     answers: List[UserAnswer]
+    session_id: Optional[str] = None
+    user_id: Optional[str] = None
 
 class ConversationTurn(BaseModel):
     """
@@ -111,6 +117,57 @@ class ContinueRefinementResponse(BaseModel):
     reasoning: str = ""  # Make optional with default
     original_query: str
     final_package: Optional[FinalRefinementPackage] = None
+    session_id: Optional[str] = None  # Set while more refinement rounds are pending
+
+# ==================== LLM OUTPUT SCHEMAS ====================
+# Structured-output schemas sent to the LLM for the refiner stages. They hold
+# only the fields the model generates; ids, the original query and session
+# data are added server-side. Gemini rejects schema defaults, so optional
+# fields are nullable instead.
+
+class SuggestionDraft(BaseModel):
+    """LLM-generated part of a RefinementSuggestion (question_id is assigned server-side)."""
+    text: str
+    adds: str
+
+class RefinementDraft(BaseModel):
+    """
+    Output schema for the refine stage (the generated part of RefinementData).
+    
+    Attributes:
+        category: 'academic' or 'non-academic'
+        needs_refinement: Whether the query needs refinement
+        suggestions: Follow-up questions to ask
+        refined_query_preview: Predicted clearer version of the goal
+        reasoning: Why refinement is or isn't needed
+    """
+    category: Optional[str] = None
+    needs_refinement: bool
+    suggestions: List[SuggestionDraft]
+    refined_query_preview: Optional[str] = None
+    reasoning: str
+
+class FinalFieldsDraft(BaseModel):
+    """Output schema for the finalize stage (the generated fields of FinalRefinementPackage)."""
+    refined_query: str
+    requirements: List[str]
+    tags: List[str]
+    confidence: float
+
+class ContinuationDraft(BaseModel):
+    """
+    Output schema for the continue stage.
+    
+    The final package fields are filled in when needs_refinement is false and
+    the decision and finalization happen in one call.
+    """
+    needs_refinement: bool
+    suggestions: List[SuggestionDraft]
+    reasoning: str
+    refined_query: Optional[str] = None
+    requirements: Optional[List[str]] = None
+    tags: Optional[List[str]] = None
+    confidence: Optional[float] = None
 
 # ==================== CLASSROOM MODELS ====================
 
@@ -122,10 +179,12 @@ class ClassroomChatRequest(BaseModel):
         user_message: The student's question or message
         user_id: Optional user identifier
         conversation_history: Optional list of previous messages for context
+        locale: Optional locale for locally answered small talk (e.g. 'en')
     """
     user_message: str
     user_id: Optional[str] = None
     conversation_history: Optional[List[Dict[str, str]]] = None
+    locale: Optional[str] = None
 
 class ClassroomChatResponse(BaseModel):
     response_type: str  # 'direct_response' or 'refinement_needed'
@@ -135,6 +194,38 @@ class ClassroomChatResponse(BaseModel):
     timestamp: datetime
     success: bool
 
+class ClassroomBatchRequest(BaseModel):
+    """
+    Request model for bulk classroom chat processing.
+    
+    Attributes:
+        items: Chat requests to process; identical messages are generated once
+        max_concurrency: Optional cap on items processed in parallel
+        stream: Stream results as NDJSON lines in completion order
+    """
+    items: List[ClassroomChatRequest]
+    max_concurrency: Optional[int] = None
+    stream: bool = False
+
+class ClassroomBatchItemResult(BaseModel):
+    """
+    Outcome of one batch item.
+    
+    Attributes:
+        index: Position of the item in the request
+        success: Whether a response was generated
+        response: The classroom response when successful
+        error: Error message when the item failed
+    """
+    index: int
+    success: bool
+    response: Optional[ClassroomChatResponse] = None
+    error: Optional[str] = None
+
+class ClassroomBatchResponse(BaseModel):
+    """Per-item results in request order."""
+    results: List[ClassroomBatchItemResult]
+
 # ==================== AUTH MODELS ====================
 
 class LoginRequest(BaseModel):
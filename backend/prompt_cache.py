@@ -0,0 +1,293 @@
+import os
+import time
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, Optional, Set, Tuple
+
+from llm_client import get_client
+from llm_providers import StageRoute
+from logging_config import get_logger
+
+if TYPE_CHECKING:
+    from google.genai import types
+
+logger = get_logger("prompt_cache")
+
+# Prompt prefix caching configuration (overridable through environment variables)
+# PROMPT_CACHE_BACKEND: 'gemini' (server-side context cache), 'local' (offline stand-in) or 'off'
+PROMPT_CACHE_BACKEND = os.getenv("PROMPT_CACHE_BACKEND", "gemini").lower()
+PROMPT_CACHE_TTL_SECONDS = int(os.getenv("PROMPT_CACHE_TTL_SECONDS", "3600"))
+PROMPT_CACHE_REFRESH_MARGIN_SECONDS = int(os.getenv("PROMPT_CACHE_REFRESH_MARGIN_SECONDS", "60"))
+PROMPT_CACHE_RETRY_SECONDS = int(os.getenv("PROMPT_CACHE_RETRY_SECONDS", "300"))
+# Smallest prompt (in tokens) Gemini accepts for explicit caching; 0 uses the per-model table
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "0"))
+
+# Explicit context caching minimums by model prefix (longest match wins)
+_GEMINI_MIN_CACHE_TOKENS = {
+    "gemini-2.5-flash": 1024,
+    "gemini-2.5-pro": 2048,
+    "gemini": 4096,
+}
+# Rough characters per token, enough to tell whether a prompt can be cached at all
+_CHARS_PER_TOKEN = 4
+
+
+def prompt_version(system_prompt: str) -> str:
+    """Short content hash used to detect prompt edits."""
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:12]
+
+
+@dataclass
+class _CachedPrefix:
+    handle: Optional[str]   # cached content name, or None when registration failed
+    version: str
+    expires_at: float
+
+
+class PromptPrefixCache:
+    """
+    Registers static system prompts once and hands out a reference per call.
+
+    Each (prefix name, model) pair is registered on first use and re-registered
+    when it is about to expire or when the prompt text changes. Registration
+    runs in a background task, never on the request path: calls send the
+    prompt inline until a handle is ready, and keep using the current handle
+    while its refresh is in flight. Prompts the backend cannot cache (too short
+    for the model) are never registered; after other failures (quota, outage)
+    registration is retried after PROMPT_CACHE_RETRY_SECONDS.
+    """
+
+    backend_name = "base"
+
+    def __init__(
+        self,
+        ttl_seconds: int = PROMPT_CACHE_TTL_SECONDS,
+        refresh_margin_seconds: int = PROMPT_CACHE_REFRESH_MARGIN_SECONDS,
+        retry_seconds: int = PROMPT_CACHE_RETRY_SECONDS,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.retry_seconds = retry_seconds
+        self._prefixes: Dict[Tuple[str, str], _CachedPrefix] = {}
+        self._pending: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._uncacheable: Set[Tuple[str, str, str]] = set()
+
+        self.registrations = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.skipped = 0
+        self.cached_calls = 0
+        self.inline_calls = 0
+
+    async def _create(self, name: str, model: str, system_prompt: str, version: str) -> str:
+        raise NotImplementedError
+
+    async def _delete(self, handle: str) -> None:
+        return None
+
+    def supports(self, route: StageRoute) -> bool:
+        """Whether prompts for this route can be registered with the backend."""
+        return True
+
+    def cacheable(self, model: str, system_prompt: str) -> bool:
+        """Whether the backend accepts this prompt for ``model`` (checked before any request)."""
+        return True
+
+    async def resolve(self, name: str, model: str, system_prompt: str) -> Optional[str]:
+        """
+        Return a cached-content handle for the prompt, scheduling registration or refresh if needed.
+
+        Returns:
+            The handle to pass as ``cached_content``, or None to send the prompt inline
+        """
+        key = (name, model)
+        version = prompt_version(system_prompt)
+        entry = self._prefixes.get(key)
+        if self._is_usable(entry, version):
+            return entry.handle
+
+        if not self.cacheable(model, system_prompt):
+            if (name, model, version) not in self._uncacheable:
+                self._uncacheable.add((name, model, version))
+                self.skipped += 1
+                logger.info(
+                    "Prompt prefix too short to cache, sending it inline",
+                    extra={"prefix": name, "model": model, "backend": self.backend_name}
+                )
+            return None
+
+        if key not in self._pending:
+            task = asyncio.create_task(self._register(key, name, model, system_prompt, version))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+
+        # A handle inside its refresh margin stays valid until the new one is ready
+        if entry is not None and entry.handle and entry.version == version and time.monotonic() < entry.expires_at:
+            return entry.handle
+        return None
+
+    async def _register(self, key: Tuple[str, str], name: str, model: str, system_prompt: str, version: str) -> None:
+        """Register (or refresh) one prefix; runs as a background task."""
+        entry = self._prefixes.get(key)
+        stale_handle = entry.handle if entry else None
+        try:
+            handle = await self._create(name, model, system_prompt, version)
+            self._prefixes[key] = _CachedPrefix(
+                handle=handle,
+                version=version,
+                expires_at=time.monotonic() + self.ttl_seconds,
+            )
+            if entry is None:
+                self.registrations += 1
+            else:
+                self.refreshes += 1
+            logger.info(
+                "Prompt prefix registered",
+                extra={"prefix": name, "model": model, "version": version, "backend": self.backend_name}
+            )
+        except Exception as e:
+            self.failures += 1
+            self._prefixes[key] = _CachedPrefix(
+                handle=None,
+                version=version,
+                expires_at=time.monotonic() + self.retry_seconds,
+            )
+            logger.warning(
+                "Prompt prefix registration failed, sending prompt inline",
+                extra={"prefix": name, "model": model, "backend": self.backend_name, "error": str(e)[:200]}
+            )
+
+        if stale_handle and stale_handle != self._prefixes[key].handle:
+            try:
+                await self._delete(stale_handle)
+            except Exception:
+                pass
+
+    def _is_usable(self, entry: Optional[_CachedPrefix], version: str) -> bool:
+        if entry is None or entry.version != version:
+            return False
+        margin = self.refresh_margin_seconds if entry.handle else 0
+        return time.monotonic() < entry.expires_at - margin
+
+    async def prepare_config(
+        self,
+        name: str,
+        route: StageRoute,
+        system_prompt: str,
+        config: "types.GenerateContentConfig"
+    ) -> "types.GenerateContentConfig":
+        """
+        Attach the static prompt to a generation config, by reference when cached.
+
+        Args:
+            name: Prefix name (e.g. 'refiner', 'classroom')
+            route: Stage route the request will be sent to; caches are model specific
+            system_prompt: The static system prompt text
+            config: Per-call generation config
+
+        Returns:
+            A copy of ``config`` with either ``cached_content`` or ``system_instruction`` set
+        """
+        handle = await self.resolve(name, route.model, system_prompt) if self.supports(route) else None
+        if handle:
+            self.cached_calls += 1
+            return config.model_copy(update={"cached_content": handle})
+        self.inline_calls += 1
+        return config.model_copy(update={"system_instruction": system_prompt})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend_name,
+            "prefixes": len(self._prefixes),
+            "registrations": self.registrations,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "cached_calls": self.cached_calls,
+            "inline_calls": self.inline_calls,
+        }
+
+
+def _min_cache_tokens(model: str) -> int:
+    if PROMPT_CACHE_MIN_TOKENS > 0:
+        return PROMPT_CACHE_MIN_TOKENS
+    name = model.split("/")[-1]
+    matches = [prefix for prefix in _GEMINI_MIN_CACHE_TOKENS if name.startswith(prefix)]
+    return _GEMINI_MIN_CACHE_TOKENS[max(matches, key=len)] if matches else _GEMINI_MIN_CACHE_TOKENS["gemini"]
+
+
+class GeminiPromptPrefixCache(PromptPrefixCache):
+    """Prefix cache backed by Gemini explicit context caching."""
+
+    backend_name = "gemini"
+
+    def supports(self, route: StageRoute) -> bool:
+        return route.provider == "gemini"
+
+    def cacheable(self, model: str, system_prompt: str) -> bool:
+        return len(system_prompt) / _CHARS_PER_TOKEN >= _min_cache_tokens(model)
+
+    async def _create(self, name: str, model: str, system_prompt: str, version: str) -> str:
+        from google.genai import types
+
+        cached = await get_client().aio.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                display_name=f"mahaguru-{name}-{version}",
+                system_instruction=system_prompt,
+                ttl=f"{self.ttl_seconds}s",
+            )
+        )
+        return cached.name
+
+    async def _delete(self, handle: str) -> None:
+        await get_client().aio.caches.delete(name=handle)
+
+
+class LocalPromptPrefixCache(PromptPrefixCache):
+    """
+    Offline stand-in with the same register/refresh/expiry lifecycle.
+
+    Handles are local identifiers only, so prepare_config always sends the
+    prompt inline; use it for development and tests without Gemini access.
+    """
+
+    backend_name = "local"
+
+    async def _create(self, name: str, model: str, system_prompt: str, version: str) -> str:
+        return f"local/{name}/{model}/{version}"
+
+    async def prepare_config(
+        self,
+        name: str,
+        route: StageRoute,
+        system_prompt: str,
+        config: "types.GenerateContentConfig"
+    ) -> "types.GenerateContentConfig":
+        handle = await self.resolve(name, route.model, system_prompt)
+        if handle:
+            self.cached_calls += 1
+        else:
+            self.inline_calls += 1
+        return config.model_copy(update={"system_instruction": system_prompt})
+
+
+class DisabledPromptPrefixCache(PromptPrefixCache):
+    """Always sends the prompt inline."""
+
+    backend_name = "off"
+
+    async def resolve(self, name: str, model: str, system_prompt: str) -> Optional[str]:
+        return None
+
+
+def _create_prefix_cache() -> PromptPrefixCache:
+    if PROMPT_CACHE_BACKEND == "local":
+        return LocalPromptPrefixCache()
+    if PROMPT_CACHE_BACKEND == "off":
+        return DisabledPromptPrefixCache()
+    return GeminiPromptPrefixCache()
+
+
+prefix_cache = _create_prefix_cache()
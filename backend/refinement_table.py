@@ -0,0 +1,284 @@
+"""
+Precomputed refine_query results for the most frequent student queries.
+
+Serving: the artifact is loaded once per process and consulted before any
+LLM call for complex queries (see classroom.generate_classroom_response).
+
+Building (from backend/):
+    python refinement_table.py --log queries.log --top 500
+
+The log is either plain text (one query per line) or the server's JSON log,
+where classroom chat lines carry the query in 'user_message' (LOG_LEVEL=DEBUG).
+Rebuilds are incremental: entries built for the current REFINER_SYSTEM_PROMPT
+version and refine model are reused, only new or stale queries hit the LLM.
+"""
+import os
+import copy
+import json
+import asyncio
+import argparse
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from llm_cache import normalize_query
+from llm_client import get_route
+from logging_config import get_logger
+from refiner_agent import REFINER_PROMPT_VERSION, is_fallback_refinement, refine_query
+
+logger = get_logger("refinement_table")
+
+# Refinement table configuration (overridable through environment variables)
+REFINEMENT_TABLE_ENABLED = os.getenv("REFINEMENT_TABLE_ENABLED", "true").lower() in ("1", "true", "yes")
+REFINEMENT_TABLE_PATH = os.getenv("REFINEMENT_TABLE_PATH", "refinement_table.json")
+
+# Bumped when the artifact layout changes
+TABLE_FORMAT = 1
+
+# Per-request fields that are never stored in the table
+_REQUEST_FIELDS = ("original_query", "session_id")
+
+
+def current_version() -> Tuple[str, str]:
+    """(prompt version, refine model) that table entries must match to be served."""
+    return REFINER_PROMPT_VERSION, get_route("refine").model
+
+
+class RefinementTable:
+    """
+    In-memory lookup of precomputed refinement results by normalized query.
+
+    Entries built for another prompt version or model are dropped at load
+    time, so editing REFINER_SYSTEM_PROMPT can never serve outdated
+    suggestions. The table holds a few hundred small entries, so it is read
+    into a dict rather than memory-mapped.
+    """
+
+    def __init__(self, path: str = REFINEMENT_TABLE_PATH, enabled: bool = REFINEMENT_TABLE_ENABLED):
+        self.path = path
+        self.enabled = enabled
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self.built_at: Optional[str] = None
+        self.expected_coverage: Optional[float] = None
+        self.stale_entries = 0
+
+        self.lookups = 0
+        self.hits = 0
+
+        if self.enabled and self.path:
+            self.load()
+
+    def load(self) -> None:
+        """(Re)load the artifact, keeping only entries for the current version."""
+        if not os.path.exists(self.path):
+            logger.info("No refinement table found", extra={"path": self.path})
+            return
+        try:
+            artifact = read_artifact(self.path)
+        except Exception as e:
+            logger.warning("Could not load refinement table", extra={"path": self.path, "error": str(e)[:120]})
+            return
+
+        prompt_version, model = current_version()
+        entries, stale = {}, 0
+        for query, entry in artifact["entries"].items():
+            if entry.get("prompt_version") == prompt_version and entry.get("model") == model:
+                entries[query] = entry["data"]
+            else:
+                stale += 1
+
+        self._entries = entries
+        self.stale_entries = stale
+        self.built_at = artifact.get("built_at")
+        self.expected_coverage = artifact.get("source", {}).get("coverage")
+        logger.info(
+            "Refinement table loaded",
+            extra={"path": self.path, "entries": len(entries), "stale_entries": stale, "built_at": self.built_at}
+        )
+        if stale:
+            logger.warning(
+                "Refinement table has entries for another prompt version or model; rebuild it",
+                extra={"stale_entries": stale}
+            )
+
+    def lookup(self, query: str) -> Optional[Dict[str, Any]]:
+        """Return a private copy of the precomputed result for ``query``, or None."""
+        if not self.enabled or not self._entries:
+            return None
+        self.lookups += 1
+        data = self._entries.get(normalize_query(query))
+        if data is None:
+            return None
+        self.hits += 1
+        return copy.deepcopy(data)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "entries": len(self._entries),
+            "stale_entries": self.stale_entries,
+            "built_at": self.built_at,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            # Share of complex queries answered without an LLM call
+            "absorbed_ratio": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            "expected_coverage": self.expected_coverage,
+        }
+
+
+def read_artifact(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        artifact = json.load(f)
+    if artifact.get("format") != TABLE_FORMAT:
+        raise ValueError(f"Unsupported refinement table format: {artifact.get('format')}")
+    return artifact
+
+
+def write_artifact(path: str, artifact: Dict[str, Any]) -> None:
+    """Write the artifact atomically so serving processes never read a partial file."""
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(artifact, f, ensure_ascii=False, separators=(",", ":"), sort_keys=True, default=str)
+    os.replace(tmp_path, path)
+
+
+# ----------------------------------------------------------------- building
+
+def read_query_log(path: str) -> Tuple[Counter, Dict[str, str]]:
+    """
+    Count normalized queries in a query log.
+
+    Returns:
+        (count per normalized query, first raw spelling per normalized query)
+    """
+    counts: Counter = Counter()
+    spellings: Dict[str, str] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            query = line
+            if line.startswith("{"):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                query = record.get("user_message")
+                if not isinstance(query, str):
+                    continue
+            normalized = normalize_query(query)
+            if not normalized:
+                continue
+            counts[normalized] += 1
+            spellings.setdefault(normalized, query.strip())
+    return counts, spellings
+
+
+async def build_table(
+    log_path: str,
+    output_path: str = REFINEMENT_TABLE_PATH,
+    top_n: int = 500,
+    concurrency: int = 4,
+    full_rebuild: bool = False,
+) -> Dict[str, Any]:
+    """
+    Build or incrementally refresh the table from the most frequent complex queries.
+
+    Returns:
+        Build report (counts and the share of logged traffic the table covers)
+    """
+    # Imported here: classroom imports this module for serving
+    from classroom import classify_query_details
+    from refiner_agent import semantic_cache
+
+    # Every entry should be the refiner's own answer for that exact query
+    semantic_cache.enabled = False
+
+    counts, spellings = read_query_log(log_path)
+    total = sum(counts.values())
+    candidates = [
+        (query, count) for query, count in counts.most_common()
+        if classify_query_details(query)["decision"] == "complex"
+    ][:top_n]
+
+    previous: Dict[str, Any] = {}
+    if not full_rebuild and os.path.exists(output_path):
+        try:
+            previous = read_artifact(output_path)["entries"]
+        except Exception as e:
+            logger.warning("Ignoring unreadable refinement table", extra={"path": output_path, "error": str(e)[:120]})
+
+    prompt_version, model = current_version()
+    entries: Dict[str, Dict[str, Any]] = {}
+    report = {"candidates": len(candidates), "reused": 0, "built": 0, "failed": 0}
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _build(query: str, count: int) -> None:
+        old = previous.get(query)
+        if old and old.get("prompt_version") == prompt_version and old.get("model") == model:
+            entries[query] = {**old, "count": count}
+            report["reused"] += 1
+            return
+        async with semaphore:
+            try:
+                data = await refine_query(spellings[query], start_session=False)
+            except Exception as e:
+                data = {"fallback": True, "error": str(e)}
+        if is_fallback_refinement(data):
+            report["failed"] += 1
+            logger.warning("Refinement failed, query left out of the table", extra={"query": query[:80]})
+            return
+        for field in _REQUEST_FIELDS:
+            data.pop(field, None)
+        entries[query] = {"count": count, "prompt_version": prompt_version, "model": model, "data": data}
+        report["built"] += 1
+
+    await asyncio.gather(*(_build(query, count) for query, count in candidates))
+
+    covered = sum(entry["count"] for entry in entries.values())
+    report.update({
+        "entries": len(entries),
+        "logged_queries": total,
+        "distinct_queries": len(counts),
+        "coverage": round(covered / total, 4) if total else 0.0,
+    })
+    write_artifact(output_path, {
+        "format": TABLE_FORMAT,
+        "prompt_version": prompt_version,
+        "model": model,
+        "built_at": datetime.utcnow().isoformat(),
+        "source": {
+            "log": os.path.basename(log_path),
+            "top_n": top_n,
+            "logged_queries": total,
+            "coverage": report["coverage"],
+        },
+        "entries": entries,
+    })
+    logger.info("Refinement table built", extra={"path": output_path, **report})
+    return report
+
+
+refinement_table = RefinementTable()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", required=True, help="query log (plain text or JSON lines)")
+    parser.add_argument("--output", default=REFINEMENT_TABLE_PATH)
+    parser.add_argument("--top", type=int, default=500, help="number of most frequent queries to precompute")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--full", action="store_true", help="recompute every entry instead of reusing current ones")
+    args = parser.parse_args()
+
+    report = asyncio.run(build_table(args.log, args.output, args.top, args.concurrency, args.full))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,26 @@
 import os
 import json
+import time
 import asyncio
-from typing import Dict, Any, List
+import hashlib
+from typing import Dict, Any, List, Optional, Type, TypeVar
+from pydantic import BaseModel, ValidationError
 from datetime import datetime
-from dotenv import load_dotenv
-from google import genai
-from google.genai import types
-from models import ConversationTurn, FinalRefinementPackage
+from models import (
+    ConversationTurn, FinalRefinementPackage,
+    RefinementDraft, ContinuationDraft, FinalFieldsDraft
+)
+from llm_cache import LLMResponseCache, make_cache_key, normalize_query
+from llm_client import generate_content, get_route
+from logging_config import get_logger
+from prompt_cache import prefix_cache
+from session_store import RefinementSession, SessionNotFoundError, session_store
+from metrics import observe_finalization, observe_stage, record_json_parse_failure
+from semantic_cache import SemanticCache
 
-# Load environment variables
-load_dotenv()
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY not found in environment variables")
+logger = get_logger("refiner")
 
-# Initialize Gemini client
-client = genai.Client(api_key=GEMINI_API_KEY)
+SchemaT = TypeVar("SchemaT", bound=BaseModel)
 
 # System prompt for the refiner agent
 REFINER_SYSTEM_PROMPT = """{
@@ -117,111 +122,202 @@ REFINER_SYSTEM_PROMPT = """{
 }
 """
 
+# Prompt version used in cache keys - changes whenever the system prompt is edited
+REFINER_PROMPT_VERSION = hashlib.sha256(REFINER_SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:12]
+
+# Shared cache for parsed refine/continue/finalize LLM outputs
+response_cache = LLMResponseCache(name="refiner")
+
+# Near-duplicate refine results ("learn ML" ~ "teach me machine learning"),
+# consulted when the exact-key cache misses; tied to the prompt and model
+semantic_cache = SemanticCache(
+    name="refiner", version=f"{REFINER_PROMPT_VERSION}:{get_route('refine').model}"
+)
+
+# Ask the LLM for schema-constrained JSON (response_schema) in the refiner stages
+REFINER_STRUCTURED_OUTPUT = os.getenv("REFINER_STRUCTURED_OUTPUT", "true").lower() in ("1", "true", "yes")
+
+# How the last refinement round is finalized:
+#   'combined' - one call decides and returns the final package fields
+#   'two_call' - decide first, then a separate finalize_refinement_package call
+REFINER_FINALIZE_MODE = os.getenv("REFINER_FINALIZE_MODE", "combined").lower()
+
 def extract_json_from_text(text: str) -> str:
-    print(f"[REFINER] Raw LLM output length: {len(text)} chars")
+    logger.debug("Raw LLM output received", extra={"chars": len(text)})
     
-    # Remove markdown code block markers
-    if '```json' in text:
-        text = text.split('```json', 1)[1]
-    if '```' in text:
-        text = text.split('```')[0]
-    
-    text = text.strip()
-    
-    # Extract JSON object by finding first { and last }
-    start = text.find('{')
-    end = text.rfind('}')
-    
-    if start != -1 and end != -1 and end > start:
-        text = text[start:end+1]
+    with observe_stage("extract_json_from_text"):
+        # Remove markdown code block markers
+        if '```json' in text:
+            text = text.split('```json', 1)[1]
+        if '```' in text:
+            text = text.split('```')[0]
+        
+        text = text.strip()
+        
+        # Extract JSON object by finding first { and last }
+        start = text.find('{')
+        end = text.rfind('}')
+        
+        if start != -1 and end != -1 and end > start:
+            text = text[start:end+1]
     
     return text
 
-async def refine_query(user_query: str) -> Dict[str, Any]:
-    # Build the complete prompt
-    full_prompt = f"""{REFINER_SYSTEM_PROMPT}
+class LLMOutputError(ValueError):
+    """LLM output that is not valid JSON for the expected schema."""
+
+
+def _structured_output(schema: Type[BaseModel]) -> Dict[str, Any]:
+    """Generation config fields requesting JSON output constrained to ``schema``."""
+    if not REFINER_STRUCTURED_OUTPUT:
+        return {}
+    return {"response_mime_type": "application/json", "response_schema": schema}
+
+
+def parse_llm_output(text: str, schema: Type[SchemaT]) -> SchemaT:
+    """
+    Parse and validate LLM output into its schema model in one pass.
+    
+    Structured output is bare JSON and goes straight through pydantic-core's
+    JSON parser; extract_json_from_text is only used for replies wrapped in
+    prose or code fences (structured output disabled or unsupported).
+    
+    Raises:
+        LLMOutputError: The text does not contain valid JSON for ``schema``
+    """
+    try:
+        return schema.model_validate_json(text)
+    except ValidationError:
+        pass
+    try:
+        return schema.model_validate_json(extract_json_from_text(text))
+    except ValidationError as e:
+        raise LLMOutputError(f"Invalid {schema.__name__} output: {e.error_count()} error(s)") from e
 
-Student Query: "{user_query}"
+def _build_refine_prompt(user_query: str) -> str:
+    """Per-call refine prompt; REFINER_SYSTEM_PROMPT is attached via the prefix cache."""
+    return f"""Student Query: "{user_query}"
 
 Analyze this query and provide refinement suggestions in JSON format:"""
+
+async def _generate_refinement(user_query: str) -> Dict[str, Any]:
+    """
+    Call Gemini for the first refinement stage and return the parsed JSON.
+    Raises on empty, malformed or incomplete output so failures are never cached.
+    """
+    full_prompt = _build_refine_prompt(user_query)
+    
+    # Call the model routed to the refine stage
+    route = get_route("refine")
+    config = await prefix_cache.prepare_config(
+        "refiner",
+        route,
+        REFINER_SYSTEM_PROMPT,
+        route.generation_config(**_structured_output(RefinementDraft))
+    )
+    response = await generate_content(
+        "refine",
+        contents=full_prompt,
+        config=config
+    )
+    # Validate response
+    if not response or not response.text:
+        raise ValueError("Empty response from Gemini API")
     
-    print(f"[REFINER] Analyzing query: {user_query[:80]}...")
+    data = parse_llm_output(response.text, RefinementDraft).model_dump()
     
+    # Add question_id to each suggestion
+    for i, suggestion in enumerate(data["suggestions"]):
+        suggestion["question_id"] = f"q_{i+1}"
+    
+    return data
+
+async def start_refinement_session(data: Dict[str, Any], user_query: str) -> None:
+    """
+    Remember the asked questions so follow-ups only need to send answers.
+    Sets data['session_id'] when a session was stored.
+    """
+    if not (data.get('needs_refinement') and data.get('suggestions')):
+        return
     try:
-        # Call Gemini API
-        response = await asyncio.to_thread(
-            client.models.generate_content,
-            model='gemini-2.0-flash-001',
-            contents=full_prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.3,  # Lower temperature for consistent JSON
-                max_output_tokens=500
-            )
-        )
-        #https://ai.google.dev/gemini-api/docs/models#gemini-2.5-flash-lite
-        # Validate response
-        if not response or not response.text:
-            raise ValueError("Empty response from Gemini API")
-        
-        # Extract and parse JSON
-        json_str = extract_json_from_text(response.text)
-        print(f"[REFINER] Extracted JSON: {json_str[:150]}...")
-        
-        # Parse JSON
-        data = json.loads(json_str)
-        
-        # Validate structure
-        if "needs_refinement" not in data:
-            raise ValueError("Missing 'needs_refinement' field in response")
-        
-        # Add question_id to each suggestion
-        if "suggestions" in data and isinstance(data["suggestions"], list):
-            for i, suggestion in enumerate(data["suggestions"]):
-                suggestion["question_id"] = f"q_{i+1}"
+        session = RefinementSession.new(user_query)
+        session.ask(data['suggestions'], data.get('reasoning', ''))
+        await session_store.save(session)
+        data['session_id'] = session.session_id
+    except Exception as e:
+        logger.warning("Could not store refinement session", extra={"error": str(e)})
+
+async def refine_query(user_query: str, start_session: bool = True) -> Dict[str, Any]:
+    """
+    Analyze a student query and suggest refinement questions.
+
+    Args:
+        user_query: The student's query
+        start_session: Store a refinement session for the asked questions
+            (offline callers such as the refinement table build skip it)
+    """
+    logger.debug("Analyzing query", extra={"query_preview": user_query[:80]})
+    
+    try:
+        cache_key = make_cache_key("refine", REFINER_PROMPT_VERSION, get_route("refine").model, normalize_query(user_query))
+
+        async def _compute() -> Dict[str, Any]:
+            similar = semantic_cache.lookup(user_query)
+            if similar is not None:
+                return similar
+            result = await _generate_refinement(user_query)
+            semantic_cache.add(user_query, result)
+            return result
+
+        data = await response_cache.get_or_compute(cache_key, _compute)
         
         # Add original query to response
         data['original_query'] = user_query
         
-        print(f"[REFINER] Refinement {'needed' if data['needs_refinement'] else 'not needed'}")
+        if start_session:
+            await start_refinement_session(data, user_query)
+        
+        logger.info("Refinement analyzed", extra={"needs_refinement": data['needs_refinement']})
         return data
         
-    except json.JSONDecodeError as e:
-        print(f"[REFINER] JSON parsing error: {str(e)}")
+    except LLMOutputError as e:
+        record_json_parse_failure("refine")
+        logger.warning("JSON parsing error in refine_query", extra={"error": str(e)})
         return {
             "needs_refinement": False,
             "suggestions": [],
             "reasoning": "Unable to parse refinement suggestions",
-            "original_query": user_query
+            "original_query": user_query,
+            "fallback": True
         }
     
     except Exception as e:
-        print(f"[REFINER] Error during refinement: {str(e)}")
+        logger.error("Error during refinement", extra={"error": str(e)})
         return {
             "needs_refinement": False,
             "suggestions": [],
             "reasoning": f"Technical error: {str(e)[:50]}",
-            "original_query": user_query
+            "original_query": user_query,
+            "fallback": True
         }
 
-async def continue_refinement(original_query: str, user_answers: List[Dict]) -> Dict[str, Any]:
-    """
-    Continue multi-turn refinement based on user answers.
-    
-    Args:
-        original_query: The original user query
-        user_answers: List of user answers with question_id and answer
-    
-    Returns:
-        Dict with either follow-up questions or finalized refinement
-    """
-    print(f"[REFINER] Continuing refinement for: {original_query[:80]}...")
-    
-    # Format user answers for the prompt
+def is_fallback_refinement(refinement_data: Dict[str, Any]) -> bool:
+    """True when refine_query could not get a usable answer from the LLM."""
+    return bool(refinement_data.get("fallback"))
+
+def _build_continue_prompt(
+    original_query: str,
+    conversation_history: List[Dict],
+    rounds: int,
+    combined: bool = False
+) -> str:
+    """Prompt asking whether another refinement round is needed (and, in combined mode, for the package)."""
+    # Format the question/answer turns for the prompt
     answers_context = "\n".join([
-        f"Q{answer['question_id']}: {answer['answer']}" 
-        for answer in user_answers
+        f"Q: {turn['question']}\nA: {turn['answer']}"
+        for turn in conversation_history
     ])
-    
+
     # Build prompt for continuation
     continue_prompt = f"""
 Based on the original query and user's answers, determine if more refinement is needed or if we can finalize.
@@ -231,6 +327,8 @@ Original Query: "{original_query}"
 User's Answers:
 {answers_context}
 
+Refinement rounds completed so far: {rounds}
+
 Guidelines:
 - Maximum 2 rounds of refinement total
 - If enough context is gathered, set needs_refinement=false
@@ -239,69 +337,176 @@ Guidelines:
 
 Respond in JSON format with the same structure as before.
 """
+    if combined:
+        continue_prompt += """
+If needs_refinement is false, finalize in the same response and also include:
+- refined_query: An enhanced, clear version of the original query that incorporates all gathered context
+- requirements: List of specific requirements/constraints extracted from the answers
+- tags: Categorization tags including academic/non-academic and subject areas
+- confidence: Score from 0.7 to 1.0 based on completeness of information gathered
+
+Format as JSON:
+{
+  "needs_refinement": false,
+  "suggestions": [],
+  "reasoning": "Why the query is now complete",
+  "refined_query": "Enhanced query text here",
+  "requirements": ["requirement1", "requirement2"],
+  "tags": ["tag1", "tag2"],
+  "confidence": 0.85
+}
+"""
+    return continue_prompt
+
+async def _generate_continuation(
+    original_query: str,
+    conversation_history: List[Dict],
+    rounds: int,
+    combined: bool = False
+) -> Dict[str, Any]:
+    """
+    Call Gemini to decide whether another refinement round is needed.
+    In combined mode the same call also returns the final package fields
+    when no more refinement is needed.
+    Raises on empty, malformed or incomplete output so failures are never cached.
+    """
+    continue_prompt = _build_continue_prompt(original_query, conversation_history, rounds, combined)
+    
+    # Call the model routed to the continue stage
+    route = get_route("continue")
+    overrides = _structured_output(ContinuationDraft)
+    if combined:
+        # The combined reply also carries the final package fields
+        overrides["max_output_tokens"] = max(route.max_output_tokens, get_route("finalize").max_output_tokens)
+    response = await generate_content(
+        "continue",
+        contents=continue_prompt,
+        config=route.generation_config(**overrides)
+    )
+    
+    if not response or not response.text:
+        raise ValueError("Empty response from Gemini API")
+    
+    data = parse_llm_output(response.text, ContinuationDraft).model_dump(exclude_none=True)
+    
+    # Add question_id to each new suggestion
+    for i, suggestion in enumerate(data["suggestions"]):
+        suggestion["question_id"] = f"q_followup_{i+1}"
+    
+    return data
+
+async def continue_refinement(
+    original_query: Optional[str],
+    user_answers: List[Dict],
+    session_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Continue multi-turn refinement based on user answers.
+    
+    With a session_id the asked questions, earlier answers and round count
+    come from the session store, so the client only sends the new answers.
+    Without one (or when the session has expired but original_query is
+    given) answers are paired with placeholder questions as before.
+    
+    Args:
+        original_query: The original user query (optional when session_id is given)
+        user_answers: List of user answers with question_id and answer
+        session_id: Refinement session id returned by refine_query
+    
+    Returns:
+        Dict with either follow-up questions or finalized refinement
+    
+    Raises:
+        SessionNotFoundError: If the session is unknown and no original_query was sent
+    """
+    session = await session_store.get(session_id) if session_id else None
+    if session_id and session is None:
+        if not original_query:
+            raise SessionNotFoundError(session_id)
+        logger.warning("Refinement session not found, continuing without it", extra={"session_id": session_id})
+    
+    if session is not None:
+        original_query = session.original_query
+        session.record_answers(user_answers)
+        conversation_history = session.conversation_history
+        rounds = session.rounds
+        previous_reasoning = session.reasoning
+    else:
+        # We don't have the original questions, so use placeholders
+        conversation_history = [
+            {
+                "question_id": answer_data.get("question_id", ""),
+                "question": f"Question {answer_data.get('question_id', '')}",
+                "answer": answer_data.get("answer", "")
+            }
+            for answer_data in user_answers
+        ]
+        rounds = len(user_answers)  # Use number of answers as approximation of rounds
+        previous_reasoning = []
+    
+    logger.debug("Continuing refinement", extra={"query_preview": original_query[:80], "rounds": rounds})
+    
+    combined = REFINER_FINALIZE_MODE == "combined"
+    started = time.perf_counter()
     
     try:
-        # Call Gemini API
-        response = await asyncio.to_thread(
-            client.models.generate_content,
-            model='gemini-2.0-flash-001',
-            contents=continue_prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.3,
-                max_output_tokens=500
-            )
+        cache_key = make_cache_key(
+            "continue_combined" if combined else "continue",
+            REFINER_PROMPT_VERSION,
+            get_route("continue").model,
+            normalize_query(original_query),
+            [[turn['question'], turn['answer'].strip()] for turn in conversation_history],
+            rounds
+        )
+        data = await response_cache.get_or_compute(
+            cache_key, lambda: _generate_continuation(original_query, conversation_history, rounds, combined)
         )
-        
-        if not response or not response.text:
-            raise ValueError("Empty response from Gemini API")
-        
-        # Extract and parse JSON
-        json_str = extract_json_from_text(response.text)
-        print(f"[REFINER] Continue refinement JSON: {json_str[:150]}...")
-        
-        data = json.loads(json_str)
-        
-        # Validate structure
-        if "needs_refinement" not in data:
-            raise ValueError("Missing 'needs_refinement' field in response")
-        
-        # Add question_id to each new suggestion
-        if "suggestions" in data and isinstance(data["suggestions"], list):
-            for i, suggestion in enumerate(data["suggestions"]):
-                suggestion["question_id"] = f"q_followup_{i+1}"
         
         # Ensure consistent data structure
         needs_refinement = data.get('needs_refinement', True)
         
         if needs_refinement:
             # More refinement needed
+            suggestions = data.get('suggestions', [])
+            if session is not None:
+                session.ask(suggestions, data.get('reasoning', ''))
+                await session_store.save(session)
             return {
                 "needs_refinement": True,
-                "suggestions": data.get('suggestions', []),
+                "suggestions": suggestions,
                 "reasoning": data.get('reasoning', ''),
                 "original_query": original_query,
-                "final_package": None
+                "final_package": None,
+                "session_id": session.session_id if session is not None else None
             }
         else:
             # Refinement complete - generate final package
-            print("[REFINER] Refinement complete, generating final package...")
+            all_reasoning = " ".join(previous_reasoning + [data.get('reasoning', '')]).strip()
             
-            # Build conversation history from user answers
-            conversation_history = []
-            for answer_data in user_answers:
-                conversation_history.append({
-                    "question_id": answer_data.get("question_id", ""),
-                    "question": f"Question {answer_data.get('question_id', '')}",  # We don't store original questions, so use placeholder
-                    "answer": answer_data.get("answer", "")
-                })
+            if combined and data.get('refined_query'):
+                # Decide-and-finalize: the same call already returned the package fields
+                path = "combined"
+                final_package = _build_final_package(
+                    original_query, conversation_history, all_reasoning, rounds, data
+                )
+            else:
+                path = "combined_fallback" if combined else "two_call"
+                logger.info("Refinement complete, generating final package")
+                final_package = await finalize_refinement_package(
+                    original_query=original_query,
+                    conversation_history=conversation_history,
+                    all_reasoning=all_reasoning,
+                    rounds=rounds
+                )
             
-            # Generate final package
-            final_package = await finalize_refinement_package(
-                original_query=original_query,
-                conversation_history=conversation_history,
-                all_reasoning=data.get('reasoning', ''),
-                rounds=len(user_answers)  # Use number of answers as approximation of rounds
+            elapsed = time.perf_counter() - started
+            observe_finalization(path, elapsed)
+            logger.info(
+                "Refinement finalized",
+                extra={"path": path, "latency_ms": round(elapsed * 1000, 2)}
             )
+            if session is not None:
+                await session_store.delete(session.session_id)
             
             return {
                 "needs_refinement": False,
@@ -311,67 +516,62 @@ Respond in JSON format with the same structure as before.
                 "final_package": final_package
             }
         
-        print(f"[REFINER] Continue refinement {'needed' if needs_refinement else 'complete'}")
-        
-    except json.JSONDecodeError as e:
-        print(f"[REFINER] JSON parsing error in continue_refinement: {str(e)}")
-        
-        # Create fallback response and generate final package since we're ending refinement
-        fallback_data = {
-            "needs_refinement": False,
-            "suggestions": [],
-            "reasoning": "Refinement completed based on provided answers",
-            "original_query": original_query
-        }
-        
-        # Generate final package for fallback
-        conversation_history = []
-        for answer_data in user_answers:
-            conversation_history.append({
-                "question_id": answer_data.get("question_id", ""),
-                "question": f"Question {answer_data.get('question_id', '')}",
-                "answer": answer_data.get("answer", "")
-            })
-        
-        final_package = await finalize_refinement_package(
-            original_query=original_query,
-            conversation_history=conversation_history,
-            all_reasoning="Refinement completed based on provided answers",
-            rounds=len(user_answers)
-        )
-        
-        fallback_data['final_package'] = final_package
-        return fallback_data
+    except LLMOutputError as e:
+        record_json_parse_failure("continue")
+        logger.warning("JSON parsing error in continue_refinement", extra={"error": str(e)})
+        fallback_reasoning = "Refinement completed based on provided answers"
     
     except Exception as e:
-        print(f"[REFINER] Error during continue_refinement: {str(e)}")
-        
-        # Create fallback response and generate final package since we're ending refinement
-        fallback_data = {
-            "needs_refinement": False,
-            "suggestions": [],
-            "reasoning": f"Technical error: {str(e)[:50]}",
-            "original_query": original_query
-        }
-        
-        # Generate final package for fallback
-        conversation_history = []
-        for answer_data in user_answers:
-            conversation_history.append({
-                "question_id": answer_data.get("question_id", ""),
-                "question": f"Question {answer_data.get('question_id', '')}",
-                "answer": answer_data.get("answer", "")
-            })
-        
-        final_package = await finalize_refinement_package(
-            original_query=original_query,
-            conversation_history=conversation_history,
-            all_reasoning=f"Technical error: {str(e)[:50]}",
-            rounds=len(user_answers)
-        )
-        
-        fallback_data['final_package'] = final_package
-        return fallback_data
+        logger.error("Error during continue_refinement", extra={"error": str(e)})
+        fallback_reasoning = f"Technical error: {str(e)[:50]}"
+    
+    # Create fallback response and generate final package since we're ending refinement
+    final_package = await finalize_refinement_package(
+        original_query=original_query,
+        conversation_history=conversation_history,
+        all_reasoning=fallback_reasoning,
+        rounds=rounds
+    )
+    if session is not None:
+        await session_store.delete(session.session_id)
+    
+    return {
+        "needs_refinement": False,
+        "suggestions": [],
+        "reasoning": fallback_reasoning,
+        "original_query": original_query,
+        "final_package": final_package
+    }
+
+def _build_final_package(
+    original_query: str,
+    conversation_history: List[Dict],
+    all_reasoning: str,
+    rounds: int,
+    gemini_data: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Assemble a FinalRefinementPackage dict from the LLM's finalization fields."""
+    # Convert conversation history to ConversationTurn format
+    conversation_turns = []
+    for qa in conversation_history:
+        conversation_turns.append({
+            "question_id": qa.get("question_id", ""),
+            "question": qa.get("question", ""),
+            "answer": qa.get("answer", "")
+        })
+    
+    # Build final package
+    return {
+        "original_query": original_query,
+        "refined_query": gemini_data.get("refined_query", original_query),
+        "conversation_history": conversation_turns,
+        "requirements": gemini_data.get("requirements", []),
+        "reasoning": all_reasoning,
+        "refinement_rounds": rounds,
+        "confidence": gemini_data.get("confidence", 0.8),
+        "tags": gemini_data.get("tags", []),
+        "timestamp": datetime.now().isoformat()
+    }
 
 async def finalize_refinement_package(
     original_query: str,
@@ -391,7 +591,7 @@ async def finalize_refinement_package(
     Returns:
         Dict containing FinalRefinementPackage structure
     """
-    print(f"[REFINER] Finalizing refinement package for: {original_query[:80]}...")
+    logger.debug("Finalizing refinement package", extra={"query_preview": original_query[:80]})
     
     # Build conversation context for Gemini
     conversation_context = ""
@@ -424,52 +624,40 @@ Format as JSON:
 }}
 """
     
-    try:
-        # Call Gemini for refinement finalization
-        response = await asyncio.to_thread(
-            client.models.generate_content,
-            model='gemini-2.0-flash-001',
+    async def _generate_final_fields() -> Dict[str, Any]:
+        # Call the model routed to the finalize stage
+        response = await generate_content(
+            "finalize",
             contents=finalization_prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.3,
-                max_output_tokens=800
-            )
+            config=get_route("finalize").generation_config(**_structured_output(FinalFieldsDraft))
         )
         
         if not response or not response.text:
             raise ValueError("Empty response from Gemini API")
         
-        # Extract and parse JSON
-        json_str = extract_json_from_text(response.text)
-        gemini_data = json.loads(json_str)
-        
-        # Convert conversation history to ConversationTurn format
-        conversation_turns = []
-        for qa in conversation_history:
-            conversation_turns.append({
-                "question_id": qa.get("question_id", ""),
-                "question": qa.get("question", ""),
-                "answer": qa.get("answer", "")
-            })
+        return parse_llm_output(response.text, FinalFieldsDraft).model_dump()
+    
+    try:
+        cache_key = make_cache_key(
+            "finalize",
+            REFINER_PROMPT_VERSION,
+            get_route("finalize").model,
+            normalize_query(original_query),
+            [[qa.get('question', ''), qa.get('answer', '')] for qa in conversation_history],
+            all_reasoning
+        )
+        gemini_data = await response_cache.get_or_compute(cache_key, _generate_final_fields)
         
-        # Build final package
-        final_package = {
-            "original_query": original_query,
-            "refined_query": gemini_data.get("refined_query", original_query),
-            "conversation_history": conversation_turns,
-            "requirements": gemini_data.get("requirements", []),
-            "reasoning": all_reasoning,
-            "refinement_rounds": rounds,
-            "confidence": gemini_data.get("confidence", 0.8),
-            "tags": gemini_data.get("tags", []),
-            "timestamp": datetime.now().isoformat()
-        }
+        final_package = _build_final_package(
+            original_query, conversation_history, all_reasoning, rounds, gemini_data
+        )
         
-        print(f"[REFINER] Package created with confidence: {final_package['confidence']}")
+        logger.info("Final package created", extra={"confidence": final_package['confidence']})
         return final_package
         
-    except json.JSONDecodeError as e:
-        print(f"[REFINER] JSON parsing error in finalization: {str(e)}")
+    except LLMOutputError as e:
+        record_json_parse_failure("finalize")
+        logger.warning("JSON parsing error in finalization", extra={"error": str(e)})
         # Fallback package
         return {
             "original_query": original_query,
@@ -484,7 +672,7 @@ Format as JSON:
         }
     
     except Exception as e:
-        print(f"[REFINER] Error during finalization: {str(e)}")
+        logger.error("Error during finalization", extra={"error": str(e)})
         # Fallback package
         return {
             "original_query": original_query,
@@ -0,0 +1,317 @@
+import os
+import json
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from pydantic import BaseModel, ValidationError
+from starlette.websockets import WebSocket, WebSocketDisconnect, WebSocketState
+
+from admission import AdmissionRejected, AdmissionTicket, admission_controller
+from classroom import classify_message, generate_classroom_response
+from logging_config import get_logger
+from metrics import METRICS_ENABLED, WS_CONNECTIONS, WS_MESSAGES
+from models import (
+    ClassroomChatRequest, ClassroomChatResponse, ContinueRefinementRequest, ContinueRefinementResponse
+)
+from refiner_agent import continue_refinement
+from session_store import SessionNotFoundError, session_store
+
+logger = get_logger("refiner_socket")
+
+# Refinement WebSocket configuration (overridable through environment variables)
+# Server heartbeat interval; any client frame counts as a sign of life
+WS_HEARTBEAT_SECONDS = float(os.getenv("WS_HEARTBEAT_SECONDS", "20"))
+# Idle connections (no client frame, nothing in flight) are closed after this long
+WS_IDLE_TIMEOUT_SECONDS = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "120"))
+# How long a result computed for a dropped connection waits for a 'resume'
+WS_RESUME_SECONDS = float(os.getenv("WS_RESUME_SECONDS", "120"))
+WS_RESUME_MAX_ENTRIES = int(os.getenv("WS_RESUME_MAX_ENTRIES", "1000"))
+WS_MAX_MESSAGE_BYTES = int(os.getenv("WS_MAX_MESSAGE_BYTES", str(64 * 1024)))
+
+# Close code sent to idle connections (RFC 6455 "going away")
+_CLOSE_IDLE = 1001
+
+
+class DetachedResults:
+    """
+    Answer rounds whose connection dropped while they were being computed.
+
+    The computation is left running and parked here under its session id, so
+    a client that reconnects and sends 'resume' gets the suggestions or final
+    package instead of losing them. Entries are process-local and expire
+    after WS_RESUME_SECONDS.
+    """
+
+    def __init__(self, ttl_seconds: float = WS_RESUME_SECONDS, max_entries: int = WS_RESUME_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._tasks: "OrderedDict[str, Tuple[asyncio.Task, float]]" = OrderedDict()
+
+        self.parked = 0
+        self.claimed = 0
+        self.expired = 0
+
+    def park(self, session_id: str, task: "asyncio.Task") -> None:
+        self._purge()
+        self._tasks.pop(session_id, None)
+        self._tasks[session_id] = (task, time.monotonic() + self.ttl_seconds)
+        self.parked += 1
+        while len(self._tasks) > self.max_entries:
+            self._drop(next(iter(self._tasks)))
+
+    def claim(self, session_id: str) -> Optional["asyncio.Task"]:
+        self._purge()
+        item = self._tasks.pop(session_id, None)
+        if item is None:
+            return None
+        self.claimed += 1
+        return item[0]
+
+    def _purge(self) -> None:
+        now = time.monotonic()
+        while self._tasks:
+            session_id, (_, expires_at) = next(iter(self._tasks.items()))
+            if expires_at > now:
+                break
+            self._drop(session_id)
+
+    def _drop(self, session_id: str) -> None:
+        task, _ = self._tasks.pop(session_id)
+        self.expired += 1
+        if task.done() and not task.cancelled():
+            task.exception()  # retrieved, so asyncio does not log it as never retrieved
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._tasks),
+            "parked": self.parked,
+            "claimed": self.claimed,
+            "expired": self.expired,
+        }
+
+
+detached_results = DetachedResults()
+
+
+def _continue_message(result: Dict[str, Any], original_query: Optional[str]) -> Tuple[str, ContinueRefinementResponse]:
+    """Turn a continue_refinement result into a 'suggestions' or 'final' frame."""
+    result.setdefault('suggestions', [])
+    result.setdefault('reasoning', '')
+    result.setdefault('original_query', original_query)
+    response = ContinueRefinementResponse(**result)
+    return ("suggestions" if response.needs_refinement else "final"), response
+
+
+class RefinerSocket:
+    """
+    One WebSocket connection carrying a whole refinement conversation.
+
+    Client frames are JSON objects with a 'type':
+        start    ClassroomChatRequest fields; answered with a 'response' frame
+                 (a direct answer, or suggestions plus the session id)
+        answers  {'answers': [...]} for the current session (session_id and
+                 original_query optional); answered with 'suggestions' for
+                 another round or 'final' with the FinalRefinementPackage
+        resume   {'session_id': ...} after a reconnect; answered with the
+                 result computed while disconnected, or the pending questions
+        ping     answered with 'pong'; 'pong' frames are accepted silently
+
+    The server sends 'ping' every WS_HEARTBEAT_SECONDS and reports problems as
+    'error' frames with a 'code' (invalid_message, busy, session_not_found,
+    throttled, overloaded, internal_error) without closing the connection.
+    Turn state lives in the session store, so only the session id is kept
+    here. One operation runs at a time per connection.
+    """
+
+    def __init__(self, websocket: WebSocket, client_key: Callable[[Optional[str]], str]):
+        self.websocket = websocket
+        self.client_key = client_key
+        self.session_id: Optional[str] = None
+        self._operation: Optional[asyncio.Task] = None
+        # Answer round in flight as (session_id, task), parked if the client drops
+        self._computing: Optional[Tuple[str, asyncio.Task]] = None
+        self._send_lock = asyncio.Lock()
+        self._last_received = time.monotonic()
+        self._closed = False
+
+    async def run(self) -> None:
+        """Serve the connection until the client disconnects or idles out."""
+        await self.websocket.accept()
+        if METRICS_ENABLED:
+            WS_CONNECTIONS.inc()
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                self._last_received = time.monotonic()
+                await self._dispatch(message.get("text"))
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self._closed = True
+            heartbeat.cancel()
+            self._detach()
+            if METRICS_ENABLED:
+                WS_CONNECTIONS.dec()
+
+    async def _dispatch(self, text: Optional[str]) -> None:
+        if text is None or len(text) > WS_MAX_MESSAGE_BYTES:
+            await self._send_error("invalid_message", "Send JSON text frames under the size limit.")
+            return
+        try:
+            payload = json.loads(text)
+        except ValueError:
+            payload = None
+        kind = payload.get("type") if isinstance(payload, dict) else None
+        handler = {"start": self._start, "answers": self._answers, "resume": self._resume}.get(kind)
+        if METRICS_ENABLED:
+            WS_MESSAGES.labels(kind if handler is not None or kind in ("ping", "pong") else "invalid").inc()
+
+        if kind == "ping":
+            await self._send({"type": "pong"})
+        elif kind == "pong":
+            pass
+        elif handler is None:
+            await self._send_error("invalid_message", "Unknown or missing message type.")
+        elif self._operation is not None and not self._operation.done():
+            await self._send_error("busy", "Wait for the current reply before sending another message.")
+        else:
+            self._operation = asyncio.create_task(self._run_operation(handler, payload))
+
+    async def _run_operation(self, handler: Callable[[Dict[str, Any]], Awaitable[None]], payload: Dict[str, Any]) -> None:
+        try:
+            await handler(payload)
+        except ValidationError as e:
+            await self._send_error("invalid_message", str(e.errors()[0].get("msg", "Invalid message"))[:200])
+        except SessionNotFoundError:
+            await self._send_error("session_not_found", "Refinement session not found or expired. Please start again.")
+        except AdmissionRejected as e:
+            code = "throttled" if e.status_code == 429 else "overloaded"
+            await self._send_error(code, "Please try again shortly.", retry_after=int(e.retry_after_header))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Error in refinement socket")
+            await self._send_error("internal_error", "An error occurred while processing your request. Please try again.")
+
+    async def _admit(self, user_id: Optional[str], interactive: bool) -> AdmissionTicket:
+        return await admission_controller.acquire(self.client_key(user_id), interactive)
+
+    async def _start(self, payload: Dict[str, Any]) -> None:
+        request = ClassroomChatRequest.model_validate(payload)
+        classification = classify_message(request.user_message)
+        ticket = await self._admit(request.user_id, classification["decision"] == "simple")
+        try:
+            response_data = await generate_classroom_response(
+                user_message=request.user_message,
+                conversation_history=request.conversation_history,
+                locale=request.locale,
+                classification=classification
+            )
+        finally:
+            ticket.release()
+        response = ClassroomChatResponse(**response_data)
+        refinement = response.refinement_data
+        self.session_id = refinement.session_id if refinement is not None else None
+        await self._send_model("response", response)
+
+    async def _answers(self, payload: Dict[str, Any]) -> None:
+        request = ContinueRefinementRequest.model_validate(
+            {**payload, "session_id": payload.get("session_id") or self.session_id}
+        )
+        if not request.session_id and not request.original_query:
+            await self._send_error("session_not_found", "No refinement in progress. Send 'start' or 'resume' first.")
+            return
+
+        ticket = await self._admit(request.user_id, interactive=False)
+        compute = asyncio.create_task(continue_refinement(
+            original_query=request.original_query,
+            user_answers=[{"question_id": a.question_id, "answer": a.answer} for a in request.answers],
+            session_id=request.session_id
+        ))
+        # The round outlives its connection, so the slot is returned when it finishes
+        compute.add_done_callback(lambda _: ticket.release())
+        self._computing = (request.session_id, compute) if request.session_id else None
+        try:
+            result = await asyncio.shield(compute)
+        finally:
+            if not self._closed:
+                self._computing = None
+
+        kind, response = _continue_message(result, request.original_query)
+        self.session_id = response.session_id if kind == "suggestions" else None
+        if not await self._send_model(kind, response) and request.session_id:
+            detached_results.park(request.session_id, compute)
+
+    async def _resume(self, payload: Dict[str, Any]) -> None:
+        session_id = payload.get("session_id")
+        if not isinstance(session_id, str) or not session_id:
+            await self._send_error("invalid_message", "'resume' needs a session_id.")
+            return
+
+        parked = detached_results.claim(session_id)
+        if parked is not None:
+            logger.info("Refinement resumed with a detached result", extra={"session_id": session_id})
+            kind, response = _continue_message(await parked, None)
+            self.session_id = response.session_id if kind == "suggestions" else None
+            await self._send_model(kind, response)
+            return
+
+        session = await session_store.get(session_id)
+        if session is None:
+            raise SessionNotFoundError(session_id)
+        logger.info("Refinement resumed", extra={"session_id": session_id, "rounds": session.rounds})
+        self.session_id = session_id
+        await self._send_model("suggestions", ContinueRefinementResponse(
+            needs_refinement=True,
+            suggestions=list(session.pending_questions.values()),
+            reasoning=session.reasoning[-1] if session.reasoning else "",
+            original_query=session.original_query,
+            session_id=session_id
+        ))
+
+    def _detach(self) -> None:
+        """On disconnect, park an answer round in flight instead of dropping its result."""
+        if self._computing is not None:
+            session_id, compute = self._computing
+            detached_results.park(session_id, compute)
+            logger.info("Refinement socket closed mid-round; result kept for resume", extra={"session_id": session_id})
+        if self._operation is not None and not self._operation.done():
+            self._operation.cancel()
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_SECONDS)
+            busy = self._operation is not None and not self._operation.done()
+            if not busy and time.monotonic() - self._last_received > WS_IDLE_TIMEOUT_SECONDS:
+                logger.info("Closing idle refinement socket", extra={"session_id": self.session_id})
+                try:
+                    await self.websocket.close(code=_CLOSE_IDLE)
+                except Exception:
+                    pass
+                return
+            await self._send({"type": "ping", "ts": time.time()})
+
+    async def _send_model(self, kind: str, model: BaseModel) -> bool:
+        return await self._send({"type": kind, "data": model.model_dump(mode="json")})
+
+    async def _send_error(self, code: str, detail: str, retry_after: Optional[int] = None) -> bool:
+        frame: Dict[str, Any] = {"type": "error", "code": code, "detail": detail}
+        if retry_after is not None:
+            frame["retry_after"] = retry_after
+        return await self._send(frame)
+
+    async def _send(self, frame: Dict[str, Any]) -> bool:
+        """Send one frame; False when the connection is already gone."""
+        if self._closed or self.websocket.application_state != WebSocketState.CONNECTED:
+            return False
+        try:
+            async with self._send_lock:
+                await self.websocket.send_text(json.dumps(frame, ensure_ascii=False))
+            return True
+        except (WebSocketDisconnect, RuntimeError, OSError):
+            return False
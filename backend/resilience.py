@@ -0,0 +1,400 @@
+import os
+import time
+import random
+import sys
+import asyncio
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Optional
+
+from latency import LatencyTracker
+from llm_providers import FakeProviderError, StageRoute
+from logging_config import get_logger
+from metrics import (
+    LLM_BREAKER_FAST_FAILED, LLM_BREAKER_OPENED, LLM_BREAKER_STATE, LLM_HEDGE_WINS, LLM_HEDGES,
+    LLM_HEDGES_SKIPPED, LLM_RETRIES, LLM_TIMEOUTS, METRICS_ENABLED
+)
+
+if TYPE_CHECKING:
+    from llm_client import LLMConcurrencyPool
+
+logger = get_logger("resilience")
+
+
+def _stage_setting(name: str, stage: str, default: str) -> str:
+    """Read ``<name>_<STAGE>``, falling back to ``<name>`` and then ``default``."""
+    return os.getenv(f"{name}_{stage.upper()}", os.getenv(name, default))
+
+
+def _stage_flag(name: str, stage: str, default: str) -> bool:
+    return _stage_setting(name, stage, default).lower() in ("1", "true", "yes")
+
+
+# Circuit breaker configuration (per provider/model)
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+LLM_BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+
+# Minimum latency samples before hedging uses the observed percentile
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+# Values of the breaker state gauge
+_BREAKER_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling upstream while a model's circuit breaker is open."""
+
+
+@dataclass(frozen=True)
+class ResiliencePolicy:
+    """
+    Timeout, retry and hedging settings for one call site.
+
+    Every setting reads ``LLM_<SETTING>_<STAGE>`` first and then the global
+    ``LLM_<SETTING>`` (e.g. LLM_TIMEOUT_SECONDS_REFINE, LLM_TIMEOUT_SECONDS).
+    """
+    timeout_seconds: float
+    max_attempts: int
+    retry_base_delay: float
+    retry_max_delay: float
+    hedge_enabled: bool
+    hedge_percentile: float
+    hedge_min_delay: float
+
+    @classmethod
+    def for_stage(cls, stage: str) -> "ResiliencePolicy":
+        return cls(
+            timeout_seconds=float(_stage_setting("LLM_TIMEOUT_SECONDS", stage, "30")),
+            max_attempts=max(1, int(_stage_setting("LLM_RETRY_MAX_ATTEMPTS", stage, "3"))),
+            retry_base_delay=float(_stage_setting("LLM_RETRY_BASE_DELAY_MS", stage, "200")) / 1000,
+            retry_max_delay=float(_stage_setting("LLM_RETRY_MAX_DELAY_MS", stage, "2000")) / 1000,
+            hedge_enabled=_stage_flag("LLM_HEDGE_ENABLED", stage, "true"),
+            hedge_percentile=float(_stage_setting("LLM_HEDGE_PERCENTILE", stage, "95")),
+            hedge_min_delay=float(_stage_setting("LLM_HEDGE_MIN_DELAY_MS", stage, "500")) / 1000,
+        )
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff before retry number ``attempt`` (1-based)."""
+        ceiling = min(self.retry_max_delay, self.retry_base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+
+def is_transient(error: BaseException) -> bool:
+    """Whether an error is worth retrying and counts against upstream health."""
+    if isinstance(error, (asyncio.TimeoutError, FakeProviderError)):
+        return True
+    # httpx and the Gemini SDK are imported lazily; if a module was never
+    # loaded, the error cannot be one of its types
+    httpx = sys.modules.get("httpx")
+    if httpx is not None and isinstance(error, httpx.TransportError):
+        return True
+    genai_errors = sys.modules.get("google.genai.errors")
+    if genai_errors is not None and isinstance(error, genai_errors.APIError):
+        return error.code == 429 or (error.code or 0) >= 500
+    return False
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one upstream model.
+
+    Closed: calls pass through. After ``failure_threshold`` consecutive
+    transient failures it opens and fast-fails every call for
+    ``open_seconds``. Then a single half-open probe is let through; its
+    success closes the breaker and its failure re-opens it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = LLM_BREAKER_FAILURE_THRESHOLD,
+        open_seconds: float = LLM_BREAKER_OPEN_SECONDS,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_started_at: Optional[float] = None
+
+        self.opened = 0
+        self.fast_failed = 0
+
+        if METRICS_ENABLED:
+            LLM_BREAKER_STATE.labels(name).set_function(lambda: _BREAKER_STATE_VALUES[self.state])
+
+    def allow(self) -> bool:
+        """Return True if a call may go upstream now."""
+        if self.state == "closed":
+            return True
+        now = time.monotonic()
+        if self.state == "open" and now - self._opened_at >= self.open_seconds:
+            self.state = "half_open"
+            self._probe_started_at = None
+        # A probe that never reported back (e.g. cancelled) is replaced after open_seconds
+        probe_idle = self._probe_started_at is None or now - self._probe_started_at >= self.open_seconds
+        if self.state == "half_open" and probe_idle:
+            self._probe_started_at = now
+            return True
+        self.fast_failed += 1
+        if METRICS_ENABLED:
+            LLM_BREAKER_FAST_FAILED.labels(self.name).inc()
+        return False
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            logger.info("Circuit breaker closed", extra={"breaker": self.name})
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._probe_started_at = None
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opened += 1
+                if METRICS_ENABLED:
+                    LLM_BREAKER_OPENED.labels(self.name).inc()
+                logger.warning(
+                    "Circuit breaker opened",
+                    extra={"breaker": self.name, "consecutive_failures": self.consecutive_failures}
+                )
+            self.state = "open"
+            self._opened_at = time.monotonic()
+            self._probe_started_at = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "opened": self.opened,
+            "fast_failed": self.fast_failed,
+        }
+
+
+class StageCallStats:
+    """Counters for one call site, mirrored to Prometheus by stage and model."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.model = ""
+        self.latency = LatencyTracker(f"llm.{stage}")
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedges_skipped = 0
+        self.failures = 0
+        self.fast_failed = 0
+
+    def count(self, event: str) -> None:
+        """Increment ``event`` ('retries', 'timeouts', 'hedges', 'hedge_wins' or 'hedges_skipped')."""
+        setattr(self, event, getattr(self, event) + 1)
+        if METRICS_ENABLED:
+            _EVENT_COUNTERS[event].labels(self.stage, self.model).inc()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedges_skipped": self.hedges_skipped,
+            "failures": self.failures,
+            "fast_failed": self.fast_failed,
+            "latency": self.latency.stats(),
+        }
+
+
+_EVENT_COUNTERS = {
+    "retries": LLM_RETRIES,
+    "timeouts": LLM_TIMEOUTS,
+    "hedges": LLM_HEDGES,
+    "hedge_wins": LLM_HEDGE_WINS,
+    "hedges_skipped": LLM_HEDGES_SKIPPED,
+}
+
+
+class ResilientCaller:
+    """
+    Wraps LLM calls with per-attempt timeouts, jittered retries, hedged
+    duplicate requests and per-model circuit breakers.
+
+    When a concurrency pool is given, every attempt first waits for a slot
+    and only then starts its timeout and latency clock, so time queued
+    locally never counts as upstream slowness. Hedges are only sent when the
+    primary is running upstream and a slot is free right away.
+    """
+
+    def __init__(self):
+        self._policies: Dict[str, ResiliencePolicy] = {}
+        self._stats: Dict[str, StageCallStats] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def policy(self, stage: str) -> ResiliencePolicy:
+        if stage not in self._policies:
+            self._policies[stage] = ResiliencePolicy.for_stage(stage)
+        return self._policies[stage]
+
+    def breaker(self, route: StageRoute) -> CircuitBreaker:
+        name = f"{route.provider}:{route.model}"
+        if name not in self._breakers:
+            self._breakers[name] = CircuitBreaker(name)
+        return self._breakers[name]
+
+    def _stage_stats(self, stage: str) -> StageCallStats:
+        if stage not in self._stats:
+            self._stats[stage] = StageCallStats(stage)
+        return self._stats[stage]
+
+    def check_breaker(self, route: StageRoute) -> None:
+        """Raise CircuitOpenError if the route's model is currently fast-failing."""
+        if not self.breaker(route).allow():
+            self._stage_stats(route.stage).fast_failed += 1
+            raise CircuitOpenError(f"Circuit open for {route.provider}:{route.model}")
+
+    def record_outcome(self, route: StageRoute, error: Optional[BaseException]) -> None:
+        """Feed a call outcome made outside call() (e.g. a stream) into the breaker."""
+        breaker = self.breaker(route)
+        if error is not None and is_transient(error):
+            breaker.record_failure()
+        else:
+            # Non-transient errors (bad request, parse errors) still mean upstream answered
+            breaker.record_success()
+
+    def _hedge_delay(self, stats: StageCallStats, policy: ResiliencePolicy) -> Optional[float]:
+        if not policy.hedge_enabled or stats.latency.count < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        observed = stats.latency.percentile(policy.hedge_percentile) or 0.0
+        return max(policy.hedge_min_delay, observed)
+
+    async def _attempt(
+        self,
+        fn: Callable[[], Awaitable[Any]],
+        policy: ResiliencePolicy,
+        stats: StageCallStats,
+        pool: Optional["LLMConcurrencyPool"] = None,
+        lane: str = "standard",
+        running: Optional[asyncio.Event] = None
+    ) -> Any:
+        async with pool.slot(lane) if pool is not None else nullcontext():
+            if running is not None:
+                running.set()
+            stats.attempts += 1
+            started = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(fn(), timeout=policy.timeout_seconds)
+            except asyncio.TimeoutError:
+                stats.count("timeouts")
+                raise
+            stats.latency.record(time.perf_counter() - started)
+            return result
+
+    async def _hedged_attempt(
+        self,
+        route: StageRoute,
+        fn: Callable[[], Awaitable[Any]],
+        policy: ResiliencePolicy,
+        stats: StageCallStats,
+        pool: Optional["LLMConcurrencyPool"] = None,
+        lane: str = "standard"
+    ) -> Any:
+        """Run one attempt, racing a duplicate request if it outlives the hedge delay upstream."""
+        hedge_delay = self._hedge_delay(stats, policy)
+        running = asyncio.Event()
+        primary = asyncio.create_task(self._attempt(fn, policy, stats, pool, lane, running))
+        tasks = {primary}
+        try:
+            if hedge_delay is not None:
+                # The hedge delay counts from when the primary holds a slot, not from when it queued
+                started = asyncio.create_task(running.wait())
+                await asyncio.wait({primary, started}, return_when=asyncio.FIRST_COMPLETED)
+                started.cancel()
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done:
+                    if pool is not None and not pool.has_capacity(lane):
+                        # A hedge that has to queue cannot beat the primary
+                        stats.count("hedges_skipped")
+                    else:
+                        stats.count("hedges")
+                        logger.debug("Launching hedged request", extra={"stage": route.stage, "delay_s": round(hedge_delay, 3)})
+                        tasks.add(asyncio.create_task(self._attempt(fn, policy, stats, pool, lane)))
+
+            error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            stats.count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def call(
+        self,
+        route: StageRoute,
+        fn: Callable[[], Awaitable[Any]],
+        pool: Optional["LLMConcurrencyPool"] = None,
+        lane: str = "standard"
+    ) -> Any:
+        """
+        Call upstream through the route's breaker with timeouts, retries and hedging.
+
+        Args:
+            route: Stage route being called (selects policy and breaker)
+            fn: Coroutine factory performing one upstream attempt
+            pool: Concurrency pool each attempt takes a slot from (outside its timeout)
+            lane: Pool lane of the attempts
+
+        Returns:
+            The first successful attempt's result
+
+        Raises:
+            CircuitOpenError: The model's breaker is open
+            Exception: The last attempt's error once retries are exhausted
+        """
+        policy = self.policy(route.stage)
+        stats = self._stage_stats(route.stage)
+        stats.model = route.model
+        stats.calls += 1
+
+        attempt = 1
+        while True:
+            self.check_breaker(route)
+            try:
+                result = await self._hedged_attempt(route, fn, policy, stats, pool, lane)
+            except Exception as e:
+                self.record_outcome(route, e)
+                if not is_transient(e) or attempt >= policy.max_attempts:
+                    stats.failures += 1
+                    raise
+                delay = policy.backoff(attempt)
+                logger.warning(
+                    "LLM call failed, retrying",
+                    extra={"stage": route.stage, "model": route.model, "attempt": attempt,
+                           "delay_s": round(delay, 3), "error": str(e)[:200]}
+                )
+                stats.count("retries")
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            self.record_outcome(route, None)
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "stages": {stage: s.stats() for stage, s in self._stats.items()},
+            "breakers": {name: b.stats() for name, b in self._breakers.items()},
+        }
+
+
+resilient_caller = ResilientCaller()
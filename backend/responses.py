@@ -0,0 +1,37 @@
+import os
+from typing import Any, Union
+
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+# Serialize endpoint models directly instead of through FastAPI's response_model
+# re-validation (set to false to fall back to the default FastAPI path)
+API_FAST_SERIALIZATION = os.getenv("API_FAST_SERIALIZATION", "true").lower() in ("1", "true", "yes")
+
+
+class ModelResponse(Response):
+    """
+    JSON response rendered straight from a pydantic model by pydantic-core.
+
+    Returning a Response from an endpoint makes FastAPI skip response_model
+    validation and jsonable_encoder, so a model we just built and validated
+    is serialized exactly once.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: BaseModel) -> bytes:
+        return content.model_dump_json().encode("utf-8")
+
+
+def model_response(model: BaseModel, **kwargs: Any) -> Union[ModelResponse, BaseModel]:
+    """
+    Return ``model`` through the fast serialization path when enabled.
+
+    With API_FAST_SERIALIZATION=false the model itself is returned and FastAPI
+    validates and encodes it against the endpoint's response_model as usual.
+    """
+    if not API_FAST_SERIALIZATION:
+        return model
+    return ModelResponse(content=model, **kwargs)
+
@@ -0,0 +1,308 @@
+import os
+import re
+import json
+import time
+import zlib
+import asyncio
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from llm_cache import normalize_query
+from logging_config import get_logger
+
+logger = get_logger("semantic_cache")
+
+# Semantic cache configuration (overridable through environment variables)
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.85"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+SEMANTIC_CACHE_DIM = int(os.getenv("SEMANTIC_CACHE_DIM", "512"))
+# Index file (.npz); empty keeps the index in memory only
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", "")
+SEMANTIC_CACHE_SAVE_EVERY = int(os.getenv("SEMANTIC_CACHE_SAVE_EVERY", "100"))
+# Scores this far below the threshold are counted as near misses for tuning
+SEMANTIC_CACHE_NEAR_MISS_MARGIN = float(os.getenv("SEMANTIC_CACHE_NEAR_MISS_MARGIN", "0.1"))
+
+# Bumped whenever tokenization or features change, so persisted indexes are rebuilt
+_EMBEDDING_VERSION = 2
+
+# Function words that carry request phrasing rather than topic. Verbs such as
+# "learn" or "teach" stay: they change what the student is asking for.
+_FILLER_WORDS = frozenset({
+    "i", "im", "want", "wanna", "to", "me", "my", "please", "can", "could", "you", "would", "like",
+    "about", "the", "a", "an", "how", "do", "some", "with", "in", "on", "of", "and", "for", "is",
+    "are", "need", "should", "what",
+})
+
+# Words keep '+', '#' and inner dots so "c", "c++", "c#", ".net" and "node.js" stay distinct
+_TOKEN_PATTERN = re.compile(r"\.?[^\W_](?:[\w+#.]*[\w+#])?")
+
+# Common abbreviations expanded before hashing so "ML" matches "machine learning"
+_ALIASES = {
+    "ml": "machine learning",
+    "ai": "artificial intelligence",
+    "dl": "deep learning",
+    "nlp": "natural language processing",
+    "cv": "computer vision",
+    "dsa": "data structures algorithms",
+    "ds": "data science",
+    "os": "operating systems",
+    "dbms": "database management systems",
+    "oop": "object oriented programming",
+    "js": "javascript",
+    "py": "python",
+}
+
+
+def _content_tokens(query: str) -> List[str]:
+    words = _TOKEN_PATTERN.findall(normalize_query(query))
+    tokens: List[str] = []
+    for word in words:
+        tokens.extend(_ALIASES.get(word, word).split())
+    return [t for t in tokens if t not in _FILLER_WORDS] or tokens
+
+
+def _same_topic(query: str, candidate: str) -> bool:
+    """
+    Whether two queries ask about the same thing: identical content tokens.
+
+    Similar queries that differ in one word ("python" vs "java", "C" vs
+    "C++", "mathematics 2" vs "mathematics 3") are different requests, however
+    long the shared part is.
+    """
+    return set(_content_tokens(query)) == set(_content_tokens(candidate))
+
+
+def embed_query(query: str, dim: int = SEMANTIC_CACHE_DIM) -> np.ndarray:
+    """
+    Hashed n-gram embedding of a query (L2-normalized float32 vector).
+
+    Features are content words, adjacent word pairs and character 3-grams of
+    each word, hashed with CRC32 so vectors are stable across processes and
+    restarts. Filler phrasing ("I want to", "can you") is dropped first.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    tokens = _content_tokens(query)
+    features: List[Tuple[str, float]] = [(f"w:{t}", 1.0) for t in tokens]
+    features += [(f"b:{a} {b}", 0.5) for a, b in zip(tokens, tokens[1:])]
+    for token in tokens:
+        padded = f"^{token}$"
+        features += [(f"c:{padded[i:i + 3]}", 0.25) for i in range(len(padded) - 2)]
+    for feature, weight in features:
+        digest = zlib.crc32(feature.encode("utf-8"))
+        # Low bits pick the slot, one high bit picks the sign to reduce collision bias
+        vector[digest % dim] += weight if digest & 0x80000000 else -weight
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+class SemanticCache:
+    """
+    Near-duplicate lookup of refiner results over a NumPy cosine index.
+
+    Rows of a preallocated matrix hold unit vectors of previously refined
+    queries, so a lookup is one matrix-vector product. Results are reused
+    when the cosine similarity reaches ``threshold`` and the content words
+    (after aliases and filler) are the same. When full, the
+    least recently used row is overwritten. The index can be persisted to an
+    .npz file and is only reloaded when its ``version`` (prompt and model)
+    matches.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        version: str,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        dim: int = SEMANTIC_CACHE_DIM,
+        path: str = SEMANTIC_CACHE_PATH,
+        save_every: int = SEMANTIC_CACHE_SAVE_EVERY,
+        enabled: bool = SEMANTIC_CACHE_ENABLED,
+    ):
+        self.name = name
+        self.version = f"{version}:e{_EMBEDDING_VERSION}"
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self.dim = dim
+        self.path = path
+        self.save_every = save_every
+        self.enabled = enabled
+
+        self._vectors = np.zeros((self.max_entries, dim), dtype=np.float32)
+        self._last_used = np.zeros(self.max_entries, dtype=np.float64)
+        self._queries: List[str] = [""] * self.max_entries
+        self._payloads: List[Optional[str]] = [None] * self.max_entries
+        self._rows: Dict[str, int] = {}      # normalized query -> row
+        self._size = 0
+        self._unsaved = 0
+        self._background_tasks: Set[asyncio.Task] = set()
+
+        self.lookups = 0
+        self.hits = 0
+        self.near_misses = 0
+        self.inserts = 0
+        self.evictions = 0
+        self.hit_similarity_total = 0.0
+
+        if self.enabled and self.path:
+            self.load()
+
+    def lookup(self, query: str) -> Optional[Dict[str, Any]]:
+        """
+        Return a copy of the stored result for the most similar query, or None.
+        """
+        if not self.enabled or self._size == 0:
+            return None
+        self.lookups += 1
+        vector = embed_query(query, self.dim)
+        scores = self._vectors[:self._size] @ vector
+        row = int(np.argmax(scores))
+        similarity = float(scores[row])
+
+        if similarity >= self.threshold:
+            # Best-scoring row about the same topic; a closer row may differ in its key word
+            candidates = np.flatnonzero(scores >= self.threshold)
+            ordered = candidates[np.argsort(-scores[candidates])]
+            match = next((int(r) for r in ordered if _same_topic(query, self._queries[r])), None)
+            if match is not None:
+                row = match
+                similarity = float(scores[row])
+            else:
+                similarity = min(similarity, self.threshold - 1e-6)
+
+        if similarity < self.threshold:
+            if similarity >= self.threshold - SEMANTIC_CACHE_NEAR_MISS_MARGIN:
+                self.near_misses += 1
+                logger.debug(
+                    "Semantic cache near miss",
+                    extra={"cache": self.name, "similarity": round(similarity, 4),
+                           "query": query[:80], "nearest": self._queries[row][:80]}
+                )
+            return None
+
+        self.hits += 1
+        self.hit_similarity_total += similarity
+        self._last_used[row] = time.monotonic()
+        # Hit-quality log: pairs close to the threshold show whether it is tuned too low
+        logger.info(
+            "Semantic cache hit",
+            extra={"cache": self.name, "similarity": round(similarity, 4),
+                   "query": query[:80], "matched_query": self._queries[row][:80]}
+        )
+        return json.loads(self._payloads[row])
+
+    def add(self, query: str, value: Dict[str, Any]) -> None:
+        """Index a freshly generated result under its query."""
+        if not self.enabled:
+            return
+        normalized = normalize_query(query)
+        row = self._rows.get(normalized)
+        if row is None:
+            if self._size < self.max_entries:
+                row = self._size
+                self._size += 1
+            else:
+                row = int(np.argmin(self._last_used[:self._size]))
+                self._rows.pop(normalize_query(self._queries[row]), None)
+                self.evictions += 1
+            self._rows[normalized] = row
+
+        self._vectors[row] = embed_query(query, self.dim)
+        self._queries[row] = query
+        self._payloads[row] = json.dumps(value, ensure_ascii=False, default=str)
+        self._last_used[row] = time.monotonic()
+        self.inserts += 1
+
+        self._unsaved += 1
+        if self.path and self._unsaved >= self.save_every:
+            self._schedule_save()
+
+    # ------------------------------------------------------------ persistence
+
+    def _snapshot(self) -> Dict[str, Any]:
+        n = self._size
+        return {
+            "version": np.array(self.version),
+            "dim": np.array(self.dim),
+            "vectors": self._vectors[:n].copy(),
+            # Text is stored as one JSON string so loading never needs pickle
+            "entries": np.array(json.dumps({"queries": self._queries[:n], "payloads": self._payloads[:n]})),
+        }
+
+    def _write(self, snapshot: Dict[str, Any]) -> None:
+        tmp_path = f"{self.path}.tmp.{os.getpid()}.npz"
+        np.savez(tmp_path, **snapshot)
+        os.replace(tmp_path, self.path)
+
+    def _schedule_save(self) -> None:
+        self._unsaved = 0
+        snapshot = self._snapshot()
+
+        async def _save() -> None:
+            try:
+                await asyncio.to_thread(self._write, snapshot)
+            except Exception as e:
+                logger.warning("Semantic cache save failed", extra={"cache": self.name, "error": str(e)[:120]})
+
+        try:
+            task = asyncio.get_running_loop().create_task(_save())
+        except RuntimeError:
+            self._write(snapshot)
+            return
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    def save(self) -> None:
+        """Write the index to ``path`` synchronously (e.g. at shutdown)."""
+        if not (self.enabled and self.path and self._size):
+            return
+        self._unsaved = 0
+        try:
+            self._write(self._snapshot())
+            logger.info("Semantic cache saved", extra={"cache": self.name, "entries": self._size})
+        except Exception as e:
+            logger.warning("Semantic cache save failed", extra={"cache": self.name, "error": str(e)[:120]})
+
+    def load(self) -> None:
+        """Load a persisted index written for the same version and dimension."""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if str(data["version"]) != self.version or int(data["dim"]) != self.dim:
+                    logger.info("Semantic cache file is for another prompt/model version, ignoring",
+                                extra={"cache": self.name, "path": self.path})
+                    return
+                vectors = data["vectors"]
+                entries = json.loads(str(data["entries"]))
+            queries, payloads = entries["queries"], entries["payloads"]
+        except Exception as e:
+            logger.warning("Could not load semantic cache", extra={"cache": self.name, "error": str(e)[:120]})
+            return
+
+        n = min(len(queries), self.max_entries)
+        self._vectors[:n] = vectors[:n]
+        self._queries[:n] = queries[:n]
+        self._payloads[:n] = payloads[:n]
+        self._last_used[:n] = time.monotonic()
+        self._rows = {normalize_query(q): i for i, q in enumerate(self._queries[:n])}
+        self._size = n
+        logger.info("Semantic cache loaded", extra={"cache": self.name, "entries": n})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "enabled": self.enabled,
+            "entries": self._size,
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_ratio": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            "avg_hit_similarity": round(self.hit_similarity_total / self.hits, 4) if self.hits else None,
+            "near_misses": self.near_misses,
+            "inserts": self.inserts,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from logging_config import get_logger
+from shared_state import STATE_BACKEND, SharedKV, get_shared_kv, shared_key
+
+logger = get_logger("session_store")
+
+# Session store configuration (overridable through environment variables)
+# SESSION_STORE_BACKEND: 'memory' (per process), 'sqlite' or 'redis' (shared by all workers)
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", STATE_BACKEND).lower()
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "10000"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class SessionNotFoundError(Exception):
+    """Raised when a refinement session id is unknown or has expired."""
+
+
+@dataclass
+class RefinementSession:
+    """
+    Server-side state of one multi-turn refinement conversation.
+
+    Attributes:
+        session_id: Identifier returned to the client by refine_query
+        original_query: The student's original query
+        pending_questions: Suggestions asked in the latest round, keyed by question_id
+        conversation_history: Question-answer turns answered so far
+        reasoning: Reasoning collected from every refinement round
+        rounds: Number of refinement rounds asked so far
+    """
+    session_id: str
+    original_query: str
+    pending_questions: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    conversation_history: List[Dict[str, str]] = field(default_factory=list)
+    reasoning: List[str] = field(default_factory=list)
+    rounds: int = 0
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    @classmethod
+    def new(cls, original_query: str) -> "RefinementSession":
+        return cls(session_id=uuid.uuid4().hex, original_query=original_query)
+
+    def ask(self, suggestions: List[Dict[str, Any]], reasoning: str = "") -> None:
+        """Record a new round of suggestions sent to the student."""
+        self.pending_questions = {s["question_id"]: s for s in suggestions if "question_id" in s}
+        if reasoning:
+            self.reasoning.append(reasoning)
+        self.rounds += 1
+
+    def record_answers(self, user_answers: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        Resolve answers against the questions asked in the latest round.
+
+        Returns:
+            The new conversation turns, carrying the real question text
+        """
+        turns = []
+        for answer in user_answers:
+            question_id = answer.get("question_id", "")
+            question = self.pending_questions.get(question_id, {}).get("text") or f"Question {question_id}"
+            turns.append({"question_id": question_id, "question": question, "answer": answer.get("answer", "")})
+        self.conversation_history.extend(turns)
+        self.pending_questions = {}
+        return turns
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, payload: str) -> "RefinementSession":
+        return cls(**json.loads(payload))
+
+
+class SessionStore:
+    """Interface for refinement session backends."""
+
+    backend_name = "base"
+
+    async def get(self, session_id: str) -> Optional[RefinementSession]:
+        raise NotImplementedError
+
+    async def save(self, session: RefinementSession) -> None:
+        raise NotImplementedError
+
+    async def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend_name}
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Process-local session store with LRU + TTL eviction and a memory cap.
+
+    Sessions are kept JSON-encoded so the memory bound is measured on the
+    same payload other backends would persist.
+    """
+
+    backend_name = "memory"
+
+    def __init__(
+        self,
+        ttl_seconds: float = SESSION_TTL_SECONDS,
+        max_entries: int = SESSION_MAX_ENTRIES,
+        max_bytes: int = SESSION_MAX_BYTES,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sessions: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    async def get(self, session_id: str) -> Optional[RefinementSession]:
+        item = self._sessions.get(session_id)
+        if item is None:
+            self.misses += 1
+            return None
+        payload, saved_at = item
+        if time.monotonic() - saved_at >= self.ttl_seconds:
+            self._remove(session_id)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._sessions.move_to_end(session_id)
+        return RefinementSession.from_json(payload)
+
+    async def save(self, session: RefinementSession) -> None:
+        session.updated_at = time.time()
+        payload = session.to_json()
+        self._remove(session.session_id)
+        self._sessions[session.session_id] = (payload, time.monotonic())
+        self._total_bytes += len(payload.encode("utf-8"))
+
+        while self._sessions and (
+            len(self._sessions) > self.max_entries or self._total_bytes > self.max_bytes
+        ):
+            oldest_id = next(iter(self._sessions))
+            self._remove(oldest_id)
+            self.evictions += 1
+
+    async def delete(self, session_id: str) -> None:
+        self._remove(session_id)
+
+    def _remove(self, session_id: str) -> None:
+        item = self._sessions.pop(session_id, None)
+        if item is not None:
+            self._total_bytes -= len(item[0].encode("utf-8"))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend_name,
+            "sessions": len(self._sessions),
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SharedSessionStore(SessionStore):
+    """
+    Sessions in the cross-process store (see shared_state.py), so any worker
+    can continue a refinement another worker started. Nothing is cached
+    locally because sessions change every round.
+    """
+
+    def __init__(self, backend: str, ttl_seconds: float = SESSION_TTL_SECONDS):
+        self.backend_name = backend
+        self.ttl_seconds = ttl_seconds
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def _kv(self) -> SharedKV:
+        # Opened lazily so every worker process gets its own connection
+        return get_shared_kv(self.backend_name)
+
+    async def get(self, session_id: str) -> Optional[RefinementSession]:
+        item = await self._kv.get(shared_key("session", session_id))
+        if item is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return RefinementSession.from_json(item[0])
+
+    async def save(self, session: RefinementSession) -> None:
+        session.updated_at = time.time()
+        await self._kv.set(shared_key("session", session.session_id), session.to_json(), self.ttl_seconds)
+
+    async def delete(self, session_id: str) -> None:
+        await self._kv.delete(shared_key("session", session_id))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend_name, "hits": self.hits, "misses": self.misses}
+
+
+def create_session_store(backend: str = SESSION_STORE_BACKEND) -> SessionStore:
+    """Build the configured session store backend."""
+    if backend in ("sqlite", "redis"):
+        return SharedSessionStore(backend)
+    if backend != "memory":
+        logger.warning("Unknown session store backend, using memory", extra={"backend": backend})
+    return InMemorySessionStore()
+
+
+session_store = create_session_store()
@@ -0,0 +1,181 @@
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from logging_config import get_logger
+
+logger = get_logger("shared_state")
+
+# Cross-process state backend (overridable through environment variables)
+# STATE_BACKEND: 'memory' (per process), 'sqlite' (WAL file shared by all workers on one box)
+# or 'redis' (any Redis-protocol server; needs the optional 'redis' package)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+STATE_SQLITE_PATH = os.getenv("STATE_SQLITE_PATH", "mahaguru_state.sqlite3")
+STATE_SQLITE_MAX_ENTRIES = int(os.getenv("STATE_SQLITE_MAX_ENTRIES", "100000"))
+STATE_REDIS_URL = os.getenv("STATE_REDIS_URL", "redis://localhost:6379/0")
+STATE_KEY_PREFIX = os.getenv("STATE_KEY_PREFIX", "mahaguru:")
+
+
+class SharedKV:
+    """
+    Minimal async key-value store shared by every worker process.
+
+    Values are strings stored with their wall-clock write time so readers in
+    any process can apply TTL and staleness rules; entries also expire in the
+    backend after ``ttl_seconds``.
+    """
+
+    backend_name = "base"
+
+    async def get(self, key: str) -> Optional[Tuple[str, float]]:
+        """Return (value, stored_at) or None when missing or expired."""
+        raise NotImplementedError
+
+    async def set(self, key: str, value: str, ttl_seconds: float) -> None:
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend_name}
+
+
+class SQLiteKV(SharedKV):
+    """
+    SQLite store in WAL mode: concurrent readers, one writer at a time.
+
+    Every worker opens its own connection to the same file. Calls run in a
+    thread so lock waits never block the event loop; expired rows and rows
+    beyond ``max_entries`` are pruned periodically on write.
+    """
+
+    backend_name = "sqlite"
+    _PRUNE_EVERY = 500
+
+    def __init__(self, path: str = STATE_SQLITE_PATH, max_entries: int = STATE_SQLITE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " stored_at REAL NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS kv_stored_at ON kv (stored_at)")
+        self._writes = 0
+
+        self.errors = 0
+        self.pruned = 0
+
+    def _get(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, stored_at FROM kv WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def _set(self, key: str, value: str, ttl_seconds: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, stored_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now + ttl_seconds)
+            )
+            self._writes += 1
+            if self._writes % self._PRUNE_EVERY == 0:
+                self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        cursor = self._conn.execute("DELETE FROM kv WHERE expires_at <= ?", (now,))
+        removed = cursor.rowcount
+        cursor = self._conn.execute(
+            "DELETE FROM kv WHERE key IN (SELECT key FROM kv ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        self.pruned += removed + cursor.rowcount
+
+    def _delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    async def get(self, key: str) -> Optional[Tuple[str, float]]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str, ttl_seconds: float) -> None:
+        await asyncio.to_thread(self._set, key, value, ttl_seconds)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete, key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend_name, "path": self.path, "writes": self._writes, "pruned": self.pruned}
+
+
+class RedisKV(SharedKV):
+    """
+    Store on any Redis-protocol server (Redis, Valkey, KeyDB, Dragonfly...).
+
+    The write time is kept as a prefix of the stored value and expiry is
+    delegated to the server.
+    """
+
+    backend_name = "redis"
+
+    def __init__(self, url: str = STATE_REDIS_URL):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as e:
+            raise RuntimeError("STATE_BACKEND=redis requires the 'redis' package") from e
+        self.url = url
+        self._client = redis_asyncio.from_url(url, decode_responses=True)
+
+    async def get(self, key: str) -> Optional[Tuple[str, float]]:
+        raw = await self._client.get(key)
+        if raw is None:
+            return None
+        stored_at, _, value = raw.partition(":")
+        return value, float(stored_at)
+
+    async def set(self, key: str, value: str, ttl_seconds: float) -> None:
+        await self._client.set(key, f"{time.time():.6f}:{value}", px=max(1, int(ttl_seconds * 1000)))
+
+    async def delete(self, key: str) -> None:
+        await self._client.delete(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend_name, "url": self.url.split("@")[-1]}
+
+
+_shared: Dict[str, Optional[SharedKV]] = {}
+
+
+def get_shared_kv(backend: str = STATE_BACKEND) -> Optional[SharedKV]:
+    """
+    Process-wide shared store for ``backend``, created on first use.
+
+    Returns:
+        The store, or None for the per-process 'memory' backend
+    """
+    if backend not in _shared:
+        if backend == "sqlite":
+            _shared[backend] = SQLiteKV()
+        elif backend == "redis":
+            _shared[backend] = RedisKV()
+        else:
+            if backend != "memory":
+                logger.warning("Unknown state backend, using memory", extra={"backend": backend})
+            _shared[backend] = None
+        logger.info("Shared state backend ready", extra={"backend": backend, "pid": os.getpid()})
+    return _shared[backend]
+
+
+def shared_key(*parts: str) -> str:
+    """Namespaced key for the shared store."""
+    return STATE_KEY_PREFIX + ":".join(parts)
@@ -0,0 +1,185 @@
+import os
+import json
+import itertools
+from typing import Any, Dict, Iterator, List, Optional
+
+from logging_config import get_logger
+
+logger = get_logger("smalltalk")
+
+# Local small-talk responder (overridable through environment variables)
+SMALLTALK_ENABLED = os.getenv("SMALLTALK_ENABLED", "true").lower() in ("1", "true", "yes")
+SMALLTALK_LOCALE = os.getenv("SMALLTALK_LOCALE", "en").lower()
+# Optional JSON file {locale: {intent: [replies]}} adding or overriding reply sets
+SMALLTALK_REPLIES_PATH = os.getenv("SMALLTALK_REPLIES_PATH", "")
+# Longer messages are treated as real questions even if they open with a greeting
+SMALLTALK_MAX_WORDS = int(os.getenv("SMALLTALK_MAX_WORDS", "8"))
+
+# Source tag of locally answered messages
+SMALLTALK_SOURCE = "local-smalltalk"
+
+# Intent of each greeting the classifier matches (see classroom.classify_query_details)
+GREETING_INTENTS = {
+    "hi": "greeting",
+    "hello": "greeting",
+    "hey": "greeting",
+    "thanks": "thanks",
+    "thank you": "thanks",
+    "good morning": "good_morning",
+    "good afternoon": "good_afternoon",
+    "good evening": "good_evening",
+    "how are you": "how_are_you",
+}
+# When several greetings match, the most specific intent answers ("hi, thanks!" -> thanks)
+_INTENT_PRIORITY = ("thanks", "how_are_you", "good_morning", "good_afternoon", "good_evening", "greeting")
+
+# Words that may accompany a greeting without turning it into a question
+_COURTESY_WORDS = frozenset({
+    "there", "again", "so", "much", "a", "lot", "very", "all", "everyone", "guys", "friend",
+    "sir", "maam", "madam", "teacher", "mentor", "guru", "mahaguru", "bot", "ai",
+    "today", "doing", "and", "you", "too", "ok", "okay", "oh", "well", "dear", "buddy",
+    "great", "nice", "cool", "hii", "hiii", "heyy", "hellooo", "yo",
+})
+
+REPLIES: Dict[str, Dict[str, List[str]]] = {
+    "en": {
+        "greeting": [
+            "Hello! I'm your Mahaguru mentor. What would you like to learn or work on today?",
+            "Hi there! Ready when you are - tell me a topic, a doubt, or a goal you're working towards.",
+            "Hey! Good to see you. What are we exploring today?",
+        ],
+        "thanks": [
+            "You're welcome! Keep the questions coming whenever you're stuck.",
+            "Happy to help! Is there anything else you'd like to go over?",
+            "Anytime! Learning is a journey - I'm here for the next step too.",
+        ],
+        "good_morning": [
+            "Good morning! A fresh mind learns best - what shall we start with today?",
+            "Good morning! What's on your study plan today?",
+        ],
+        "good_afternoon": [
+            "Good afternoon! How is your study day going? Tell me what you're working on.",
+            "Good afternoon! What would you like to learn or revise now?",
+        ],
+        "good_evening": [
+            "Good evening! Want to review what you learned today or pick up something new?",
+            "Good evening! What topic shall we go through together?",
+        ],
+        "how_are_you": [
+            "I'm doing great and ready to help! How are your studies going?",
+            "All good here, thanks for asking! What are you learning these days?",
+        ],
+    },
+}
+
+
+class SmallTalkResponder:
+    """
+    Rule-based replies to greetings and courtesies, with no LLM call.
+
+    A message qualifies only when the classifier matched a greeting and
+    nothing but greetings and courtesy words remain, so "hi, what is a
+    derivative?" still reaches the LLM. Replies rotate through the reply set
+    of the message's intent in the requested locale (falling back to the
+    default locale, then English).
+    """
+
+    def __init__(
+        self,
+        replies: Optional[Dict[str, Dict[str, List[str]]]] = None,
+        default_locale: str = SMALLTALK_LOCALE,
+        max_words: int = SMALLTALK_MAX_WORDS,
+        enabled: bool = SMALLTALK_ENABLED,
+    ):
+        self.replies = replies if replies is not None else _load_replies(SMALLTALK_REPLIES_PATH)
+        self.default_locale = default_locale
+        self.max_words = max_words
+        self.enabled = enabled
+        self._rotations: Dict[tuple, Iterator[str]] = {}
+
+        self.answered = 0
+        self.declined = 0
+        self.by_intent: Dict[str, int] = {}
+
+    def intent(self, message: str, matched: List[str]) -> Optional[str]:
+        """Small-talk intent of ``message``, or None when it carries a real request."""
+        words = "".join(c if c.isalnum() else " " for c in message.lower()).split()
+        if not words or len(words) > self.max_words:
+            return None
+        text = " " + " ".join(words) + " "
+        # Classifier matches are substrings ("hi" in "which"); keep whole-word ones only
+        found = [greeting for greeting in matched if f" {greeting} " in text]
+        if not found:
+            return None
+        for greeting in found:
+            text = text.replace(f" {greeting} ", " ")
+        if any(word not in _COURTESY_WORDS for word in text.split()):
+            return None
+        intents = {GREETING_INTENTS.get(greeting, "greeting") for greeting in found}
+        return next(intent for intent in _INTENT_PRIORITY + tuple(intents) if intent in intents)
+
+    def reply(self, message: str, classification: Dict[str, Any], locale: Optional[str] = None) -> Optional[str]:
+        """
+        Local reply for a small-talk message.
+
+        Args:
+            message: The student's message
+            classification: classify_query_details() result for the message
+            locale: Reply locale (defaults to SMALLTALK_LOCALE)
+
+        Returns:
+            The reply text, or None when the message should go to the LLM
+        """
+        if not self.enabled or classification.get("reason") != "greeting":
+            return None
+        intent = self.intent(message, classification.get("matched") or [])
+        if intent is None:
+            self.declined += 1
+            return None
+
+        locale = self._resolve_locale(locale, intent)
+        key = (locale, intent)
+        rotation = self._rotations.get(key)
+        if rotation is None:
+            rotation = self._rotations[key] = itertools.cycle(self.replies[locale][intent])
+        self.answered += 1
+        self.by_intent[intent] = self.by_intent.get(intent, 0) + 1
+        logger.debug("Small talk answered locally", extra={"intent": intent, "locale": locale})
+        return next(rotation)
+
+    def _resolve_locale(self, locale: Optional[str], intent: str) -> str:
+        for candidate in (locale, (locale or "").split("-")[0], self.default_locale, "en"):
+            if candidate and self.replies.get(candidate.lower(), {}).get(intent):
+                return candidate.lower()
+        return "en"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "default_locale": self.default_locale,
+            "locales": sorted(self.replies),
+            "answered": self.answered,
+            "declined": self.declined,
+            "by_intent": dict(self.by_intent),
+        }
+
+
+def _load_replies(path: str) -> Dict[str, Dict[str, List[str]]]:
+    """Built-in reply sets merged with the optional SMALLTALK_REPLIES_PATH file."""
+    replies = {locale: dict(intents) for locale, intents in REPLIES.items()}
+    if not path:
+        return replies
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            custom = json.load(f)
+        for locale, intents in custom.items():
+            replies.setdefault(locale.lower(), {}).update(
+                {intent: list(texts) for intent, texts in intents.items() if texts}
+            )
+        logger.info("Small-talk replies loaded", extra={"path": path, "locales": sorted(custom)})
+    except Exception as e:
+        logger.warning("Could not load small-talk replies", extra={"path": path, "error": str(e)[:120]})
+    return replies
+
+
+smalltalk_responder = SmallTalkResponder()
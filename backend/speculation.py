@@ -0,0 +1,115 @@
+import os
+from collections import deque
+from typing import Any, Deque, Dict
+
+from logging_config import get_logger
+
+logger = get_logger("speculation")
+
+# Speculative routing configuration (overridable through environment variables)
+SPECULATIVE_ROUTING_ENABLED = os.getenv("SPECULATIVE_ROUTING_ENABLED", "false").lower() in ("1", "true", "yes")
+# Speculate when the classifier's confidence in a 'complex' decision is below this value
+SPECULATION_CONFIDENCE_THRESHOLD = float(os.getenv("SPECULATION_CONFIDENCE_THRESHOLD", "0.5"))
+# ...or when the refiner recently failed more often than this fraction of calls
+SPECULATION_FAILURE_RATE_THRESHOLD = float(os.getenv("SPECULATION_FAILURE_RATE_THRESHOLD", "0.2"))
+SPECULATION_FAILURE_WINDOW = int(os.getenv("SPECULATION_FAILURE_WINDOW", "50"))
+# Extra LLM spend cap: speculative calls may be at most this fraction of routed requests
+SPECULATION_MAX_EXTRA_RATIO = float(os.getenv("SPECULATION_MAX_EXTRA_RATIO", "0.2"))
+SPECULATION_BURST = float(os.getenv("SPECULATION_BURST", "5"))
+
+
+class SpeculationPolicy:
+    """
+    Decides when to race the refiner against a direct answer, within a spend budget.
+
+    The budget is a token bucket: every routed complex request adds
+    ``max_extra_ratio`` tokens (capped at ``burst``) and every speculative
+    launch spends one, so speculation can never add more than that fraction
+    of extra LLM calls over time.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = SPECULATIVE_ROUTING_ENABLED,
+        confidence_threshold: float = SPECULATION_CONFIDENCE_THRESHOLD,
+        failure_rate_threshold: float = SPECULATION_FAILURE_RATE_THRESHOLD,
+        failure_window: int = SPECULATION_FAILURE_WINDOW,
+        max_extra_ratio: float = SPECULATION_MAX_EXTRA_RATIO,
+        burst: float = SPECULATION_BURST,
+    ):
+        self.enabled = enabled
+        self.confidence_threshold = confidence_threshold
+        self.failure_rate_threshold = failure_rate_threshold
+        self.max_extra_ratio = max_extra_ratio
+        self.burst = burst
+        self._tokens = burst
+        self._refiner_outcomes: Deque[bool] = deque(maxlen=failure_window)
+
+        self.routed = 0
+        self.launched = 0
+        self.budget_denied = 0
+        self.refiner_won = 0
+        self.direct_won = 0
+        self.cancelled_branches = 0
+
+    def refiner_failure_rate(self) -> float:
+        if not self._refiner_outcomes:
+            return 0.0
+        return self._refiner_outcomes.count(False) / len(self._refiner_outcomes)
+
+    def should_speculate(self, confidence: float) -> bool:
+        """
+        Return True when a complex query should run refiner and direct branches concurrently.
+
+        Args:
+            confidence: Classifier confidence in the 'complex' decision (0.0-1.0)
+        """
+        if not self.enabled:
+            return False
+
+        self.routed += 1
+        self._tokens = min(self.burst, self._tokens + self.max_extra_ratio)
+
+        uncertain = confidence < self.confidence_threshold
+        failure_prone = self.refiner_failure_rate() > self.failure_rate_threshold
+        if not (uncertain or failure_prone):
+            return False
+
+        if self._tokens < 1:
+            self.budget_denied += 1
+            return False
+
+        self._tokens -= 1
+        self.launched += 1
+        logger.debug(
+            "Speculating on routing",
+            extra={"confidence": confidence, "uncertain": uncertain, "failure_prone": failure_prone}
+        )
+        return True
+
+    def record_refiner_outcome(self, accepted: bool) -> None:
+        self._refiner_outcomes.append(accepted)
+
+    def record_winner(self, branch: str, cancelled_other: bool) -> None:
+        if branch == "refiner":
+            self.refiner_won += 1
+        else:
+            self.direct_won += 1
+        if cancelled_other:
+            self.cancelled_branches += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "routed": self.routed,
+            "launched": self.launched,
+            "budget_denied": self.budget_denied,
+            "refiner_won": self.refiner_won,
+            "direct_won": self.direct_won,
+            "cancelled_branches": self.cancelled_branches,
+            "refiner_failure_rate": round(self.refiner_failure_rate(), 4),
+            "budget_tokens": round(self._tokens, 3),
+        }
+
+
+speculation_policy = SpeculationPolicy()
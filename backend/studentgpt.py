@@ -0,0 +1,331 @@
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from logging_config import get_logger
+from metrics import (
+    METRICS_ENABLED, STUDENTGPT_BATCH_SIZE, STUDENTGPT_QUEUE_DEPTH,
+    STUDENTGPT_REJECTED, STUDENTGPT_TOKENS, STUDENTGPT_TOKENS_PER_SECOND
+)
+
+logger = get_logger("studentgpt")
+
+# Model configuration (overridable through environment variables)
+# STUDENTGPT_MODEL_PATH: local directory or Hugging Face id of the fine-tuned causal LM.
+# Without it (or without the optional transformers/torch packages) a placeholder model answers.
+STUDENTGPT_MODEL_PATH = os.getenv("STUDENTGPT_MODEL_PATH", "")
+STUDENTGPT_MAX_NEW_TOKENS = int(os.getenv("STUDENTGPT_MAX_NEW_TOKENS", "128"))
+STUDENTGPT_TEMPERATURE = float(os.getenv("STUDENTGPT_TEMPERATURE", "0.7"))
+STUDENTGPT_THREADS = int(os.getenv("STUDENTGPT_THREADS", "0"))  # 0 = library default
+
+# Scheduler configuration
+STUDENTGPT_MAX_BATCH_SIZE = int(os.getenv("STUDENTGPT_MAX_BATCH_SIZE", "8"))
+STUDENTGPT_BATCH_WINDOW_MS = float(os.getenv("STUDENTGPT_BATCH_WINDOW_MS", "10"))
+STUDENTGPT_MAX_QUEUE = int(os.getenv("STUDENTGPT_MAX_QUEUE", "256"))
+
+STUDENTGPT_SYSTEM_PROMPT = "You are StudentGPT, a friendly brainstorming partner for students."
+
+
+class StudentGPTOverloadedError(Exception):
+    """Raised when the request queue is full; callers should retry later."""
+
+
+class StudentGPTModel:
+    """Interface for batch text generation; called from a single worker thread."""
+
+    name = "base"
+    # Whether requests gain from sharing a forward pass (worth waiting for a batch window)
+    batched = True
+
+    def load(self) -> None:
+        return None
+
+    def generate_batch(self, messages: List[str], max_new_tokens: int) -> List[Tuple[str, int]]:
+        """
+        Generate replies for a batch of student messages.
+
+        Returns:
+            (reply text, generated token count) per message, in order
+        """
+        raise NotImplementedError
+
+
+class PlaceholderModel(StudentGPTModel):
+    """Stand-in used until fine-tuned weights are configured."""
+
+    name = "placeholder"
+    batched = False
+
+    def generate_batch(self, messages: List[str], max_new_tokens: int) -> List[Tuple[str, int]]:
+        results = []
+        for message in messages:
+            text = (
+                f"StudentGPT: I understand you asked about '{message}'. This is a placeholder response. "
+                "Implement your fine-tuned small LLM logic here."
+            )
+            results.append((text, len(text.split())))
+        return results
+
+
+class TransformersModel(StudentGPTModel):
+    """Causal LM served on CPU with Hugging Face transformers, batched with left padding."""
+
+    name = "transformers"
+
+    def __init__(self, model_path: str, temperature: float = STUDENTGPT_TEMPERATURE, threads: int = STUDENTGPT_THREADS):
+        self.model_path = model_path
+        self.temperature = temperature
+        self.threads = threads
+        self._torch: Any = None
+        self._tokenizer: Any = None
+        self._model: Any = None
+
+    def load(self) -> None:
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        tokenizer = AutoTokenizer.from_pretrained(self.model_path, padding_side="left")
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        model = AutoModelForCausalLM.from_pretrained(self.model_path, torch_dtype=torch.float32)
+        model.eval()
+
+        self._torch, self._tokenizer, self._model = torch, tokenizer, model
+
+    def _prompt(self, message: str) -> str:
+        if getattr(self._tokenizer, "chat_template", None):
+            return self._tokenizer.apply_chat_template(
+                [
+                    {"role": "system", "content": STUDENTGPT_SYSTEM_PROMPT},
+                    {"role": "user", "content": message},
+                ],
+                tokenize=False,
+                add_generation_prompt=True,
+            )
+        return f"{STUDENTGPT_SYSTEM_PROMPT}\n\nStudent: {message}\nStudentGPT:"
+
+    def generate_batch(self, messages: List[str], max_new_tokens: int) -> List[Tuple[str, int]]:
+        inputs = self._tokenizer([self._prompt(m) for m in messages], return_tensors="pt", padding=True)
+        with self._torch.inference_mode():
+            output = self._model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                do_sample=self.temperature > 0,
+                temperature=self.temperature if self.temperature > 0 else None,
+                pad_token_id=self._tokenizer.pad_token_id,
+            )
+        generated = output[:, inputs["input_ids"].shape[1]:]
+        results = []
+        for row in generated:
+            tokens = int((row != self._tokenizer.pad_token_id).sum())
+            results.append((self._tokenizer.decode(row, skip_special_tokens=True).strip(), tokens))
+        return results
+
+
+def create_model(model_path: str = STUDENTGPT_MODEL_PATH) -> StudentGPTModel:
+    """The configured model, or the placeholder when weights or libraries are unavailable."""
+    if not model_path:
+        return PlaceholderModel()
+    try:
+        import torch  # noqa: F401
+        import transformers  # noqa: F401
+    except ImportError:
+        logger.warning("transformers/torch not installed, using placeholder StudentGPT model")
+        return PlaceholderModel()
+    return TransformersModel(model_path)
+
+
+@dataclass
+class _PendingRequest:
+    message: str
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class MicroBatchScheduler:
+    """
+    Groups concurrent requests into batches for one shared model.
+
+    The first queued request opens a batch window of ``batch_window_ms``;
+    requests arriving within it (up to ``max_batch_size``) run in the same
+    forward pass. Batches run one at a time on a dedicated thread, so the
+    event loop stays responsive and the model's own threads get the CPU. The
+    queue is bounded: when it is full, submit() fails fast instead of piling
+    up latency. Models that do not batch (the placeholder) skip the window,
+    and a model that fails to load is replaced by the placeholder so the API
+    still starts.
+    """
+
+    def __init__(
+        self,
+        model: StudentGPTModel,
+        max_batch_size: int = STUDENTGPT_MAX_BATCH_SIZE,
+        batch_window_ms: float = STUDENTGPT_BATCH_WINDOW_MS,
+        max_queue: int = STUDENTGPT_MAX_QUEUE,
+        max_new_tokens: int = STUDENTGPT_MAX_NEW_TOKENS,
+    ):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.batch_window = batch_window_ms / 1000
+        self.max_queue = max_queue
+        self.max_new_tokens = max_new_tokens
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._start_lock: Optional[asyncio.Lock] = None
+        self.loaded = False
+        self.load_error: Optional[str] = None
+
+        self.requests = 0
+        self.rejected = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.generated_tokens = 0
+        self.generation_seconds = 0.0
+        self.max_batch_seen = 0
+
+    async def start(self) -> None:
+        """Load the model once and start the batching loop (idempotent)."""
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._worker is not None and not self._worker.done():
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="studentgpt")
+            if not self.loaded:
+                await self._load()
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            if METRICS_ENABLED:
+                STUDENTGPT_QUEUE_DEPTH.set_function(lambda: self._queue.qsize() if self._queue else 0)
+            self._worker = asyncio.create_task(self._run())
+
+    async def _load(self) -> None:
+        started = time.perf_counter()
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self.model.load)
+        except Exception as e:
+            self.load_error = str(e)[:200]
+            logger.warning(
+                "StudentGPT model failed to load, using placeholder model",
+                extra={"model": self.model.name, "error": self.load_error}
+            )
+            self.model = PlaceholderModel()
+        self.loaded = True
+        logger.info(
+            "StudentGPT model loaded",
+            extra={"model": self.model.name, "load_ms": round((time.perf_counter() - started) * 1000, 2)}
+        )
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._queue is not None:
+            while not self._queue.empty():
+                pending = self._queue.get_nowait()
+                if not pending.future.done():
+                    pending.future.set_exception(StudentGPTOverloadedError("StudentGPT is shutting down"))
+        if self._executor is not None:
+            # Do not block the event loop on a batch that is still generating
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def submit(self, message: str) -> str:
+        """
+        Queue a message and wait for its reply.
+
+        Raises:
+            StudentGPTOverloadedError: The queue is full
+        """
+        if self._worker is None or self._worker.done():
+            await self.start()
+        self.requests += 1
+        pending = _PendingRequest(message=message, future=asyncio.get_running_loop().create_future())
+        try:
+            self._queue.put_nowait(pending)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            if METRICS_ENABLED:
+                STUDENTGPT_REJECTED.inc()
+            raise StudentGPTOverloadedError("StudentGPT queue is full")
+        return await pending.future
+
+    async def _collect_batch(self) -> List[_PendingRequest]:
+        batch = [await self._queue.get()]
+        window = self.batch_window if self.model.batched else 0.0
+        deadline = time.perf_counter() + window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        # Requests whose caller went away are not worth generating
+        return [p for p in batch if not p.future.done()]
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+            if not batch:
+                continue
+            started = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self.model.generate_batch, [p.message for p in batch], self.max_new_tokens
+                )
+            except Exception as e:
+                logger.error("StudentGPT batch failed", extra={"batch_size": len(batch), "error": str(e)[:200]})
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(e)
+                continue
+            self._record_batch(len(batch), sum(tokens for _, tokens in results), time.perf_counter() - started)
+            for pending, (text, _) in zip(batch, results):
+                if not pending.future.done():
+                    pending.future.set_result(text)
+
+    def _record_batch(self, size: int, tokens: int, seconds: float) -> None:
+        self.batches += 1
+        self.batched_requests += size
+        self.generated_tokens += tokens
+        self.generation_seconds += seconds
+        self.max_batch_seen = max(self.max_batch_seen, size)
+        if METRICS_ENABLED:
+            STUDENTGPT_BATCH_SIZE.observe(size)
+            STUDENTGPT_TOKENS.inc(tokens)
+            if seconds > 0:
+                STUDENTGPT_TOKENS_PER_SECOND.set(tokens / seconds)
+        logger.debug("StudentGPT batch generated", extra={"batch_size": size, "tokens": tokens, "seconds": round(seconds, 4)})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model.name,
+            "loaded": self.loaded,
+            "load_error": self.load_error,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "max_queue": self.max_queue,
+            "requests": self.requests,
+            "rejected": self.rejected,
+            "batches": self.batches,
+            "avg_batch_size": round(self.batched_requests / self.batches, 3) if self.batches else 0.0,
+            "max_batch_size": self.max_batch_seen,
+            "generated_tokens": self.generated_tokens,
+            "tokens_per_second": round(self.generated_tokens / self.generation_seconds, 2) if self.generation_seconds else 0.0,
+        }
+
+
+studentgpt_engine = MicroBatchScheduler(create_model())
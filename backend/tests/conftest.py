@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Tests run offline against the deterministic fake provider
+os.environ.setdefault("LLM_PROVIDER", "fake")
+os.environ.setdefault("LLM_PREWARM", "false")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ.pop("GEMINI_API_KEY", None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
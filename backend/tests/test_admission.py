@@ -0,0 +1,112 @@
+import asyncio
+
+import httpx
+import pytest
+
+import classroom
+import main
+from admission import AdmissionController, RateLimitedError, admission_identity
+from classroom import classify_query_details
+
+
+def _chat(ip: str, user_id: str) -> int:
+    async def post() -> int:
+        transport = httpx.ASGITransport(app=main.app, client=(ip, 40000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post("/api/v1/classroom/chat", json={"user_message": "hi", "user_id": user_id})
+            return response.status_code
+
+    return asyncio.run(post())
+
+
+def test_placeholder_user_ids_do_not_share_a_bucket(monkeypatch):
+    # One request per client, refilled far slower than the test runs
+    monkeypatch.setattr(main, "admission_controller", AdmissionController(user_rate=0.001, user_burst=1, global_rate=0))
+
+    assert _chat("10.0.0.1", "anonymous") == 200
+    assert _chat("10.0.0.2", "anonymous") == 200
+    # The bucket still applies per client
+    assert _chat("10.0.0.1", "anonymous") == 429
+
+
+def test_identity_ignores_untrusted_and_placeholder_user_ids(monkeypatch):
+    assert admission_identity("10.0.0.1", "alice") == "ip:10.0.0.1"
+
+    monkeypatch.setattr("admission.ADMISSION_TRUST_USER_ID", True)
+    assert admission_identity("10.0.0.1", "alice") == "user:alice"
+    assert admission_identity("10.0.0.1", "default_user") == "ip:10.0.0.1"
+    assert admission_identity("10.0.0.2", "Anonymous") == "ip:10.0.0.2"
+
+
+def test_batch_is_charged_per_unique_item(monkeypatch):
+    monkeypatch.setattr(main, "admission_controller", AdmissionController(user_rate=0.001, user_burst=5, global_rate=0))
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app, client=("10.0.0.3", 40000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            items = [{"user_message": f"hello {i}"} for i in range(4)] + [{"user_message": "hello 0"}]
+            batch = await client.post("/api/v1/classroom/chat/batch", json={"items": items})
+            # Four unique items leave one token of the burst of five
+            first = await client.post("/api/v1/classroom/chat", json={"user_message": "hi"})
+            second = await client.post("/api/v1/classroom/chat", json={"user_message": "hi"})
+            return batch.status_code, first.status_code, second.status_code
+
+    assert asyncio.run(run()) == (200, 200, 429)
+
+
+def test_batch_larger_than_burst_leaves_the_bucket_in_debt():
+    controller = AdmissionController(user_rate=1, user_burst=10, global_rate=0)
+
+    async def run():
+        (await controller.acquire("ip:10.0.0.4", cost=50)).release()
+        with pytest.raises(RateLimitedError) as rejected:
+            await controller.acquire("ip:10.0.0.4")
+        return rejected.value.retry_after
+
+    # 40 tokens of debt plus one for the new request at one token per second
+    assert asyncio.run(run()) == pytest.approx(41, abs=0.5)
+
+
+@pytest.mark.parametrize("path, message, interactive, lane", [
+    ("/api/v1/classroom/chat", "What is photosynthesis?", True, "interactive"),
+    ("/api/v1/classroom/chat/stream", "What is photosynthesis?", True, "interactive"),
+    ("/api/v1/classroom/chat", "I want to learn linear algebra", False, "standard"),
+    ("/api/v1/classroom/chat/stream", "I want to learn linear algebra", False, "standard"),
+])
+def test_chat_lane_follows_one_classification(monkeypatch, path, message, interactive, lane):
+    admitted, lanes, classified = [], [], []
+
+    class RecordingController(AdmissionController):
+        async def acquire(self, user, interactive=False, cost=1.0):
+            admitted.append(interactive)
+            return await super().acquire(user, interactive, cost)
+
+    def classify(query):
+        classified.append(query)
+        return classify_query_details(query)
+
+    async def direct(user_message, conversation_history=None, lane="standard"):
+        lanes.append(lane)
+        return classroom.format_direct_response("answer", "test")
+
+    async def stream_direct(user_message, conversation_history=None, lane="standard"):
+        lanes.append(lane)
+        yield "final", classroom.format_direct_response("answer", "test")
+
+    monkeypatch.setattr(main, "admission_controller", RecordingController(global_rate=0))
+    monkeypatch.setattr(classroom, "classify_query_details", classify)
+    monkeypatch.setattr(classroom, "_direct_gemini_response", direct)
+    monkeypatch.setattr(classroom, "_stream_direct_gemini_response", stream_direct)
+    # Complex messages fall back to the direct answer, which shows their lane
+    monkeypatch.setattr(classroom, "_accept_refinement", lambda refinement_data: False)
+
+    async def post() -> int:
+        transport = httpx.ASGITransport(app=main.app, client=("10.0.0.5", 40000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post(path, json={"user_message": message})
+            return response.status_code
+
+    assert asyncio.run(post()) == 200
+    assert admitted == [interactive]
+    assert lanes == [lane]
+    assert classified == [message]
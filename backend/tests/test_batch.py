@@ -0,0 +1,29 @@
+import asyncio
+
+import httpx
+
+import classroom
+import main
+
+
+def test_batch_items_keep_their_locale(monkeypatch):
+    replies = {
+        "en": {"greeting": ["Hello!"]},
+        "de": {"greeting": ["Hallo!"]},
+    }
+    monkeypatch.setattr(classroom.smalltalk_responder, "replies", replies)
+    monkeypatch.setattr(classroom.smalltalk_responder, "_rotations", {})
+
+    async def post() -> httpx.Response:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/api/v1/classroom/chat/batch", json={"items": [
+                {"user_message": "hi", "locale": "de", "user_id": "a"},
+                {"user_message": "hi", "locale": "en", "user_id": "b"},
+                {"user_message": "hi", "locale": "de-AT", "user_id": "c"},
+            ]})
+
+    response = asyncio.run(post())
+    assert response.status_code == 200
+    messages = [result["response"]["bot_message"] for result in response.json()["results"]]
+    assert messages == ["Hallo!", "Hello!", "Hallo!"]
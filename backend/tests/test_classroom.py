@@ -0,0 +1,38 @@
+import asyncio
+
+import classroom
+import refiner_agent
+
+
+def _speculate_and_count_sessions(monkeypatch) -> list:
+    monkeypatch.setattr(classroom.speculation_policy, "should_speculate", lambda confidence: True)
+    saved = []
+    original_save = refiner_agent.session_store.save
+
+    async def save(session):
+        saved.append(session.session_id)
+        await original_save(session)
+
+    monkeypatch.setattr(refiner_agent.session_store, "save", save)
+    return saved
+
+
+def test_speculative_refiner_win_stores_one_session(monkeypatch):
+    saved = _speculate_and_count_sessions(monkeypatch)
+
+    response = asyncio.run(classroom.generate_classroom_response("I want to learn organic chemistry"))
+
+    assert response["response_type"] == "refinement_needed"
+    assert saved == [response["refinement_data"]["session_id"]]
+
+
+def test_speculative_direct_win_leaves_no_session(monkeypatch):
+    saved = _speculate_and_count_sessions(monkeypatch)
+
+    # The refiner produces questions, but routing keeps the direct answer
+    monkeypatch.setattr(classroom, "_accept_refinement", lambda refinement_data: False)
+
+    response = asyncio.run(classroom.generate_classroom_response("How do I prepare for my history exam?"))
+
+    assert response["response_type"] == "direct_response"
+    assert saved == []
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import time
+
+from prometheus_client import REGISTRY
+
+from llm_cache import LLMResponseCache
+
+
+def _cache(**settings) -> LLMResponseCache:
+    settings.setdefault("name", "test")
+    return LLMResponseCache(backend="memory", enabled=True, **settings)
+
+
+def _counter(**values):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return {"version": len(calls), **values}
+
+    return compute, calls
+
+
+def test_expired_entries_are_recomputed():
+    cache = _cache(ttl_seconds=0.05, stale_seconds=0)
+    compute, calls = _counter()
+
+    async def run():
+        first = await cache.get_or_compute("k", compute)
+        cached = await cache.get_or_compute("k", compute)
+        await asyncio.sleep(0.06)
+        expired = await cache.get_or_compute("k", compute)
+        return first, cached, expired
+
+    assert asyncio.run(run()) == ({"version": 1}, {"version": 1}, {"version": 2})
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 2 and stats["expirations"] == 1
+
+
+def test_stale_entries_are_served_while_refreshing():
+    cache = _cache(ttl_seconds=0.05, stale_seconds=10)
+    compute, calls = _counter()
+
+    async def run():
+        await cache.get_or_compute("k", compute)
+        await asyncio.sleep(0.06)
+        stale = await cache.get_or_compute("k", compute)
+        await asyncio.gather(*cache._background_tasks)
+        refreshed = await cache.get_or_compute("k", compute)
+        return stale, refreshed
+
+    assert asyncio.run(run()) == ({"version": 1}, {"version": 2})
+    stats = cache.stats()
+    assert stats["stale_hits"] == 1 and stats["refreshes"] == 1 and stats["hits"] == 1
+
+
+def test_failed_refresh_keeps_the_stale_value():
+    cache = _cache(ttl_seconds=0.05, stale_seconds=10)
+
+    async def failing():
+        raise RuntimeError("upstream down")
+
+    async def run():
+        cache.set("k", {"version": 1})
+        await asyncio.sleep(0.06)
+        stale = await cache.get_or_compute("k", failing)
+        await asyncio.gather(*cache._background_tasks)
+        return stale
+
+    assert asyncio.run(run()) == {"version": 1}
+    assert cache.stats()["refresh_failures"] == 1
+
+
+def test_byte_cap_evicts_least_recently_used():
+    value = {"text": "x" * 100}
+    size = len(json.dumps(value))
+    cache = _cache(max_bytes=size * 2 + 10)
+
+    cache.set("a", value)
+    cache.set("b", value)
+    assert cache.get("a") == value  # "a" becomes most recently used
+    cache.set("c", value)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == value and cache.get("c") == value
+    assert cache.stats()["evictions"] == 1 and cache.stats()["bytes"] <= cache.max_bytes
+    # A value larger than the whole cache is not stored
+    cache.set("huge", {"text": "x" * size * 3})
+    assert cache.get("huge") is None
+
+
+def test_returned_values_are_private_copies():
+    cache = _cache()
+    original = {"suggestions": [{"text": "Beginner?"}]}
+
+    async def compute():
+        return original
+
+    async def run():
+        first = await cache.get_or_compute("k", compute)
+        first["suggestions"].append({"text": "mutated"})
+        original["suggestions"].clear()
+        return await cache.get_or_compute("k", compute)
+
+    assert asyncio.run(run()) == {"suggestions": [{"text": "Beginner?"}]}
+
+
+def test_counters_are_exported():
+    cache = _cache(name="test-metrics", max_entries=1)
+    compute, _ = _counter()
+
+    async def run():
+        await cache.get_or_compute("a", compute)
+        await cache.get_or_compute("a", compute)
+        await cache.get_or_compute("b", compute)
+
+    asyncio.run(run())
+
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, {"cache": "test-metrics", **labels})
+
+    assert sample("mahaguru_llm_cache_lookups_total", result="hit") == 1
+    assert sample("mahaguru_llm_cache_lookups_total", result="miss") == 2
+    assert sample("mahaguru_llm_cache_evictions_total", reason="lru") == 1
+    assert sample("mahaguru_llm_cache_entries") == 1
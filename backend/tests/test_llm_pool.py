@@ -0,0 +1,173 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import llm_client
+from llm_client import LLMConcurrencyPool
+
+
+def _pool(size: int, **lanes) -> LLMConcurrencyPool:
+    limits = {lane: (0, size) for lane in ("interactive", "standard", "refinement")}
+    limits.update(lanes)
+    return LLMConcurrencyPool(max_concurrency=size, lane_limits=limits)
+
+
+async def _hold(pool: LLMConcurrencyPool, lane: str, release: asyncio.Event, order: list, name: str) -> None:
+    async with pool.slot(lane):
+        order.append(name)
+        await release.wait()
+
+
+def test_pool_enforces_limit_and_reports_queue_depth():
+    pool = _pool(2)
+
+    async def run():
+        release = asyncio.Event()
+        order: list = []
+        tasks = [asyncio.create_task(_hold(pool, "standard", release, order, str(i))) for i in range(5)]
+        await asyncio.sleep(0.01)
+        during = pool.stats()
+        release.set()
+        await asyncio.gather(*tasks)
+        return during, order
+
+    during, order = asyncio.run(run())
+    assert during["in_flight"] == 2 and during["queue_depth"] == 3
+    assert during["lanes"]["standard"]["queue_depth"] == 3
+    assert order == ["0", "1", "2", "3", "4"]
+    stats = pool.stats()
+    assert stats["peak_in_flight"] == 2 and stats["peak_queue_depth"] == 3
+    assert stats["in_flight"] == 0 and stats["queue_depth"] == 0 and stats["total_calls"] == 5
+
+
+def test_reserved_interactive_slot_is_not_used_by_other_lanes():
+    pool = _pool(2, interactive=(1, 2))
+
+    async def run():
+        release = asyncio.Event()
+        order: list = []
+        refinement = [asyncio.create_task(_hold(pool, "refinement", release, order, f"r{i}")) for i in range(2)]
+        await asyncio.sleep(0.01)
+        interactive = asyncio.create_task(_hold(pool, "interactive", release, order, "i"))
+        await asyncio.sleep(0.01)
+        started = list(order)
+        release.set()
+        await asyncio.gather(*refinement, interactive)
+        return started
+
+    # The second refinement call waits; the interactive one starts at once
+    assert asyncio.run(run()) == ["r0", "i"]
+
+
+def test_freed_slot_goes_to_the_highest_priority_lane():
+    pool = _pool(1)
+
+    async def run():
+        first = asyncio.Event()
+        order: list = []
+        holder = asyncio.create_task(_hold(pool, "standard", first, order, "holder"))
+        await asyncio.sleep(0.01)
+        release = asyncio.Event()
+        waiting = [
+            asyncio.create_task(_hold(pool, "refinement", release, order, "refinement")),
+            asyncio.create_task(_hold(pool, "interactive", release, order, "interactive")),
+        ]
+        await asyncio.sleep(0.01)
+        first.set()
+        release.set()
+        await asyncio.gather(holder, *waiting)
+        return order
+
+    assert asyncio.run(run()) == ["holder", "interactive", "refinement"]
+
+
+def test_lane_maximum_caps_a_lane():
+    pool = _pool(4, refinement=(0, 1))
+
+    async def run():
+        release = asyncio.Event()
+        order: list = []
+        tasks = [asyncio.create_task(_hold(pool, "refinement", release, order, str(i))) for i in range(3)]
+        await asyncio.sleep(0.01)
+        lane = pool.stats()["lanes"]["refinement"]
+        release.set()
+        await asyncio.gather(*tasks)
+        return lane
+
+    lane = asyncio.run(run())
+    assert lane["in_flight"] == 1 and lane["queue_depth"] == 2
+    assert pool.peak_in_flight == 1
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    pool = _pool(1)
+
+    async def run():
+        release = asyncio.Event()
+        order: list = []
+        holder = asyncio.create_task(_hold(pool, "standard", release, order, "holder"))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(_hold(pool, "standard", release, order, "waiter"))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        depth = pool.waiting
+        release.set()
+        await holder
+        return depth
+
+    assert asyncio.run(run()) == 0
+    assert pool.in_flight == 0
+
+
+def _gemini_reply(text: str) -> dict:
+    return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+
+
+def test_sdk_requests_share_one_pooled_http_client(monkeypatch):
+    from google import genai
+
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if "streamGenerateContent" in request.url.path:
+            body = "".join(f"data: {json.dumps(_gemini_reply(t))}\r\n\r\n" for t in ("Hel", "lo"))
+            return httpx.Response(200, content=body.encode(), headers={"content-type": "text/event-stream"})
+        return httpx.Response(200, json=_gemini_reply("Hello"))
+
+    created = []
+
+    def new_client() -> httpx.AsyncClient:
+        created.append(1)
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    monkeypatch.setattr(llm_client, "_new_async_http_client", new_client)
+    client = genai.Client(api_key="test-key", http_options=llm_client._build_http_options())
+    llm_client._use_shared_async_pool(client)
+
+    async def run():
+        first = await client.aio.models.generate_content(model="gemini-2.0-flash-001", contents="hi")
+        second = await client.aio.models.generate_content(model="gemini-2.0-flash-001", contents="hi again")
+        chunks = [c.text async for c in await client.aio.models.generate_content_stream(model="gemini-2.0-flash-001", contents="hi")]
+        return first.text, second.text, chunks
+
+    assert asyncio.run(run()) == ("Hello", "Hello", ["Hel", "lo"])
+    assert len(requests) == 3 and len(created) == 1
+    assert requests[0].headers["x-goog-api-key"] == "test-key"
+
+
+def test_sdk_errors_are_raised_through_the_shared_client(monkeypatch):
+    from google import genai
+    from google.genai import errors
+
+    monkeypatch.setattr(llm_client, "_new_async_http_client", lambda: httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(503, json={"error": {"code": 503, "message": "busy"}}))
+    ))
+    client = genai.Client(api_key="test-key", http_options=llm_client._build_http_options())
+    llm_client._use_shared_async_pool(client)
+
+    with pytest.raises(errors.ServerError):
+        asyncio.run(client.aio.models.generate_content(model="gemini-2.0-flash-001", contents="hi"))
@@ -0,0 +1,94 @@
+import asyncio
+
+import classroom
+from refiner_agent import semantic_cache
+from refinement_table import (
+    TABLE_FORMAT, RefinementTable, build_table, current_version, read_artifact, write_artifact
+)
+
+QUERY = "I want to learn machine learning"
+DATA = {
+    "needs_refinement": True,
+    "suggestions": [{"question_id": "q_1", "text": "Do you know Python already?", "adds": "background"}],
+    "reasoning": "Background is unclear",
+}
+
+
+def _write_table(path, **extra_entries) -> None:
+    prompt_version, model = current_version()
+    entries = {
+        "i want to learn machine learning": {"count": 3, "prompt_version": prompt_version, "model": model, "data": DATA},
+        **extra_entries,
+    }
+    write_artifact(str(path), {"format": TABLE_FORMAT, "built_at": "2024-01-01T00:00:00", "entries": entries})
+
+
+def test_lookup_matches_normalized_queries_and_drops_stale_entries(tmp_path):
+    path = tmp_path / "table.json"
+    stale = {"count": 1, "prompt_version": "old", "model": "other", "data": DATA}
+    _write_table(path, **{"teach me calculus": stale})
+    table = RefinementTable(str(path), enabled=True)
+
+    assert len(table) == 1 and table.stale_entries == 1
+    assert table.lookup("  I want to learn Machine Learning!") == DATA
+    assert table.lookup("Teach me calculus") is None
+    assert table.stats()["absorbed_ratio"] == 0.5
+
+
+def test_lookup_returns_private_copies(tmp_path):
+    path = tmp_path / "table.json"
+    _write_table(path)
+    table = RefinementTable(str(path), enabled=True)
+
+    first = table.lookup(QUERY)
+    first["suggestions"][0]["text"] = "mutated"
+    first["session_id"] = "abc"
+
+    assert table.lookup(QUERY) == DATA
+
+
+def test_missing_or_disabled_table_serves_nothing(tmp_path):
+    path = tmp_path / "table.json"
+    assert RefinementTable(str(path), enabled=True).lookup(QUERY) is None
+    _write_table(path)
+    assert RefinementTable(str(path), enabled=False).lookup(QUERY) is None
+
+
+def test_classroom_serves_table_hits_without_the_refiner(tmp_path, monkeypatch):
+    path = tmp_path / "table.json"
+    _write_table(path)
+    table = RefinementTable(str(path), enabled=True)
+    monkeypatch.setattr(classroom, "refinement_table", table)
+
+    async def no_llm(*args, **kwargs):
+        raise AssertionError("table hits must not reach the refiner")
+
+    monkeypatch.setattr(classroom, "refine_query", no_llm)
+
+    response = asyncio.run(classroom.generate_classroom_response(QUERY))
+    refinement = response["refinement_data"]
+    assert response["response_type"] == "refinement_needed"
+    assert refinement["suggestions"] == DATA["suggestions"]
+    assert refinement["original_query"] == QUERY and refinement["session_id"]
+    # Per-request fields never leak into the shared entry
+    assert table.lookup(QUERY) == DATA
+
+
+def test_build_table_keeps_frequent_complex_queries(tmp_path, monkeypatch):
+    # build_table turns the semantic cache off; restore it for the other tests
+    monkeypatch.setattr(semantic_cache, "enabled", semantic_cache.enabled)
+
+    log = tmp_path / "queries.log"
+    log.write_text("\n".join([QUERY, QUERY.lower() + "?", "hello", "I want to learn organic chemistry"]), encoding="utf-8")
+    output = tmp_path / "table.json"
+
+    report = asyncio.run(build_table(str(log), str(output), top_n=1))
+    assert report["candidates"] == 1 and report["built"] == 1 and report["coverage"] == 0.5
+
+    entries = read_artifact(str(output))["entries"]
+    assert list(entries) == ["i want to learn machine learning"]
+    assert "session_id" not in entries["i want to learn machine learning"]["data"]
+
+    # A rebuild for the same prompt version and model reuses the entry
+    report = asyncio.run(build_table(str(log), str(output), top_n=1))
+    assert report["reused"] == 1 and report["built"] == 0
@@ -0,0 +1,24 @@
+import asyncio
+
+from prometheus_client import REGISTRY
+
+import refiner_agent
+
+
+def test_finalization_latency_is_exported_by_path():
+    def finalized() -> float:
+        value = REGISTRY.get_sample_value(
+            "mahaguru_refiner_finalization_duration_seconds_count",
+            {"path": refiner_agent.REFINER_FINALIZE_MODE},
+        )
+        return value or 0.0
+
+    async def run() -> dict:
+        first = await refiner_agent.refine_query("I want to learn python")
+        answers = [{"question_id": s["question_id"], "answer": "yes"} for s in first["suggestions"]]
+        return await refiner_agent.continue_refinement(None, answers, first["session_id"])
+
+    before = finalized()
+    result = asyncio.run(run())
+    assert result["needs_refinement"] is False and result["final_package"]
+    assert finalized() == before + 1
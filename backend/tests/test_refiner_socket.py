@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+from starlette.testclient import TestClient
+
+import main
+import refiner_socket
+from admission import AdmissionController
+from classroom import format_direct_response
+
+# starlette 0.27 builds its TestClient on the deprecated httpx app shortcut
+pytestmark = pytest.mark.filterwarnings("ignore:The 'app' shortcut:DeprecationWarning")
+
+WS_PATH = "/api/v1/refiner/ws"
+COMPLEX_QUERY = "I want to learn data structures for my exams"
+SIMPLE_QUERY = "What is photosynthesis?"
+
+
+@pytest.fixture
+def client(monkeypatch) -> TestClient:
+    monkeypatch.setattr(refiner_socket, "admission_controller", AdmissionController(global_rate=0))
+    return TestClient(main.app)
+
+
+def _answers(suggestions) -> list:
+    return [{"question_id": s["question_id"], "answer": "yes"} for s in suggestions]
+
+
+def test_refine_then_finalize_on_one_connection(client):
+    with client.websocket_connect(WS_PATH) as ws:
+        ws.send_json({"type": "start", "user_message": COMPLEX_QUERY})
+        frame = ws.receive_json()
+        assert frame["type"] == "response"
+        refinement = frame["data"]["refinement_data"]
+        assert refinement["needs_refinement"] and refinement["session_id"]
+
+        # The session id is remembered by the connection
+        ws.send_json({"type": "answers", "answers": _answers(refinement["suggestions"])})
+        frame = ws.receive_json()
+        assert frame["type"] == "final"
+        assert frame["data"]["needs_refinement"] is False
+        assert frame["data"]["final_package"]["original_query"] == COMPLEX_QUERY
+
+
+def test_resume_on_a_new_connection_continues_the_session(client):
+    with client.websocket_connect(WS_PATH) as ws:
+        ws.send_json({"type": "start", "user_message": "Teach me organic chemistry from scratch"})
+        refinement = ws.receive_json()["data"]["refinement_data"]
+
+    with client.websocket_connect(WS_PATH) as ws:
+        ws.send_json({"type": "resume", "session_id": refinement["session_id"]})
+        frame = ws.receive_json()
+        assert frame["type"] == "suggestions"
+        assert frame["data"]["suggestions"] == refinement["suggestions"]
+
+        ws.send_json({"type": "answers", "answers": _answers(frame["data"]["suggestions"])})
+        assert ws.receive_json()["type"] == "final"
+
+        # The finished session is gone
+        ws.send_json({"type": "resume", "session_id": refinement["session_id"]})
+        assert ws.receive_json()["code"] == "session_not_found"
+
+
+def test_simple_message_gets_a_direct_response(client):
+    with client.websocket_connect(WS_PATH) as ws:
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json() == {"type": "pong"}
+        ws.send_json({"type": "start", "user_message": SIMPLE_QUERY})
+        frame = ws.receive_json()
+        assert frame["type"] == "response"
+        assert frame["data"]["response_type"] == "direct_response"
+
+
+@pytest.mark.parametrize("frame, code", [
+    ("not json", "invalid_message"),
+    ('{"type": "dance"}', "invalid_message"),
+    ('{"type": "start"}', "invalid_message"),
+    ('{"type": "resume"}', "invalid_message"),
+    ('{"type": "answers", "answers": []}', "session_not_found"),
+    ('{"type": "resume", "session_id": "missing"}', "session_not_found"),
+    ('{"type": "answers", "session_id": "missing", "answers": [{"question_id": "q_1", "answer": "x"}]}',
+     "session_not_found"),
+])
+def test_invalid_frames_get_error_frames_and_keep_the_connection(client, frame, code):
+    with client.websocket_connect(WS_PATH) as ws:
+        ws.send_text(frame)
+        error = ws.receive_json()
+        assert error["type"] == "error" and error["code"] == code
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json() == {"type": "pong"}
+
+
+def test_second_message_while_busy_is_rejected(client, monkeypatch):
+    async def slow_response(user_message, **kwargs):
+        await asyncio.sleep(0.3)
+        return format_direct_response("done", "test")
+
+    monkeypatch.setattr(refiner_socket, "generate_classroom_response", slow_response)
+    with client.websocket_connect(WS_PATH) as ws:
+        ws.send_json({"type": "start", "user_message": SIMPLE_QUERY})
+        ws.send_json({"type": "start", "user_message": "Define gravity"})
+        assert ws.receive_json()["code"] == "busy"
+        frame = ws.receive_json()
+        assert frame["type"] == "response" and frame["data"]["bot_message"] == "done"
+
+
+def test_rejected_admission_and_internal_errors(client, monkeypatch):
+    monkeypatch.setattr(
+        refiner_socket, "admission_controller", AdmissionController(user_rate=0.001, user_burst=1, global_rate=0)
+    )
+
+    async def failing_response(user_message, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(refiner_socket, "generate_classroom_response", failing_response)
+    with client.websocket_connect(WS_PATH) as ws:
+        ws.send_json({"type": "start", "user_message": SIMPLE_QUERY})
+        error = ws.receive_json()
+        assert error["code"] == "internal_error" and "boom" not in error["detail"]
+
+        ws.send_json({"type": "start", "user_message": SIMPLE_QUERY})
+        error = ws.receive_json()
+        assert error["code"] == "throttled" and error["retry_after"] >= 1
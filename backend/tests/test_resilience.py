@@ -0,0 +1,154 @@
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+
+from llm_client import LLMConcurrencyPool
+from llm_providers import FakeProviderError, StageRoute
+from resilience import LLM_HEDGE_MIN_SAMPLES, CircuitOpenError, ResiliencePolicy, ResilientCaller
+
+ROUTE = StageRoute(stage="refine", provider="fake", model="test-model", temperature=0.3, max_output_tokens=500)
+
+
+def _caller(**overrides) -> ResilientCaller:
+    settings = dict(
+        timeout_seconds=1.0, max_attempts=3, retry_base_delay=0.001, retry_max_delay=0.001,
+        hedge_enabled=False, hedge_percentile=95, hedge_min_delay=0.05,
+    )
+    settings.update(overrides)
+    caller = ResilientCaller()
+    caller._policies[ROUTE.stage] = ResiliencePolicy(**settings)
+    return caller
+
+
+def _pool(size: int) -> LLMConcurrencyPool:
+    return LLMConcurrencyPool(max_concurrency=size, lane_limits={
+        "interactive": (0, size), "standard": (0, size), "refinement": (0, size)
+    })
+
+
+def test_transient_errors_are_retried():
+    caller = _caller()
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise FakeProviderError("upstream hiccup")
+        return "ok"
+
+    assert asyncio.run(caller.call(ROUTE, flaky)) == "ok"
+    stats = caller.stats()["stages"]["refine"]
+    assert stats["retries"] == 2 and stats["failures"] == 0
+    assert caller.breaker(ROUTE).state == "closed"
+
+
+def test_non_transient_errors_are_not_retried():
+    caller = _caller()
+    calls = []
+
+    async def bad_request():
+        calls.append(1)
+        raise ValueError("invalid prompt")
+
+    with pytest.raises(ValueError):
+        asyncio.run(caller.call(ROUTE, bad_request))
+    assert len(calls) == 1
+    assert caller.breaker(ROUTE).consecutive_failures == 0
+
+
+def test_breaker_opens_after_consecutive_failures_and_fast_fails():
+    caller = _caller(max_attempts=1)
+    breaker = caller.breaker(ROUTE)
+    breaker.failure_threshold = 2
+
+    async def down():
+        raise FakeProviderError("503")
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(FakeProviderError):
+                await caller.call(ROUTE, down)
+        with pytest.raises(CircuitOpenError):
+            await caller.call(ROUTE, down)
+
+    asyncio.run(run())
+    assert breaker.state == "open"
+    assert caller.stats()["stages"]["refine"]["fast_failed"] == 1
+
+
+def test_slow_primary_is_hedged():
+    caller = _caller(hedge_enabled=True, hedge_min_delay=0.02)
+    for _ in range(LLM_HEDGE_MIN_SAMPLES):
+        caller._stage_stats(ROUTE.stage).latency.record(0.01)
+    calls = []
+
+    async def first_slow():
+        calls.append(1)
+        await asyncio.sleep(0.5 if len(calls) == 1 else 0.01)
+        return len(calls)
+
+    assert asyncio.run(caller.call(ROUTE, first_slow)) == 2
+    stats = caller.stats()["stages"]["refine"]
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+
+
+def test_saturated_pool_does_not_time_out_or_open_the_breaker():
+    # Two slots, eight callers and a 200 ms upstream: queueing takes far longer
+    # than the 300 ms timeout, but each upstream call fits in it
+    caller = _caller(timeout_seconds=0.3, max_attempts=1)
+    pool = _pool(2)
+
+    async def upstream():
+        await asyncio.sleep(0.2)
+        return "ok"
+
+    async def run():
+        return await asyncio.gather(*[caller.call(ROUTE, upstream, pool=pool) for _ in range(8)])
+
+    assert asyncio.run(run()) == ["ok"] * 8
+    stats = caller.stats()["stages"]["refine"]
+    assert stats["timeouts"] == 0
+    assert caller.breaker(ROUTE).state == "closed"
+    assert pool.peak_in_flight == 2 and pool.peak_waiting == 6
+    # Latency samples hold upstream time only, not the queue wait
+    assert caller._stage_stats(ROUTE.stage).latency.percentile(100) < 0.3
+
+
+def test_hedge_is_skipped_when_pool_is_saturated():
+    caller = _caller(hedge_enabled=True, hedge_min_delay=0.02)
+    for _ in range(LLM_HEDGE_MIN_SAMPLES):
+        caller._stage_stats(ROUTE.stage).latency.record(0.01)
+    pool = _pool(1)
+
+    async def upstream():
+        await asyncio.sleep(0.1)
+        return "ok"
+
+    assert asyncio.run(caller.call(ROUTE, upstream, pool=pool)) == "ok"
+    stats = caller.stats()["stages"]["refine"]
+    assert stats["hedges"] == 0 and stats["hedges_skipped"] == 1
+
+
+def test_retries_hedges_and_breaker_state_are_exported():
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0.0
+
+    route = StageRoute(stage="finalize", provider="fake", model="metrics-model", temperature=0.3, max_output_tokens=800)
+    caller = ResilientCaller()
+    caller._policies[route.stage] = ResiliencePolicy(
+        timeout_seconds=1.0, max_attempts=2, retry_base_delay=0.001, retry_max_delay=0.001,
+        hedge_enabled=False, hedge_percentile=95, hedge_min_delay=0.05,
+    )
+    caller.breaker(route).failure_threshold = 2
+    retries_before = sample("mahaguru_llm_retries_total", stage="finalize", model="metrics-model")
+
+    async def down():
+        raise FakeProviderError("503")
+
+    with pytest.raises(FakeProviderError):
+        asyncio.run(caller.call(route, down))
+
+    assert sample("mahaguru_llm_retries_total", stage="finalize", model="metrics-model") == retries_before + 1
+    assert sample("mahaguru_llm_breaker_state", breaker="fake:metrics-model") == 2
+    assert sample("mahaguru_llm_breaker_opened_total", breaker="fake:metrics-model") >= 1
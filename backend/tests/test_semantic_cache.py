@@ -0,0 +1,43 @@
+import pytest
+
+from semantic_cache import SemanticCache
+
+
+def _cache_with(query: str) -> SemanticCache:
+    cache = SemanticCache(name="test", version="v1", path="", enabled=True)
+    cache.add(query, {"original_query": query})
+    return cache
+
+
+@pytest.mark.parametrize("stored, query", [
+    ("I want to learn machine learning", "I want to learn ML"),
+    ("Can you teach me data structures and algorithms for interviews",
+     "teach me data structures and algorithms for interviews please"),
+    ("I want to learn machine learning with python for my final year college project",
+     "I want to learn ML with Python for my final year college project"),
+])
+def test_paraphrases_hit(stored, query):
+    assert _cache_with(stored).lookup(query) == {"original_query": stored}
+
+
+@pytest.mark.parametrize("stored, query", [
+    ("I want to learn C", "I want to learn C++"),
+    ("I want to learn C", "I want to learn C#"),
+    ("I want to learn C++", "I want to learn C#"),
+    ("learn .NET", "learn net"),
+    ("learn ML", "teach me machine learning"),
+    ("learn python", "learn java"),
+    ("I want to learn machine learning with python for my final year college project",
+     "I want to learn machine learning with java for my final year college project"),
+    ("I want to learn data structures and algorithms in C",
+     "I want to learn data structures and algorithms in Java"),
+    ("engineering mathematics 2 syllabus for SPPU", "engineering mathematics 3 syllabus for SPPU"),
+])
+def test_near_miss_pairs_do_not_hit(stored, query):
+    assert _cache_with(stored).lookup(query) is None
+
+
+def test_closest_row_about_another_topic_does_not_hide_a_match():
+    cache = _cache_with("engineering mathematics 2 syllabus for SPPU")
+    cache.add("engineering mathematics 3 syllabus SPPU", {"original_query": "m3"})
+    assert cache.lookup("engineering mathematics 3 syllabus for SPPU") == {"original_query": "m3"}
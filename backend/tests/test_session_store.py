@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+import shared_state
+from session_store import InMemorySessionStore, RefinementSession, SharedSessionStore
+from shared_state import RedisKV, SharedKV, SQLiteKV
+
+
+class _WorkerStore(SharedSessionStore):
+    """Shared session store on its own connection, standing in for one worker process."""
+
+    def __init__(self, kv: SharedKV, ttl_seconds: float = 60):
+        super().__init__(kv.backend_name, ttl_seconds=ttl_seconds)
+        self._worker_kv = kv
+
+    @property
+    def _kv(self) -> SharedKV:
+        return self._worker_kv
+
+
+def _session(query: str = "I want to learn Python") -> RefinementSession:
+    session = RefinementSession.new(query)
+    session.ask(
+        [{"question_id": "q_1", "text": "Beginner or advanced?"}, {"question_id": "q_2", "text": "Für Prüfungen?"}],
+        "Level and goal are unclear",
+    )
+    return session
+
+
+async def _assert_round_trip(store) -> None:
+    session = _session()
+    await store.save(session)
+    loaded = await store.get(session.session_id)
+    assert loaded.pending_questions["q_2"]["text"] == "Für Prüfungen?"
+
+    loaded.record_answers([{"question_id": "q_1", "answer": "beginner"}])
+    await store.save(loaded)
+    loaded = await store.get(session.session_id)
+    assert loaded.original_query == session.original_query
+    assert loaded.rounds == 1 and loaded.reasoning == ["Level and goal are unclear"]
+    assert loaded.pending_questions == {}
+    assert loaded.conversation_history == [
+        {"question_id": "q_1", "question": "Beginner or advanced?", "answer": "beginner"}
+    ]
+
+
+async def _assert_expires(store) -> None:
+    session = _session("Teach me calculus")
+    await store.save(session)
+    assert await store.get(session.session_id) is not None
+    await asyncio.sleep(store.ttl_seconds + 0.05)
+    assert await store.get(session.session_id) is None
+
+
+def test_sqlite_session_round_trip_expiry_and_delete(tmp_path):
+    kv = SQLiteKV(str(tmp_path / "state.sqlite3"))
+    store = _WorkerStore(kv)
+    deleted = _session("Explain recursion")
+
+    async def run():
+        await _assert_round_trip(store)
+        await _assert_expires(_WorkerStore(kv, ttl_seconds=0.05))
+        await store.save(deleted)
+        await store.delete(deleted.session_id)
+        assert await store.get(deleted.session_id) is None
+
+    asyncio.run(run())
+    assert store.stats() == {"backend": "sqlite", "hits": 2, "misses": 1}
+
+
+def test_sqlite_sessions_are_shared_between_workers(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    workers = [_WorkerStore(SQLiteKV(path)), _WorkerStore(SQLiteKV(path))]
+    sessions = [_session(f"Query {i}") for i in range(40)]
+
+    async def run():
+        # Interleaved writes through both connections, then reads through the other one
+        await asyncio.gather(*(workers[i % 2].save(session) for i, session in enumerate(sessions)))
+        return await asyncio.gather(*(
+            workers[(i + 1) % 2].get(session.session_id) for i, session in enumerate(sessions)
+        ))
+
+    loaded = asyncio.run(run())
+    assert [session.original_query for session in loaded] == [f"Query {i}" for i in range(40)]
+
+
+def test_memory_session_round_trip_expiry_and_cap():
+    asyncio.run(_assert_round_trip(InMemorySessionStore()))
+    asyncio.run(_assert_expires(InMemorySessionStore(ttl_seconds=0.05)))
+
+    store = InMemorySessionStore(max_entries=2)
+    sessions = [_session(query) for query in ("a", "b", "c")]
+
+    async def run():
+        for session in sessions:
+            await store.save(session)
+        return [await store.get(session.session_id) for session in sessions]
+
+    evicted, *kept = asyncio.run(run())
+    assert evicted is None and all(kept)
+    assert store.stats()["evictions"] == 1 and store.stats()["sessions"] == 2
+
+
+def test_redis_session_round_trip_and_expiry():
+    redis = pytest.importorskip("redis")
+    try:
+        redis.Redis.from_url(shared_state.STATE_REDIS_URL).ping()
+    except redis.RedisError:
+        pytest.skip("no Redis server at STATE_REDIS_URL")
+
+    async def run():
+        kv = RedisKV()
+        await _assert_round_trip(_WorkerStore(kv))
+        await _assert_expires(_WorkerStore(kv, ttl_seconds=0.05))
+
+    asyncio.run(run())
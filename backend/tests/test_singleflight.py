@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+
+import llm_client
+from llm_providers import StageRoute
+from singleflight import SingleFlight
+
+
+def test_concurrent_identical_calls_share_one_execution():
+    flight = SingleFlight("test-coalesce")
+    executions = []
+
+    async def call():
+        executions.append(1)
+        await asyncio.sleep(0.02)
+        return {"answer": 42}
+
+    async def run():
+        return await asyncio.gather(*[flight.do("key", call) for _ in range(5)])
+
+    results = asyncio.run(run())
+    assert results == [{"answer": 42}] * 5
+    assert len(executions) == 1
+    stats = flight.stats()
+    assert stats["executions"] == 1 and stats["coalesced"] == 4 and stats["coalescing_ratio"] == 0.8
+    assert REGISTRY.get_sample_value("mahaguru_singleflight_calls_total", {"name": "test-coalesce"}) == 5
+    assert REGISTRY.get_sample_value("mahaguru_singleflight_coalesced_total", {"name": "test-coalesce"}) == 4
+    assert REGISTRY.get_sample_value("mahaguru_singleflight_executions_total", {"name": "test-coalesce"}) == 1
+
+
+def test_errors_reach_every_follower():
+    flight = SingleFlight("test-errors")
+
+    async def call():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream failed")
+
+    async def run():
+        return await asyncio.gather(*[flight.do("key", call) for _ in range(3)], return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    # The failed flight is forgotten, so the next call runs again
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    flight = SingleFlight("test-leader")
+
+    async def call():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def run():
+        leader = asyncio.create_task(flight.do("key", call))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("key", call))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == "done"
+    assert flight.stats()["abandoned"] == 0
+
+
+def test_execution_is_cancelled_when_every_caller_leaves():
+    flight = SingleFlight("test-abandon")
+    cancelled = []
+
+    async def call():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def run():
+        callers = [asyncio.create_task(flight.do("key", call)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert cancelled == [1]
+    assert flight.stats()["abandoned"] == 1 and flight.stats()["in_flight"] == 0
+
+
+def test_request_key_separates_stages_and_lanes():
+    direct = StageRoute(stage="classroom_direct", provider="fake", model="m", temperature=0.7, max_output_tokens=1000)
+    refine = StageRoute(stage="refine", provider="fake", model="m", temperature=0.7, max_output_tokens=1000)
+
+    key = llm_client._request_key(direct, "prompt", None, "interactive")
+    assert key == llm_client._request_key(direct, "prompt", None, "interactive")
+    assert key != llm_client._request_key(direct, "prompt", None, "standard")
+    assert key != llm_client._request_key(refine, "prompt", None, "interactive")
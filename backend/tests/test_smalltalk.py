@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+import classroom
+from classroom import classify_query_details
+from smalltalk import SMALLTALK_SOURCE, SmallTalkResponder
+
+REPLIES = {
+    "en": {"greeting": ["Hello!", "Hi there!"], "thanks": ["You're welcome!"]},
+    "de": {"greeting": ["Hallo!"]},
+}
+
+
+def _reply(responder: SmallTalkResponder, message: str, locale=None):
+    return responder.reply(message, classify_query_details(message), locale)
+
+
+def test_greetings_are_answered_locally_in_rotation():
+    responder = SmallTalkResponder(replies=REPLIES, enabled=True)
+
+    assert [_reply(responder, "hi") for _ in range(3)] == ["Hello!", "Hi there!", "Hello!"]
+    assert _reply(responder, "Hi, thanks so much!") == "You're welcome!"
+    assert responder.stats()["by_intent"] == {"greeting": 3, "thanks": 1}
+
+
+@pytest.mark.parametrize("message", [
+    "hi, what is a derivative?",
+    "hello can you explain recursion",
+    "which theorem proves this",  # "hi" only as a substring
+    "hi hi hi hi hi hi hi hi hi",  # longer than SMALLTALK_MAX_WORDS
+])
+def test_messages_with_a_request_reach_the_llm(message):
+    assert _reply(SmallTalkResponder(replies=REPLIES, enabled=True), message) is None
+
+
+def test_locale_falls_back_to_language_then_default():
+    responder = SmallTalkResponder(replies=REPLIES, default_locale="en", enabled=True)
+
+    assert _reply(responder, "hello", "de-AT") == "Hallo!"
+    assert _reply(responder, "hello", "fr") == "Hello!"
+    # German has no 'thanks' set, so English answers
+    assert _reply(responder, "thank you", "de") == "You're welcome!"
+
+
+def test_disabled_responder_declines():
+    assert _reply(SmallTalkResponder(replies=REPLIES, enabled=False), "hi") is None
+
+
+def test_classroom_short_circuits_small_talk(monkeypatch):
+    monkeypatch.setattr(classroom, "smalltalk_responder", SmallTalkResponder(replies=REPLIES, enabled=True))
+
+    async def no_llm(*args, **kwargs):
+        raise AssertionError("small talk must not reach the LLM")
+
+    monkeypatch.setattr(classroom, "_direct_gemini_response", no_llm)
+
+    response = asyncio.run(classroom.generate_classroom_response("Hello there!"))
+    assert response["response_type"] == "direct_response"
+    assert response["source"] == SMALLTALK_SOURCE
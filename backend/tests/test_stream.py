@@ -0,0 +1,50 @@
+import asyncio
+import json
+
+import httpx
+
+import llm_client
+from llm_providers import FakeProvider, FakeProviderError, FakeResponse
+import main
+
+
+class MidStreamFailureProvider(FakeProvider):
+    """Sends two chunks, then fails as a dropped connection would."""
+
+    async def stream(self, route, contents, config=None):
+        yield FakeResponse(text="Recursion is")
+        yield FakeResponse(text=" when a function")
+        raise FakeProviderError("connection reset")
+
+
+def _stream(message: str):
+    async def post() -> httpx.Response:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/api/v1/classroom/chat/stream", json={"user_message": message})
+
+    response = asyncio.run(post())
+    assert response.status_code == 200
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_mid_stream_failure_ends_with_error_not_final(monkeypatch):
+    monkeypatch.setitem(llm_client.providers, "fake", MidStreamFailureProvider())
+
+    events = _stream("what is recursion")
+
+    assert [event for event, _ in events] == ["token", "token", "error"]
+    assert events[-1][1]["partial"] is True
+
+
+def test_complete_stream_ends_with_final():
+    events = _stream("what is recursion")
+    assert events[-1][0] == "final"
+    assert events[-1][1]["success"] is True
+    # Answered by the fake provider, and labelled as such
+    assert events[-1][1]["source"].startswith("fake:")
+    assert "error" not in [event for event, _ in events]
@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+from studentgpt import MicroBatchScheduler, PlaceholderModel, StudentGPTModel
+
+
+class BrokenModel(StudentGPTModel):
+    name = "broken"
+
+    def load(self) -> None:
+        raise OSError("weights not found")
+
+
+def test_load_failure_falls_back_to_placeholder():
+    async def run():
+        scheduler = MicroBatchScheduler(BrokenModel())
+        await scheduler.start()
+        try:
+            reply = await scheduler.submit("what is entropy")
+        finally:
+            await scheduler.stop()
+        return scheduler, reply
+
+    scheduler, reply = asyncio.run(run())
+    assert isinstance(scheduler.model, PlaceholderModel)
+    assert "entropy" in reply
+    assert scheduler.stats()["load_error"] == "weights not found"
+
+
+def test_placeholder_skips_batch_window():
+    async def run():
+        scheduler = MicroBatchScheduler(PlaceholderModel(), batch_window_ms=2000)
+        await scheduler.start()
+        try:
+            started = time.perf_counter()
+            await scheduler.submit("hello")
+            return time.perf_counter() - started
+        finally:
+            await scheduler.stop()
+
+    assert asyncio.run(run()) < 1.0
+
+
+def test_stop_shuts_down_executor_and_restart_works():
+    async def run():
+        scheduler = MicroBatchScheduler(PlaceholderModel())
+        await scheduler.start()
+        executor = scheduler._executor
+        await scheduler.stop()
+        assert executor._shutdown
+        await scheduler.start()
+        try:
+            return await scheduler.submit("again")
+        finally:
+            await scheduler.stop()
+
+    assert "again" in asyncio.run(run())
@@ -130,7 +130,7 @@ const ClassroomPage = () => {
     setError(null);
     
     try {
-      const response = await continueRefinement(originalQuery, answers);
+      const response = await continueRefinement(originalQuery, answers, refinementData.session_id);
       
       if (response.needs_refinement && refinementRound < MAX_REFINEMENT_ROUNDS) {
         // Continue refinement with new questions
@@ -51,14 +51,16 @@ export const refineQuery = async (originalQuery: string): Promise<ClassroomChatR
 
 export const continueRefinement = async (
   originalQuery: string, 
-  answers: UserAnswer[]
+  answers: UserAnswer[],
+  sessionId?: string
 ): Promise<ContinueRefinementResponse> => {
   try {
     const response = await axios.post<ContinueRefinementResponse>(
       '/api/v1/refiner/continue',
       { 
         original_query: originalQuery,
-        answers: answers
+        answers: answers,
+        session_id: sessionId
       } as ContinueRefinementRequest,
       { timeout: 10000 }
     );
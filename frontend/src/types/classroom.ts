@@ -34,6 +34,7 @@ export interface RefinementData {
   suggestions: RefinementSuggestion[];
   reasoning: string;
   original_query: string;
+  session_id?: string;
 }
 
 // Multi-turn Refinement Types
@@ -43,8 +44,9 @@ export interface UserAnswer {
 }
 
 export interface ContinueRefinementRequest {
-  original_query: string;
+  original_query?: string;
   answers: UserAnswer[];
+  session_id?: string;
 }
 
 export interface ContinueRefinementResponse {
@@ -53,6 +55,7 @@ export interface ContinueRefinementResponse {
   reasoning: string;
   original_query: string;
   final_package?: FinalRefinementPackage;
+  session_id?: string;
 }
 
 // Final Refinement Package Types